@@ -1,13 +1,10 @@
 from __future__ import absolute_import
 import os
+import sys
 
-#from osconf import config_from_environment
+from ._version import __version__ as VERSION
 
-try:
-    VERSION = __import__('pkg_resources') \
-        .get_distribution(__name__).version
-except Exception as e:
-    VERSION = 'unknown'
+#from osconf import config_from_environment
 
 
 _ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -16,5 +13,21 @@ _ROOT = os.path.abspath(os.path.dirname(__file__))
 def get_data(path):
     return os.path.join(_ROOT, 'data', path)
 
-from . import mongotimecurve
-from . import resource 
+
+# Submodules pull pymongo, numpy... so they are imported on first access
+_lazySubmodules = (
+    'mongotimecurve',
+    'resource',
+)
+
+if sys.version_info < (3,7):
+    # No module level __getattr__
+    from . import mongotimecurve
+    from . import resource
+else:
+    def __getattr__(name):
+        if name in _lazySubmodules:
+            import importlib
+            return importlib.import_module('.'+name, __name__)
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,3 @@
+# Single source of the version, read by setup.py without importing
+# the package, and imported by the package without pkg_resources.
+__version__ = '1.7.12'
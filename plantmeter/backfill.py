@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Imports curve history into a MongoTimeCurve collection in parallel.
+
+Work is split in (meter, month) partitions run by a pool of processes,
+each one with its own mongo connection and writing a month at once.
+If a progress collection is given, finished partitions are recorded
+there and skipped when the backfill is rerun.
+
+Example, reimporting two meters from another collection:
+
+    plantmeter_backfill --db somenergia --collection tm_profile \\
+        --timestamp utc_gkwh_timestamp --creation create_date \\
+        --source-collection tm_profile_old \\
+        --name 88300864 --name 501215455 \\
+        --progress tm_profile_backfill --processes 8 \\
+        2015-01-01 2019-12-31
+"""
+
+import argparse
+import datetime
+import os
+
+
+def monthPartitions(names, start, stop):
+    """
+        Returns a (name, first, last) partition for every name and
+        month between start and stop dates, both included.
+        First and last dates are clipped to the range.
+    """
+    partitions = []
+    for name in names:
+        first = start
+        while first <= stop:
+            nextMonth = (first.replace(day=1)
+                + datetime.timedelta(days=32)).replace(day=1)
+            last = min(stop, nextMonth - datetime.timedelta(days=1))
+            partitions.append((name, first, last))
+            first = nextMonth
+    return partitions
+
+
+class CurveConnection(object):
+    """
+        Picklable reference to a MongoTimeCurve.
+        The curve is connected on first use in each process,
+        since mongo clients cannot be shared by forked processes.
+    """
+
+    def __init__(self, uri, db, collection, **curveOptions):
+        self.uri = uri
+        self.dbname = db
+        self.collection = collection
+        self.curveOptions = curveOptions
+        self._curve = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(_curve=None, _pid=None)
+        return state
+
+    def curve(self):
+        if self._curve is None or self._pid != os.getpid():
+            import pymongo
+            from .mongotimecurve import MongoTimeCurve
+            db = pymongo.MongoClient(self.uri)[self.dbname]
+            self._curve = MongoTimeCurve(db, self.collection,
+                **self.curveOptions)
+            self._pid = os.getpid()
+        return self._curve
+
+
+class CurveSource(object):
+    """Source taking the curves from another MongoTimeCurve"""
+
+    def __init__(self, connection, field='ae'):
+        self.connection = connection
+        self.field = field
+
+    def __call__(self, name, first, last):
+        from somutils.isodates import dateToLocal
+        return self.connection.curve().get(
+            start=dateToLocal(first),
+            stop=dateToLocal(last),
+            filter=name,
+            field=self.field,
+            )
+
+
+class Backfill(object):
+    """
+        Writes into the target curve the data given by the source
+        for every partition.
+
+        target: an object whose curve() method returns the
+            MongoTimeCurve to write, like CurveConnection.
+        source: a callable source(name, first, last) returning
+            the hourly curve of the name between both dates.
+        field: field of the points to write.
+        progressCollection: optional collection, in the target
+            database, to record the finished partitions.
+
+        To run on several processes, target and source must be
+        picklable and connect on their own in each process.
+    """
+
+    def __init__(self, target, source, field='ae', progressCollection=None):
+        self.target = target
+        self.source = source
+        self.field = field
+        self.progressCollection = progressCollection
+
+    def _progress(self):
+        if self.progressCollection is None: return None
+        return self.target.curve().db[self.progressCollection]
+
+    def _progressId(self, partition):
+        name, first, last = partition
+        return dict(
+            collection=self.target.curve().collectionName,
+            name=name,
+            first=first.isoformat(),
+            last=last.isoformat(),
+            )
+
+    def pending(self, partitions):
+        """Returns the partitions not recorded as done"""
+        progress = self._progress()
+        if progress is None: return list(partitions)
+        done = set(
+            (x['_id']['name'], x['_id']['first'], x['_id']['last'])
+            for x in progress.find({
+                '_id.collection': self.target.curve().collectionName,
+            })
+        )
+        return [
+            (name, first, last)
+            for name, first, last in partitions
+            if (name, first.isoformat(), last.isoformat()) not in done
+        ]
+
+    def runPartition(self, partition):
+        from somutils.isodates import dateToLocal
+        name, first, last = partition
+        curve = self.target.curve()
+        curve.update(
+            start=dateToLocal(first),
+            filter=name,
+            field=self.field,
+            data=self.source(name, first, last),
+            )
+        progress = self._progress()
+        if progress is not None:
+            progress.replace_one({'_id': self._progressId(partition)},
+                dict(done=datetime.datetime.now()), upsert=True)
+        return partition
+
+    def run(self, partitions, processes=None, onDone=None):
+        """
+            Runs the pending partitions on a pool of processes
+            (as many as cpus if None, in this process if 0).
+            onDone, if given, is called with every finished partition.
+            Returns the number of partitions run.
+        """
+        partitions = self.pending(partitions)
+        if processes == 0:
+            results = (self.runPartition(p) for p in partitions)
+            return self._collect(results, onDone)
+
+        import multiprocessing
+        pool = multiprocessing.Pool(processes, _initWorker, (self,))
+        try:
+            results = pool.imap_unordered(_runPartition, partitions)
+            return self._collect(results, onDone)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _collect(self, results, onDone):
+        count = 0
+        for partition in results:
+            count += 1
+            if onDone: onDone(partition)
+        return count
+
+
+_workerBackfill = None
+
+def _initWorker(backfill):
+    global _workerBackfill
+    _workerBackfill = backfill
+
+def _runPartition(partition):
+    return _workerBackfill.runPartition(partition)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('start', help="first date to import (included)")
+    parser.add_argument('stop', help="last date to import (included)")
+    parser.add_argument('--uri', default='mongodb://localhost',
+        help="mongo connection uri")
+    parser.add_argument('--db', required=True,
+        help="database name")
+    parser.add_argument('--collection', required=True,
+        help="curve collection")
+    parser.add_argument('--timestamp', default='datetime',
+        help="timestamp field of the points")
+    parser.add_argument('--creation', default='create_at',
+        help="creation field of the points")
+    parser.add_argument('--field', default='ae',
+        help="value field of the points")
+    parser.add_argument('--name', dest='names', action='append', required=True,
+        help="meter name to import, can be repeated")
+    parser.add_argument('--source-uri',
+        help="mongo connection uri of the source, --uri if not given")
+    parser.add_argument('--source-db',
+        help="database name of the source, --db if not given")
+    parser.add_argument('--source-collection', required=True,
+        help="curve collection to import from")
+    parser.add_argument('--source-timestamp', default='datetime',
+        help="timestamp field of the source points")
+    parser.add_argument('--source-creation', default='create_at',
+        help="creation field of the source points")
+    parser.add_argument('--progress',
+        help="collection recording the progress to resume")
+    parser.add_argument('--processes', type=int,
+        help="worker processes, as many as cpus if not given")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from somutils.isodates import isodate
+
+    args = parseArgs(argv)
+    target = CurveConnection(args.uri, args.db, args.collection,
+        timestampField=args.timestamp,
+        creationField=args.creation,
+        )
+    source = CurveSource(
+        CurveConnection(
+            args.source_uri or args.uri,
+            args.source_db or args.db,
+            args.source_collection,
+            timestampField=args.source_timestamp,
+            creationField=args.source_creation,
+            ),
+        field=args.field,
+        )
+    backfill = Backfill(target, source,
+        field=args.field,
+        progressCollection=args.progress,
+        )
+    def done(partition):
+        name, first, last = partition
+        print("Imported {} from {} to {}".format(name, first, last))
+    count = backfill.run(
+        monthPartitions(args.names, isodate(args.start), isodate(args.stop)),
+        processes=args.processes,
+        onDone=done,
+        )
+    print("Imported {} partitions".format(count))
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: et ts=4 sw=4
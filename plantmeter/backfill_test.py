@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+from .backfill import (
+    monthPartitions,
+    CurveConnection,
+    CurveSource,
+    Backfill,
+    )
+from .mongotimecurve import MongoTimeCurve
+from somutils.isodates import localisodate
+from . import testutils
+from datetime import date
+import pickle
+
+import unittest
+
+
+def constantSource(name, first, last):
+    """Source with a constant curve, value depending on the meter"""
+    ndays = (last-first).days+1
+    return ndays*(24*[int(name[-1])]+[0])
+
+
+class CurveTarget(object):
+    def __init__(self, curve):
+        self._curve = curve
+    def curve(self):
+        return self._curve
+
+
+class MonthPartitions_Test(unittest.TestCase):
+
+    def test_monthPartitions_singleMonth(self):
+        self.assertEqual(
+            monthPartitions(['meter1'], date(2015,1,1), date(2015,1,31)), [
+            ('meter1', date(2015,1,1), date(2015,1,31)),
+            ])
+
+    def test_monthPartitions_clippedToRange(self):
+        self.assertEqual(
+            monthPartitions(['meter1'], date(2015,1,10), date(2015,3,5)), [
+            ('meter1', date(2015,1,10), date(2015,1,31)),
+            ('meter1', date(2015,2,1), date(2015,2,28)),
+            ('meter1', date(2015,3,1), date(2015,3,5)),
+            ])
+
+    def test_monthPartitions_crossingYear(self):
+        self.assertEqual(
+            monthPartitions(['meter1'], date(2015,12,20), date(2016,1,5)), [
+            ('meter1', date(2015,12,20), date(2015,12,31)),
+            ('meter1', date(2016,1,1), date(2016,1,5)),
+            ])
+
+    def test_monthPartitions_manyNames(self):
+        self.assertEqual(
+            monthPartitions(['meter1', 'meter2'],
+                date(2015,1,31), date(2015,2,1)), [
+            ('meter1', date(2015,1,31), date(2015,1,31)),
+            ('meter1', date(2015,2,1), date(2015,2,1)),
+            ('meter2', date(2015,1,31), date(2015,1,31)),
+            ('meter2', date(2015,2,1), date(2015,2,1)),
+            ])
+
+    def test_monthPartitions_emptyRange(self):
+        self.assertEqual(
+            monthPartitions(['meter1'], date(2015,2,1), date(2015,1,31)),
+            [])
+
+
+class Backfill_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = 'production'
+        testutils.setUpMongo(self)
+        self.mtc = MongoTimeCurve(self.db, self.collection)
+
+    def get(self, name, start, stop):
+        return list(self.mtc.get(
+            start=localisodate(start),
+            stop=localisodate(stop),
+            filter=name,
+            field='ae',
+            ))
+
+    def test_run_writesPartitions(self):
+        backfill = Backfill(CurveTarget(self.mtc), constantSource)
+        count = backfill.run(
+            monthPartitions(['meter1', 'meter2'],
+                date(2015,1,31), date(2015,2,1)),
+            processes=0)
+        self.assertEqual(count, 4)
+        self.assertEqual(self.get('meter1', '2015-01-31', '2015-02-01'),
+            2*(24*[1]+[0]))
+        self.assertEqual(self.get('meter2', '2015-01-31', '2015-02-01'),
+            2*(24*[2]+[0]))
+
+    def test_run_callsOnDone(self):
+        backfill = Backfill(CurveTarget(self.mtc), constantSource)
+        done = []
+        backfill.run(
+            monthPartitions(['meter1'], date(2015,1,31), date(2015,2,1)),
+            processes=0, onDone=done.append)
+        self.assertEqual(done, [
+            ('meter1', date(2015,1,31), date(2015,1,31)),
+            ('meter1', date(2015,2,1), date(2015,2,1)),
+            ])
+
+    def test_run_withProgress_recordsDone(self):
+        backfill = Backfill(CurveTarget(self.mtc), constantSource,
+            progressCollection='progress')
+        backfill.run(
+            monthPartitions(['meter1'], date(2015,1,31), date(2015,2,1)),
+            processes=0)
+        self.assertEqual(sorted(
+            (x['_id']['name'], x['_id']['first'], x['_id']['last'])
+            for x in self.db['progress'].find()), [
+            ('meter1', '2015-01-31', '2015-01-31'),
+            ('meter1', '2015-02-01', '2015-02-01'),
+            ])
+
+    def test_run_withProgress_resumes(self):
+        partitions = monthPartitions(['meter1'],
+            date(2015,1,31), date(2015,2,1))
+        failing = []
+        def source(name, first, last):
+            if first.month == 2 and not failing:
+                failing.append(first)
+                raise IOError("Connection lost")
+            return constantSource(name, first, last)
+
+        backfill = Backfill(CurveTarget(self.mtc), source,
+            progressCollection='progress')
+        with self.assertRaises(IOError):
+            backfill.run(partitions, processes=0)
+
+        done = []
+        backfill.run(partitions, processes=0, onDone=done.append)
+
+        self.assertEqual(done, [
+            ('meter1', date(2015,2,1), date(2015,2,1)),
+            ])
+        self.assertEqual(self.get('meter1', '2015-01-31', '2015-02-01'),
+            2*(24*[1]+[0]))
+
+    def test_run_withoutProgress_rerunsAll(self):
+        partitions = monthPartitions(['meter1'],
+            date(2015,1,31), date(2015,2,1))
+        backfill = Backfill(CurveTarget(self.mtc), constantSource)
+        backfill.run(partitions, processes=0)
+        self.assertEqual(backfill.run(partitions, processes=0), 2)
+
+    def test_curveSource(self):
+        self.mtc.update(
+            start=localisodate('2015-01-01'),
+            filter='meter1',
+            field='ae',
+            data=24*[1]+[0],
+            )
+        source = CurveSource(CurveTarget(self.mtc))
+        self.assertEqual(
+            list(source('meter1', date(2015,1,1), date(2015,1,1))),
+            24*[1]+[0])
+
+    def test_curveConnection_picklesWithoutClient(self):
+        connection = CurveConnection('mongodb://localhost', 'adb', 'acollection',
+            timestampField='utc_gkwh_timestamp')
+        connection._curve = self.mtc
+        unpickled = pickle.loads(pickle.dumps(connection))
+        self.assertEqual(unpickled._curve, None)
+        self.assertEqual(unpickled.curveOptions,
+            dict(timestampField='utc_gkwh_timestamp'))
+
+    def test_run_processes(self):
+        testutils.skipIfMongomock(self, "data shared by processes")
+        target = CurveConnection(testutils.mongoBackend(),
+            self.databasename, self.collection)
+        backfill = Backfill(target, constantSource,
+            progressCollection='progress')
+        count = backfill.run(
+            monthPartitions(['meter1', 'meter2'],
+                date(2015,1,1), date(2015,3,31)),
+            processes=2)
+        self.assertEqual(count, 6)
+        self.assertEqual(self.get('meter2', '2015-03-31', '2015-03-31'),
+            24*[2]+[0])
+        self.assertEqual(self.db['progress'].count_documents({}), 6)
+
+
+# vim: et ts=4 sw=4
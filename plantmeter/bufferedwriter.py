@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+import collections
+import threading
+
+from .instrumentation import clock
+
+"""
+Write-behind buffering of curve points.
+
+High rate writers, calling fillPoint for every reading,
+queue the points in memory instead of waiting for the database.
+A background thread writes them in bulk with MongoTimeCurve.fillPoints.
+"""
+
+
+class BufferedCurveWriter(object):
+    """
+        Wraps a MongoTimeCurve buffering the points to be written.
+
+        Pending points for the same name, timestamp and type are
+        coalesced keeping the last one.
+        A background thread writes the pending points in bulk
+        when maxPoints are pending or the oldest one has been
+        waiting maxDelay seconds.
+        Writers block when maxPending points are pending,
+        until the background writes make room for them.
+
+        flush(), close() and leaving the writer as context manager,
+        wait until every pending point has been written.
+        A failed write is raised by the next call to fillPoint or
+        flush, and its points are kept pending to be written again.
+    """
+
+    def __init__(self, curve, maxPoints=1000, maxDelay=1., maxPending=10000):
+        assert maxPending >= maxPoints, (
+            "maxPending should not be lower than maxPoints")
+        self.curve = curve
+        self.maxPoints = maxPoints
+        self.maxDelay = maxDelay
+        self.maxPending = maxPending
+        self._pending = collections.OrderedDict()
+        self._oldest = None
+        self._writing = 0
+        self._flushers = 0
+        self._error = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name='BufferedCurveWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def pending(self):
+        """Number of points not written yet"""
+        with self._condition:
+            return len(self._pending) + self._writing
+
+    def fillPoint(self, **data):
+        """Queues a point, taking the same parameters than MongoTimeCurve"""
+        self.curve.checkPoint(data)
+        key = data['name'], data['datetime'], data.get('type')
+        with self._condition:
+            assert not self._closed, "BufferedCurveWriter already closed"
+            self._raiseError()
+            while len(self._pending) >= self.maxPending and key not in self._pending:
+                self.curve.stats.count('buffer', 'blocked')
+                self._condition.wait()
+                self._raiseError()
+            if not self._pending:
+                self._oldest = clock()
+            if self._pending.pop(key, None) is not None:
+                self.curve.stats.count('buffer', 'coalesced')
+            self._pending[key] = data
+            if len(self._pending) in (1, self.maxPoints):
+                self._condition.notify_all()
+
+    def flush(self):
+        """Waits until every pending point is written"""
+        with self._condition:
+            self._flushers += 1
+            try:
+                self._condition.notify_all()
+                while self._error is None and (self._pending or self._writing):
+                    self._condition.wait()
+                self._raiseError()
+            finally:
+                self._flushers -= 1
+
+    def close(self):
+        """Flushes the pending points and stops the background thread"""
+        if self._closed: return
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._thread.join()
+
+    def _raiseError(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _due(self):
+        if not self._pending:
+            return False
+        expired = clock() >= self._oldest + self.maxDelay
+        if self._error is not None:
+            # retry failed points after the delay
+            return expired
+        return bool(expired or self._flushers
+            or len(self._pending) >= self.maxPoints)
+
+    def _timeout(self):
+        if not self._pending: return None
+        return max(0, self._oldest + self.maxDelay - clock())
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._due():
+                    self._condition.wait(self._timeout())
+                    continue
+                self._write()
+
+    def _write(self):
+        """Writes the pending points, called with the lock held"""
+        batch = self._pending
+        self._pending = collections.OrderedDict()
+        self._oldest = None
+        self._writing = len(batch)
+        self._condition.release()
+        try:
+            with self.curve.stats.timed('buffer', 'write'):
+                self.curve.fillPoints(list(batch.values()))
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self._condition.acquire()
+        self._writing = 0
+        if error is not None:
+            # Requeue, newer points replace the failed ones
+            batch.update(self._pending)
+            self._pending = batch
+            self._oldest = clock()
+            self._error = error
+        self._condition.notify_all()
+
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+from .bufferedwriter import BufferedCurveWriter
+from .mongotimecurve import MongoTimeCurve
+from .instrumentation import CurveStats
+from somutils.isodates import localisodate
+from . import testutils
+import datetime
+import threading
+import time
+import mock
+
+import unittest
+
+
+def hour(n):
+    return localisodate('2015-01-01') + datetime.timedelta(hours=n)
+
+
+class BufferedCurveWriter_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = 'generation'
+        testutils.setUpMongo(self)
+        self.stats = CurveStats()
+        self.mtc = MongoTimeCurve(self.db, self.collection, stats=self.stats)
+
+    def writer(self, **kwds):
+        writer = BufferedCurveWriter(self.mtc, **kwds)
+        self.addCleanup(writer.close)
+        return writer
+
+    def stored(self):
+        return sorted(
+            (x['name'], x['ae'])
+            for x in self.db[self.collection].find()
+        )
+
+    def waitWritten(self, writer, timeout=2.):
+        start = time.time()
+        while writer.pending() and time.time() - start < timeout:
+            time.sleep(0.005)
+        self.assertEqual(writer.pending(), 0)
+
+    def test_fillPoint_notWrittenBeforeThresholds(self):
+        writer = self.writer(maxDelay=10)
+        writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+        self.assertEqual(writer.pending(), 1)
+        self.assertEqual(self.stored(), [])
+
+    def test_flush_writesPending(self):
+        writer = self.writer(maxDelay=10)
+        writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+        writer.fillPoint(name='miplanta', datetime=hour(2), ae=20)
+        writer.flush()
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(self.stored(), [
+            ('miplanta', 10),
+            ('miplanta', 20),
+            ])
+
+    def test_flush_nothingPending(self):
+        writer = self.writer(maxDelay=10)
+        writer.flush()
+        self.assertEqual(self.stored(), [])
+
+    def test_fillPoint_sameNameAndDate_coalescedKeepingLast(self):
+        writer = self.writer(maxDelay=10)
+        writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+        writer.fillPoint(name='otraplanta', datetime=hour(1), ae=20)
+        writer.fillPoint(name='miplanta', datetime=hour(1), ae=30)
+        writer.flush()
+        self.assertEqual(self.stored(), [
+            ('miplanta', 30),
+            ('otraplanta', 20),
+            ])
+        self.assertEqual(
+            self.stats.counters[('buffer', 'coalesced')], 1)
+
+    def test_fillPoint_sizeThreshold_written(self):
+        writer = self.writer(maxPoints=2, maxDelay=10)
+        writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+        writer.fillPoint(name='miplanta', datetime=hour(2), ae=20)
+        self.waitWritten(writer)
+        self.assertEqual(len(self.stored()), 2)
+
+    def test_fillPoint_timeThreshold_written(self):
+        writer = self.writer(maxDelay=0.02)
+        writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+        self.waitWritten(writer)
+        self.assertEqual(self.stored(), [
+            ('miplanta', 10),
+            ])
+
+    def test_fillPoint_writesInBulk(self):
+        writer = self.writer(maxDelay=10)
+        with mock.patch.object(self.mtc, 'fillPoints',
+                wraps=self.mtc.fillPoints) as fillPoints:
+            for i in range(5):
+                writer.fillPoint(name='miplanta', datetime=hour(i), ae=i)
+            writer.flush()
+        fillPoints.assert_called_once()
+        self.assertEqual(len(self.stored()), 5)
+
+    def test_fillPoint_missingName_failsOnCaller(self):
+        writer = self.writer()
+        with self.assertRaises(Exception) as ctx:
+            writer.fillPoint(datetime=hour(1), ae=10)
+        self.assertEqual(ctx.exception.args[0], "Missing 'name'")
+        self.assertEqual(writer.pending(), 0)
+
+    def test_fillPoint_naiveDatetime_failsOnCaller(self):
+        writer = self.writer()
+        with self.assertRaises(AssertionError):
+            writer.fillPoint(name='miplanta',
+                datetime=datetime.datetime(2015,1,1), ae=10)
+
+    def test_contextManager_flushesAndCloses(self):
+        with BufferedCurveWriter(self.mtc, maxDelay=10) as writer:
+            writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+        self.assertEqual(len(self.stored()), 1)
+        self.assertFalse(writer._thread.is_alive())
+        with self.assertRaises(AssertionError) as ctx:
+            writer.fillPoint(name='miplanta', datetime=hour(2), ae=10)
+        self.assertEqual(ctx.exception.args[0],
+            "BufferedCurveWriter already closed")
+
+    def test_fillPoint_full_blocksUntilWritten(self):
+        gate = threading.Event()
+        fillPoints = self.mtc.fillPoints
+        def slowFillPoints(points):
+            gate.wait()
+            return fillPoints(points)
+        writer = self.writer(maxPoints=1, maxPending=1, maxDelay=10)
+        with mock.patch.object(self.mtc, 'fillPoints', slowFillPoints):
+            writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+            # waiting for the writer to take it
+            start = time.time()
+            while writer._pending and time.time() - start < 2:
+                time.sleep(0.005)
+            writer.fillPoint(name='miplanta', datetime=hour(2), ae=20)
+            blocked = threading.Thread(target=writer.fillPoint,
+                kwargs=dict(name='miplanta', datetime=hour(3), ae=30))
+            blocked.start()
+            blocked.join(0.05)
+            self.assertTrue(blocked.is_alive())
+            gate.set()
+            blocked.join(2)
+            self.assertFalse(blocked.is_alive())
+            writer.flush()
+        self.assertEqual(len(self.stored()), 3)
+        self.assertEqual(self.stats.counters[('buffer', 'blocked')], 1)
+
+    def test_flush_failedWrite_raisedAndKept(self):
+        writer = self.writer(maxDelay=10)
+        with mock.patch.object(self.mtc, 'fillPoints',
+                side_effect=IOError("Connection lost")):
+            writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+            with self.assertRaises(IOError):
+                writer.flush()
+            self.assertEqual(writer.pending(), 1)
+        writer.flush()
+        self.assertEqual(self.stored(), [
+            ('miplanta', 10),
+            ])
+
+    def test_fillPoint_afterFailedWrite_raises(self):
+        writer = self.writer(maxPoints=1, maxDelay=10)
+        with mock.patch.object(self.mtc, 'fillPoints',
+                side_effect=IOError("Connection lost")):
+            writer.fillPoint(name='miplanta', datetime=hour(1), ae=10)
+            start = time.time()
+            while writer._error is None and time.time() - start < 2:
+                time.sleep(0.005)
+            with self.assertRaises(IOError):
+                writer.fillPoint(name='miplanta', datetime=hour(2), ae=20)
+        writer.flush()
+        self.assertEqual(len(self.stored()), 1)
+
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Removes superseded revisions from a MongoTimeCurve collection.
+
+Example:
+
+    plantmeter_compact --db somenergia --collection tm_profile \\
+        --timestamp utc_gkwh_timestamp --creation create_date \\
+        --archive tm_profile_archive --progress tm_profile_compaction \\
+        2015-01-01 2019-12-31
+"""
+
+import argparse
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('start', help="first date to compact (included)")
+    parser.add_argument('stop', help="last date to compact (included)")
+    parser.add_argument('--uri', default='mongodb://localhost',
+        help="mongo connection uri")
+    parser.add_argument('--db', required=True,
+        help="database name")
+    parser.add_argument('--collection', required=True,
+        help="curve collection")
+    parser.add_argument('--timestamp', default='datetime',
+        help="timestamp field of the points")
+    parser.add_argument('--creation', default='create_at',
+        help="creation field of the points")
+    parser.add_argument('--name', dest='names', action='append',
+        help="meter name to compact, can be repeated, all if not given")
+    parser.add_argument('--window', type=int, default=31,
+        help="days compacted at once for each name")
+    parser.add_argument('--batch', type=int, default=1000,
+        help="points removed at once")
+    parser.add_argument('--archive',
+        help="collection to keep the removed points")
+    parser.add_argument('--progress',
+        help="collection recording the progress to resume")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import pymongo
+    from somutils.isodates import localisodate
+    from .mongotimecurve import MongoTimeCurve
+
+    args = parseArgs(argv)
+    db = pymongo.MongoClient(args.uri)[args.db]
+    mtc = MongoTimeCurve(db, args.collection,
+        timestampField=args.timestamp,
+        creationField=args.creation,
+        )
+    removed = mtc.compact(
+        localisodate(args.start),
+        localisodate(args.stop),
+        names=args.names,
+        windowDays=args.window,
+        archiveCollection=args.archive,
+        progressCollection=args.progress,
+        batchSize=args.batch,
+        )
+    print("Removed {} superseded points".format(removed))
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: et ts=4 sw=4
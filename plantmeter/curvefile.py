@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming import of hourly curve files.
+
+Curve files are semicolon separated text, plain or gzipped,
+having for every hour its local time, a summer/winter flag
+(S/W or 1/0) and some values, like:
+
+    2015-08-04 00:00;S;0;14.8;15.2
+
+Values are integers unless another type is given,
+like float for the decimal columns above.
+
+Lines are parsed by chunks, converting the times of a chunk at once,
+and each chunk is written with a single bulk write, so memory stays
+constant whatever the size of the file.
+The flag gives the utc offset (CEST+2, CET+1), so the hour repeated
+on the change to winter time is not ambiguous.
+
+Examples:
+
+    plantmeter_import --db somenergia --collection tm_profile \\
+        --timestamp utc_gkwh_timestamp --creation create_date \\
+        --name 88300864 --header 1 --field ae=2 \\
+        manlleu_20150804.csv manlleu_20150904.csv.gz
+
+    plantmeter_import --db somenergia --collection tm_weather \\
+        --name 88300864 --field temperature=3 --value-type float \\
+        weather_20150804.csv
+"""
+
+import argparse
+import datetime
+import gzip
+import io
+import itertools
+
+import numpy
+from somutils.isodates import asUtc
+
+summerFlags = ('S', '1')
+winterFlags = ('W', '0')
+valueTypes = dict(int=int, float=float)
+
+
+def openCurveFile(filename, encoding='utf-8'):
+    """Opens a text file, uncompressing it if it is gzipped"""
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return io.TextIOWrapper(gzip.open(filename, 'rb'), encoding=encoding)
+    return io.open(filename, encoding=encoding)
+
+
+def localToUtc(times, summer):
+    """
+        Converts a sequence of naive local times (datetimes or
+        iso strings) and their summer flags into utc datetimes.
+    """
+    times = numpy.array(times, dtype='datetime64[m]')
+    offsets = numpy.where(summer, 120, 60).astype('timedelta64[m]')
+    return [asUtc(time) for time in (times - offsets).tolist()]
+
+
+def _summer(flag):
+    flag = flag.strip()
+    if flag in summerFlags: return True
+    if flag in winterFlags: return False
+    raise ValueError("Bad summer/winter flag {!r}".format(flag))
+
+
+def _parseChunk(rows, name, nameColumn, timeColumn, flagColumn,
+        fields, timeFormat, valueType):
+    times = [row[timeColumn].strip() for row in rows]
+    if timeFormat:
+        times = [datetime.datetime.strptime(t, timeFormat) for t in times]
+    else:
+        times = [t.replace('/', '-') for t in times]
+    summer = [_summer(row[flagColumn]) for row in rows]
+    points = []
+    for row, time in zip(rows, localToUtc(times, summer)):
+        point = dict(
+            (field, valueType(row[column]))
+            for field, column in fields.items()
+        )
+        point.update(
+            name=name if nameColumn is None else row[nameColumn].strip(),
+            datetime=time,
+        )
+        points.append(point)
+    return points
+
+
+def parseCurveLines(lines, name=None, nameColumn=None,
+        timeColumn=0, flagColumn=1, fields=dict(ae=2),
+        timeFormat=None, valueType=int, chunkSize=10000):
+    """
+        Yields lists of up to chunkSize points, as fillPoints dicts,
+        from an iterable of semicolon separated lines.
+
+        name: meter name of every point, or else,
+        nameColumn: column having the meter name (ie. the CUPS)
+        timeColumn: column having the local time
+        flagColumn: column having the summer/winter flag
+        fields: maps each point field to the column having its value
+        timeFormat: strptime format of times, if None iso-like
+            'YYYY-MM-DD HH:MM' (or with slashes) is expected
+        valueType: conversion of the values, int by default,
+            float for decimal values
+        Blank lines are skipped.
+    """
+    assert (name is None) != (nameColumn is None), (
+        "Either name or nameColumn should be given")
+    rows = (
+        line.rstrip('\r\n').split(';')
+        for line in lines
+        if line.strip()
+    )
+    while True:
+        chunk = list(itertools.islice(rows, chunkSize))
+        if not chunk: return
+        yield _parseChunk(chunk, name, nameColumn, timeColumn, flagColumn,
+            fields, timeFormat, valueType)
+
+
+def readCurveFile(filename, headerLines=0, encoding='utf-8', **kwds):
+    """
+        Yields lists of points from a curve file, skipping
+        the first headerLines lines.
+        See parseCurveLines for the parameters.
+    """
+    with openCurveFile(filename, encoding) as lines:
+        lines = itertools.islice(lines, headerLines, None)
+        for points in parseCurveLines(lines, **kwds):
+            yield points
+
+
+def importCurveFile(curve, filename, **kwds):
+    """
+        Writes the points of a curve file into a MongoTimeCurve
+        with a bulk write for each chunk.
+        See readCurveFile for the parameters.
+        Returns the number of points.
+    """
+    count = 0
+    for points in readCurveFile(filename, **kwds):
+        curve.fillPoints(points)
+        count += len(points)
+    return count
+
+
+def fieldColumn(text):
+    field, column = text.split('=')
+    return field, int(column)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', metavar='file',
+        help="curve file to import, maybe gzipped")
+    parser.add_argument('--uri', default='mongodb://localhost',
+        help="mongo connection uri")
+    parser.add_argument('--db', required=True,
+        help="database name")
+    parser.add_argument('--collection', required=True,
+        help="curve collection")
+    parser.add_argument('--timestamp', default='datetime',
+        help="timestamp field of the points")
+    parser.add_argument('--creation', default='create_at',
+        help="creation field of the points")
+    names = parser.add_mutually_exclusive_group(required=True)
+    names.add_argument('--name',
+        help="meter name of the points")
+    names.add_argument('--name-column', type=int,
+        help="column having the meter name of each point")
+    parser.add_argument('--time-column', type=int, default=0,
+        help="column having the local time")
+    parser.add_argument('--flag-column', type=int, default=1,
+        help="column having the summer/winter flag")
+    parser.add_argument('--field', dest='fields', type=fieldColumn,
+        action='append',
+        help="field=column, value to import, can be repeated, ae=2 if not given")
+    parser.add_argument('--value-type', choices=sorted(valueTypes),
+        default='int',
+        help="type of the values, int if not given")
+    parser.add_argument('--time-format',
+        help="strptime format of the times, iso-like if not given")
+    parser.add_argument('--header', type=int, default=0,
+        help="header lines to skip")
+    parser.add_argument('--encoding', default='utf-8',
+        help="encoding of the files")
+    parser.add_argument('--chunk', type=int, default=10000,
+        help="points written at once")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import pymongo
+    from .mongotimecurve import MongoTimeCurve
+
+    args = parseArgs(argv)
+    db = pymongo.MongoClient(args.uri)[args.db]
+    mtc = MongoTimeCurve(db, args.collection,
+        timestampField=args.timestamp,
+        creationField=args.creation,
+        )
+    for filename in args.files:
+        count = importCurveFile(mtc, filename,
+            headerLines=args.header,
+            encoding=args.encoding,
+            name=args.name,
+            nameColumn=args.name_column,
+            timeColumn=args.time_column,
+            flagColumn=args.flag_column,
+            fields=dict(args.fields or [('ae', 2)]),
+            timeFormat=args.time_format,
+            valueType=valueTypes[args.value_type],
+            chunkSize=args.chunk,
+            )
+        print("Imported {} points from {}".format(count, filename))
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from .curvefile import (
+    localToUtc,
+    parseArgs,
+    parseCurveLines,
+    readCurveFile,
+    importCurveFile,
+    )
+from .mongotimecurve import MongoTimeCurve
+from somutils.isodates import localisodate
+from . import testutils
+from . import get_data
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+
+import unittest
+
+
+def utc(*args):
+    from somutils.isodates import asUtc
+    return asUtc(datetime.datetime(*args))
+
+
+class LocalToUtc_Test(unittest.TestCase):
+
+    def test_localToUtc_summer(self):
+        self.assertEqual(
+            localToUtc(['2015-08-04 00:00'], [True]),
+            [utc(2015,8,3,22)])
+
+    def test_localToUtc_winter(self):
+        self.assertEqual(
+            localToUtc(['2015-12-04 00:00'], [False]),
+            [utc(2015,12,3,23)])
+
+    def test_localToUtc_repeatedHour(self):
+        self.assertEqual(
+            localToUtc(
+                ['2015-10-25 02:00', '2015-10-25 02:00'],
+                [True, False]), [
+            utc(2015,10,25,0),
+            utc(2015,10,25,1),
+            ])
+
+    def test_localToUtc_datetimes(self):
+        self.assertEqual(
+            localToUtc([datetime.datetime(2015,8,4,1)], [True]),
+            [utc(2015,8,3,23)])
+
+    def test_localToUtc_empty(self):
+        self.assertEqual(localToUtc([], []), [])
+
+
+class ParseCurveLines_Test(unittest.TestCase):
+
+    def parse(self, lines, **kwds):
+        return list(parseCurveLines(lines, **kwds))
+
+    def test_parseCurveLines(self):
+        self.assertEqual(self.parse([
+            '2015-08-04 00:00;S;10;14.8\n',
+            '2015-08-04 01:00;S;20;14.9\n',
+            ], name='meter'), [[
+            dict(name='meter', datetime=utc(2015,8,3,22), ae=10),
+            dict(name='meter', datetime=utc(2015,8,3,23), ae=20),
+            ]])
+
+    def test_parseCurveLines_byChunks(self):
+        chunks = self.parse([
+            '2015-08-04 00:00;S;10\n',
+            '2015-08-04 01:00;S;20\n',
+            '2015-08-04 02:00;S;30\n',
+            ], name='meter', chunkSize=2)
+        self.assertEqual(
+            [[point['ae'] for point in chunk] for chunk in chunks],
+            [[10, 20], [30]])
+
+    def test_parseCurveLines_isLazy(self):
+        def lines():
+            yield '2015-08-04 00:00;S;10\n'
+            raise AssertionError("Read beyond the first chunk")
+        chunks = parseCurveLines(lines(), name='meter', chunkSize=1)
+        self.assertEqual(len(next(chunks)), 1)
+
+    def test_parseCurveLines_blankLinesSkipped(self):
+        chunks = self.parse([
+            '2015-08-04 00:00;S;10\r\n',
+            '\r\n',
+            ], name='meter')
+        self.assertEqual(len(chunks[0]), 1)
+
+    def test_parseCurveLines_noLines(self):
+        self.assertEqual(self.parse([], name='meter'), [])
+
+    def test_parseCurveLines_nameColumnAndSlashesAndNumericFlags(self):
+        self.assertEqual(self.parse([
+            'ES0001;2015/12/04 01:00;0;10;3\n',
+            'ES0002;2015/08/04 01:00;1;20;4\n',
+            ], nameColumn=0, timeColumn=1, flagColumn=2,
+            fields=dict(ae=3, ai=4)), [[
+            dict(name='ES0001', datetime=utc(2015,12,4,0), ae=10, ai=3),
+            dict(name='ES0002', datetime=utc(2015,8,3,23), ae=20, ai=4),
+            ]])
+
+    def test_parseCurveLines_timeFormat(self):
+        self.assertEqual(self.parse([
+            '20160327000000;0;W\n',
+            ], name='meter', flagColumn=2, fields=dict(ae=1),
+            timeFormat='%Y%m%d%H%M%S'), [[
+            dict(name='meter', datetime=utc(2016,3,26,23), ae=0),
+            ]])
+
+    def test_parseCurveLines_decimalValues(self):
+        self.assertEqual(self.parse([
+            '2015-08-04 00:00;S;0;14.8;15.2\n',
+            ], name='meter', fields=dict(ae=2, temperature=3, humidity=4),
+            valueType=float), [[
+            dict(name='meter', datetime=utc(2015,8,3,22),
+                ae=0., temperature=14.8, humidity=15.2),
+            ]])
+
+    def test_parseCurveLines_decimalValuesAsInt_fail(self):
+        with self.assertRaises(ValueError):
+            self.parse(['2015-08-04 00:00;S;14.8\n'], name='meter')
+
+    def test_parseCurveLines_badFlag(self):
+        with self.assertRaises(ValueError) as ctx:
+            self.parse(['2015-08-04 00:00;X;10\n'], name='meter')
+        self.assertEqual(str(ctx.exception),
+            "Bad summer/winter flag 'X'")
+
+    def test_parseCurveLines_nameRequired(self):
+        with self.assertRaises(AssertionError):
+            self.parse(['2015-08-04 00:00;S;10\n'])
+
+
+class CurveFile_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.collection = 'production'
+        testutils.setUpMongo(self)
+        self.mtc = MongoTimeCurve(self.db, self.collection)
+        self.row1 = [0,0,0,0,0,0,0,0,3,6,5,4,8,17,34,12,12,5,3,1,0,0,0,0]
+        self.row2 = [0,0,0,0,0,0,0,0,4,7,6,5,9,18,35,13,13,6,4,2,0,0,0,0]
+
+    def gzipped(self, filename):
+        target = os.path.join(self.tempdir, os.path.basename(filename)+'.gz')
+        with open(filename, 'rb') as source:
+            with gzip.open(target, 'wb') as output:
+                output.write(source.read())
+        return target
+
+    def test_readCurveFile(self):
+        chunks = list(readCurveFile(get_data('manlleu_20150804.csv'),
+            headerLines=1, name='meter'))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0][0],
+            dict(name='meter', datetime=utc(2015,8,3,22), ae=0))
+        self.assertEqual(
+            [point['ae'] for point in chunks[0]],
+            self.row1+self.row2)
+
+    def test_readCurveFile_gzipped(self):
+        filename = self.gzipped(get_data('manlleu_20150804.csv'))
+        chunks = list(readCurveFile(filename, headerLines=1, name='meter'))
+        self.assertEqual(
+            [point['ae'] for point in chunks[0]],
+            self.row1+self.row2)
+
+    def test_importCurveFile(self):
+        count = importCurveFile(self.mtc, get_data('manlleu_20150804.csv'),
+            headerLines=1, name='meter', chunkSize=10)
+        self.assertEqual(count, 48)
+        curve = self.mtc.get(
+            start=localisodate('2015-08-04'),
+            stop=localisodate('2015-08-05'),
+            filter='meter',
+            field='ae',
+            )
+        self.assertEqual(list(curve), self.row1+[0]+self.row2+[0])
+
+
+class ParseArgs_Test(unittest.TestCase):
+
+    def test_parseArgs_valueType_intByDefault(self):
+        args = parseArgs(['--db', 'adb', '--collection', 'acollection',
+            '--name', 'meter', 'afile.csv'])
+        self.assertEqual(args.value_type, 'int')
+
+    def test_parseArgs_valueType_float(self):
+        args = parseArgs(['--db', 'adb', '--collection', 'acollection',
+            '--name', 'meter', '--value-type', 'float', 'afile.csv'])
+        self.assertEqual(args.value_type, 'float')
+
+
+# vim: et ts=4 sw=4
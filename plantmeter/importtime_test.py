@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os
+import subprocess
+import sys
+import unittest
+
+_repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall time checks are flaky on loaded machines, so they are
+# just done if this variable sets the target seconds.
+importTimeTarget = 'PLANTMETER_IMPORT_TARGET'
+
+
+def importReport(statement):
+    """
+        Runs the import statement in a fresh interpreter and returns
+        the seconds it took and the heavy modules it loaded.
+        PYTHONPATH is dropped so that site customizations
+        do not preload anything.
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONPATH', None)
+    output = subprocess.check_output([sys.executable, '-c',
+        "import time, sys\n"
+        "start = time.time()\n"
+        "{}\n"
+        "elapsed = time.time() - start\n"
+        "print(elapsed)\n"
+        "print(' '.join(sorted(m for m in sys.modules\n"
+        "    if m in ('pymongo', 'bson', 'numpy', 'yamlns', 'pkg_resources'))))\n"
+        .format(statement)],
+        cwd=_repoRoot, env=env)
+    elapsed, modules = output.decode('utf8').split('\n')[:2]
+    return float(elapsed), modules.split()
+
+
+@unittest.skipIf(sys.version_info < (3,7),
+    "lazy imports require module level __getattr__")
+class ImportTime_Test(unittest.TestCase):
+
+    def assertFast(self, elapsed):
+        target = os.environ.get(importTimeTarget)
+        if not target: return
+        self.assertLess(elapsed, float(target))
+
+    def test_package_isFastAndLight(self):
+        elapsed, modules = importReport("import plantmeter")
+        self.assertEqual(modules, [])
+        self.assertFast(elapsed)
+
+    def test_version_noPkgResources(self):
+        elapsed, modules = importReport(
+            "import plantmeter; plantmeter.VERSION")
+        self.assertEqual(modules, [])
+        self.assertFast(elapsed)
+
+    def test_version_static(self):
+        import plantmeter
+        from plantmeter._version import __version__
+        self.assertEqual(plantmeter.VERSION, __version__)
+
+    def test_resource_noPymongo(self):
+        elapsed, modules = importReport("import plantmeter.resource")
+        self.assertEqual(modules, ['numpy'])
+
+    def test_submodule_byAttribute(self):
+        elapsed, modules = importReport(
+            "import plantmeter; plantmeter.mongotimecurve.MongoTimeCurve")
+        self.assertEqual(modules, ['numpy'])
+
+    def test_unknownAttribute(self):
+        import plantmeter
+        with self.assertRaises(AttributeError):
+            plantmeter.notamodule
+
+
+# vim: et ts=4 sw=4
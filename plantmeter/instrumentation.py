@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import time
+import contextlib
+import threading
+
+"""
+Optional instrumentation for curve operations.
+
+Curves and resources accept a 'stats' object.
+When given, every call records its wall time split in phases
+and some counters (documents returned, bytes transferred, cache hits...).
+Exporters dump the aggregated histograms as a log line or
+as a Prometheus text file.
+
+Documents scanned by the server are not recorded, since they
+would require an explain of every query; the mongo profiler
+tells them. Bytes transferred are just counted with rawDecode,
+where the raw documents are at hand without decoding them.
+"""
+
+clock = getattr(time, 'perf_counter', time.time)
+
+defaultBuckets = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1., 2.5, 5., 10., float('inf'),
+)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values"""
+
+    def __init__(self, buckets=defaultBuckets):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, limit in enumerate(self.buckets):
+            if value <= limit:
+                self.counts[i] += 1
+
+    def copy(self):
+        result = Histogram(self.buckets)
+        result.counts = list(self.counts)
+        result.count = self.count
+        result.sum = self.sum
+        return result
+
+
+class CurveStats(object):
+    """
+        Collects timings and counters of curve operations.
+
+        Timings are aggregated as histograms by (operation, phase).
+        Counters are aggregated by (operation, counter).
+        If a listener is provided it is called on every
+        measure as listener(operation, metric, value).
+        Measures can be taken from several threads at once,
+        exporters read a consistent copy from snapshot().
+    """
+
+    def __init__(self, listener=None, buckets=defaultBuckets):
+        self.listener = listener
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, operation, phase, seconds):
+        key = operation, phase
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(seconds)
+        if self.listener:
+            self.listener(operation, phase, seconds)
+
+    @contextlib.contextmanager
+    def timed(self, operation, phase='total'):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.observe(operation, phase, clock()-start)
+
+    def count(self, operation, counter, n=1):
+        key = operation, counter
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+        if self.listener:
+            self.listener(operation, counter, n)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """Returns a copy of the stats not changed by later measures"""
+        result = CurveStats(buckets=self.buckets)
+        with self._lock:
+            result.histograms = dict(
+                (key, histogram.copy())
+                for key, histogram in self.histograms.items())
+            result.counters = dict(self.counters)
+        return result
+
+
+class NullStats(object):
+    """Stats object doing nothing, used when no stats are configured"""
+
+    def observe(self, operation, phase, seconds):
+        pass
+
+    @contextlib.contextmanager
+    def timed(self, operation, phase='total'):
+        yield
+
+    def count(self, operation, counter, n=1):
+        pass
+
+nullStats = NullStats()
+
+
+def statsLines(stats):
+    """Returns a line summarizing each histogram and counter"""
+    stats = stats.snapshot()
+    for (operation, phase), histogram in sorted(stats.histograms.items()):
+        yield "{} {}: {} calls, {:.6f}s total, {:.6f}s mean".format(
+            operation, phase, histogram.count, histogram.sum,
+            histogram.sum/histogram.count if histogram.count else 0)
+    for (operation, counter), value in sorted(stats.counters.items()):
+        yield "{} {}: {}".format(operation, counter, value)
+
+
+def logStats(stats, logger=None, level=None):
+    """Writes the stats summary to a logger"""
+    import logging
+    logger = logger or logging.getLogger('plantmeter.stats')
+    level = logging.INFO if level is None else level
+    for line in statsLines(stats):
+        logger.log(level, line)
+
+
+def prometheusText(stats, prefix='plantmeter'):
+    """Returns the stats in Prometheus text exposition format"""
+    stats = stats.snapshot()
+    lines = []
+    if stats.histograms:
+        name = prefix+'_seconds'
+        lines.append('# TYPE {} histogram'.format(name))
+    for (operation, phase), histogram in sorted(stats.histograms.items()):
+        labels = 'operation="{}",phase="{}"'.format(operation, phase)
+        for limit, count in zip(histogram.buckets, histogram.counts):
+            le = '+Inf' if limit == float('inf') else repr(limit)
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, le, count))
+        lines.append('{}_sum{{{}}} {!r}'.format(name, labels, histogram.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, histogram.count))
+    if stats.counters:
+        name = prefix+'_total'
+        lines.append('# TYPE {} counter'.format(name))
+    for (operation, counter), value in sorted(stats.counters.items()):
+        lines.append('{}{{operation="{}",counter="{}"}} {}'.format(
+            name, operation, counter, value))
+    return ''.join(line+'\n' for line in lines)
+
+
+def writePrometheus(stats, filename, prefix='plantmeter'):
+    """
+        Writes the stats as a Prometheus text file.
+        The file is replaced atomically so that a node exporter
+        textfile collector never reads it half written.
+    """
+    import os
+    tmpname = filename+'.tmp'
+    with open(tmpname, 'w') as output:
+        output.write(prometheusText(stats, prefix))
+    os.rename(tmpname, filename)
+
+
+# vim: et ts=4 sw=4
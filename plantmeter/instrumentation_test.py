@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from .instrumentation import (
+    Histogram,
+    CurveStats,
+    NullStats,
+    statsLines,
+    prometheusText,
+    writePrometheus,
+    )
+import os
+import tempfile
+import threading
+
+import unittest
+
+
+class Histogram_Test(unittest.TestCase):
+
+    def test_observe_cumulativeBuckets(self):
+        h = Histogram(buckets=(1, 2, float('inf')))
+        h.observe(0.5)
+        h.observe(1.5)
+        h.observe(3)
+        self.assertEqual(h.counts, [1, 2, 3])
+        self.assertEqual(h.count, 3)
+        self.assertEqual(h.sum, 5.)
+
+
+class CurveStats_Test(unittest.TestCase):
+
+    def test_timed_recordsPhase(self):
+        stats = CurveStats()
+        with stats.timed('get', 'query'):
+            pass
+        self.assertEqual(list(stats.histograms), [('get', 'query')])
+        self.assertEqual(stats.histograms['get', 'query'].count, 1)
+
+    def test_timed_defaultPhaseIsTotal(self):
+        stats = CurveStats()
+        with stats.timed('get'):
+            pass
+        self.assertEqual(list(stats.histograms), [('get', 'total')])
+
+    def test_timed_recordsOnException(self):
+        stats = CurveStats()
+        with self.assertRaises(ValueError):
+            with stats.timed('get'):
+                raise ValueError()
+        self.assertEqual(stats.histograms['get', 'total'].count, 1)
+
+    def test_count_accumulates(self):
+        stats = CurveStats()
+        stats.count('get', 'documents', 3)
+        stats.count('get', 'documents', 2)
+        self.assertEqual(stats.counters, {('get', 'documents'): 5})
+
+    def test_listener_calledOnEveryMeasure(self):
+        calls = []
+        stats = CurveStats(listener=lambda *args: calls.append(args))
+        stats.observe('get', 'query', 0.5)
+        stats.count('get', 'documents', 3)
+        self.assertEqual(calls, [
+            ('get', 'query', 0.5),
+            ('get', 'documents', 3),
+        ])
+
+    def test_reset(self):
+        stats = CurveStats()
+        stats.observe('get', 'query', 0.5)
+        stats.count('get', 'documents', 3)
+        stats.reset()
+        self.assertEqual(stats.histograms, {})
+        self.assertEqual(stats.counters, {})
+
+    def test_concurrentMeasures_noneLost(self):
+        stats = CurveStats()
+        def measure():
+            for i in range(2000):
+                stats.count('get', 'documents')
+                stats.observe('get', 'query', 0.001)
+        threads = [threading.Thread(target=measure) for i in range(8)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(stats.counters['get', 'documents'], 16000)
+        self.assertEqual(stats.histograms['get', 'query'].count, 16000)
+
+    def test_snapshot_notChangedByLaterMeasures(self):
+        stats = CurveStats()
+        stats.observe('get', 'query', 0.5)
+        stats.count('get', 'documents', 3)
+        snapshot = stats.snapshot()
+        stats.observe('get', 'query', 0.5)
+        stats.observe('get', 'decode', 0.5)
+        stats.count('get', 'documents', 3)
+        self.assertEqual(list(snapshot.histograms), [('get', 'query')])
+        self.assertEqual(snapshot.histograms['get', 'query'].count, 1)
+        self.assertEqual(snapshot.histograms['get', 'query'].counts[-1], 1)
+        self.assertEqual(snapshot.counters, {('get', 'documents'): 3})
+
+    def test_nullStats_doesNothing(self):
+        stats = NullStats()
+        with stats.timed('get'):
+            stats.count('get', 'documents')
+            stats.observe('get', 'query', 0.5)
+
+
+class Exporters_Test(unittest.TestCase):
+
+    def setupStats(self):
+        stats = CurveStats(buckets=(0.1, float('inf')))
+        stats.observe('get', 'query', 0.05)
+        stats.observe('get', 'query', 0.5)
+        stats.count('get', 'documents', 3)
+        return stats
+
+    def test_statsLines(self):
+        self.assertEqual(list(statsLines(self.setupStats())), [
+            "get query: 2 calls, 0.550000s total, 0.275000s mean",
+            "get documents: 3",
+        ])
+
+    def test_prometheusText(self):
+        self.assertMultiLineEqual(prometheusText(self.setupStats()),
+            '# TYPE plantmeter_seconds histogram\n'
+            'plantmeter_seconds_bucket{operation="get",phase="query",le="0.1"} 1\n'
+            'plantmeter_seconds_bucket{operation="get",phase="query",le="+Inf"} 2\n'
+            'plantmeter_seconds_sum{operation="get",phase="query"} 0.55\n'
+            'plantmeter_seconds_count{operation="get",phase="query"} 2\n'
+            '# TYPE plantmeter_total counter\n'
+            'plantmeter_total{operation="get",counter="documents"} 3\n'
+            )
+
+    def test_prometheusText_empty(self):
+        self.assertEqual(prometheusText(CurveStats()), '')
+
+    def test_writePrometheus(self):
+        stats = self.setupStats()
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'plantmeter.prom')
+        try:
+            writePrometheus(stats, filename)
+            with open(filename) as f:
+                self.assertEqual(f.read(), prometheusText(stats))
+            self.assertEqual(os.listdir(tmpdir), ['plantmeter.prom'])
+        finally:
+            os.remove(filename)
+            os.rmdir(tmpdir)
+
+
+# vim: et ts=4 sw=4
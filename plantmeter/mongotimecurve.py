@@ -1,9 +1,8 @@
 #!/usr/bin/env python
 
-import pymongo
-from yamlns import namespace as ns
 import numpy
 import datetime
+import random
 
 """
 + More than one meassure
@@ -26,9 +25,13 @@ from somutils.isodates import (
     addDays,
     addHours,
     )
+from .instrumentation import nullStats, clock
+from .singleflight import callKey
 
 
 hoursPerDay=25
+quartersPerHour=4
+quartersPerDay=hoursPerDay*quartersPerHour
 
 """
 - Spain daylight:
@@ -92,6 +95,200 @@ def curveIndexToDate(start, index):
     return tz.normalize(localday+datetime.timedelta(hours=hours))
 
 
+_transitions = None
+
+def _utcOffsets(localTimes):
+    """
+        Returns the utc offsets, as a timedelta64[m] array, of
+        a datetime64[m] array of naive local times, that should
+        not be ambiguous.
+        Looks up pytz transition table when available.
+    """
+    global _transitions
+    if not hasattr(tz, '_utc_transition_times'):
+        return numpy.array([
+            tz.utcoffset(time) for time in localTimes.tolist()
+            ], 'timedelta64[m]')
+    if _transitions is None:
+        _transitions = (
+            numpy.array(tz._utc_transition_times, 'datetime64[m]'),
+            numpy.array([info[0] for info in tz._transition_info],
+                'timedelta64[m]'),
+        )
+    instants, offsets = _transitions
+    def offsetAt(utcTimes):
+        return offsets[numpy.searchsorted(instants, utcTimes, 'right')-1]
+    # Taking local as utc is near enough to find the utc
+    return offsetAt(localTimes - offsetAt(localTimes))
+
+
+def curveDates(start, ndays):
+    """
+        Returns the utc instant of every slot of an hourly curve
+        of ndays days starting at 'start' date, as a naive
+        datetime64[m] array, having NaT at padding slots.
+        Equivalent to curveIndexToDate for the whole curve at once.
+    """
+    midnights = (numpy.datetime64(start.date(), 'D')
+        + numpy.arange(ndays+1)).astype('datetime64[m]')
+    midnights = midnights - _utcOffsets(midnights)
+    dayHours = (midnights[1:]-midnights[:-1]).astype('timedelta64[h]').astype(int)
+    hours = numpy.arange(hoursPerDay)
+    slots = (midnights[:-1,numpy.newaxis]
+        + hours.astype('timedelta64[h]'))
+    slots[hours >= dayHours[:,numpy.newaxis]] = numpy.datetime64('NaT')
+    return slots.ravel()
+
+
+def dateToQuarterCurveIndex(start, localTime):
+    """
+        Maps a timezoned datetime to a quarter hourly curve index
+        starting at 'start' date.
+
+        A day in a quarter hourly curve has 100 positions,
+        four for each position of the hourly curve,
+        so the same daylight saving padding applies.
+    """
+    return (dateToCurveIndex(start, localTime)*quartersPerHour
+        + localTime.minute//15)
+
+
+def quartersToHours(curve):
+    """
+        Downsamples a quarter hourly curve to an hourly one
+        by adding each four consecutive quarters.
+    """
+    return numpy.asarray(curve).reshape(-1, quartersPerHour).sum(axis=1)
+
+
+resolutions = (
+    'hourly', # hourly points, 25 slots a day
+    'quarterhourly', # quarter hourly (p4) points, 100 slots a day
+    'hourlyFromQuarters', # quarter hourly points added by hour
+)
+
+
+def slotsPerDay(resolution='hourly'):
+    """Number of curve positions for a day at the given resolution"""
+    if resolution == 'quarterhourly':
+        return quartersPerDay
+    return hoursPerDay
+
+
+# Server versions by client, since the ERP builds a curve on every call.
+# Keyed by id, since hashing a client blocks selecting a server.
+_serverVersions = {}
+
+def _clientServerVersion(client):
+    """
+        Version of the server of a mongo client as a tuple of ints,
+        empty if unknown. Known versions are asked once by client.
+    """
+    import weakref
+    cached = _serverVersions.get(id(client))
+    if cached is not None and cached[0]() is client:
+        return cached[1]
+    try:
+        version = client.server_info()['version']
+    except Exception:
+        return ()
+    version = tuple(int(x) for x in version.split('-')[0].split('.'))
+    _serverVersions[id(client)] = weakref.ref(client), version
+    return version
+
+
+class NameInterner(object):
+    """
+        Maps curve names to integer ids.
+        The mapping is kept in a collection, with a document
+        {_id: id, name: name} for each name, and cached in process.
+        Ids are allocated from the 'counters' collection.
+    """
+
+    def __init__(self, mongodb, collection):
+        self.db = mongodb
+        self.collectionName = collection
+        self.collection = self.db[collection]
+        self._ids = {}
+        self._indexed = False
+
+    def id(self, name, create=False):
+        """
+            Returns the id for the name.
+            If the name has no id yet, it is allocated if create
+            is True, otherwise returns None.
+        """
+        if name in self._ids:
+            return self._ids[name]
+        entry = self.collection.find_one({'name': name})
+        if entry is None and not create:
+            return None
+        if entry is None:
+            entry = self._allocate(name)
+        self._ids[name] = entry['_id']
+        return entry['_id']
+
+    def _allocate(self, name):
+        import pymongo
+        from pymongo.errors import DuplicateKeyError
+        if not self._indexed:
+            self.collection.create_index('name', unique=True)
+            self._indexed = True
+        counter = self.db['counters'].find_one_and_update(
+            {'_id': self.collectionName},
+            {'$inc': {'counter': 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        entry = dict(_id=counter['counter'], name=name)
+        try:
+            self.collection.insert_one(entry)
+        except DuplicateKeyError:
+            # Concurrently allocated by other writer, take that one
+            entry = self.collection.find_one({'name': name})
+        return entry
+
+
+class ShardedCounter(object):
+    """
+        Counts the points written to a collection in the
+        'counters' collection, as the former find_and_modify did.
+        The count can be split into shards, documents incremented
+        at random, so that concurrent writers do not contend on a
+        single document. The first shard is the former document,
+        {_id: name}, the rest {_id: 'name:k'}, and the total is
+        the sum of all of them.
+        No state is kept in process, so it is thread safe.
+    """
+
+    def __init__(self, mongodb, name, shards=1):
+        assert shards >= 1, "At least one shard is required"
+        self.db = mongodb
+        self.name = name
+        self.shards = shards
+
+    def _shardId(self, shard):
+        if not shard: return self.name
+        return '{}:{}'.format(self.name, shard)
+
+    def increment(self, n=1):
+        """Adds n to the count, on a random shard"""
+        shard = random.randrange(self.shards)
+        self.db['counters'].update_one(
+            {'_id': self._shardId(shard)},
+            {'$inc': {'counter': n}},
+            upsert=True,
+        )
+
+    def total(self):
+        """Returns the count, summing all the shards"""
+        return sum(
+            shard['counter']
+            for shard in self.db['counters'].find({'_id': {'$in': [
+                self._shardId(shard) for shard in range(self.shards)
+            ]}})
+        )
+
 
 class MongoTimeCurve(object):
     """Consolidates curve data in a mongo database (old format)"""
@@ -99,75 +296,327 @@ class MongoTimeCurve(object):
     def __init__(self, mongodb, collection,
             timestampField='datetime',
             creationField='create_at',
+            batchSize=None,
+            rawDecode=False,
+            stats=None,
+            datesCollection=None,
+            namesCollection=None,
+            nameIdField='name_id',
+            singleRevision=False,
+            counterShards=1,
+            topRevisions=None,
+            timeSeries=False,
+            singleFlight=None,
         ):
+        """
+            batchSize: number of documents per cursor batch on reads,
+                server default if None.
+            rawDecode: read aggregation results as raw BSON,
+                decoding just the accessed fields.
+            stats: optional CurveStats collecting call timings and counters.
+                The get phases are query, decode, mapping and assembly.
+                pymongo decodes the BSON documents while fetching them,
+                so query includes the decoding and decode just the
+                field extraction, unless rawDecode is set.
+            datesCollection: optional collection keeping the first and
+                last timestamp of each name, so that first and last
+                dates do not require sorted finds on the curve collection.
+                Writes done by other tools require calling reconcileDates.
+            namesCollection: optional collection mapping names to integer
+                ids. When given, written points also carry the id in
+                nameIdField, and reads match and group by the id,
+                using an (id, timestamp) index created on the first
+                read or write. Points keep their name, for other readers,
+                so they are no smaller. Points lacking the id, written
+                before or by other tools, are ignored until stampNameIds.
+            singleRevision: instead of appending a new revision on
+                every write, points are upserted on a unique
+                (name, timestamp, type) key, and reads skip the
+                newest revision selection. No history is kept.
+                A collection having appended revisions must be
+                compacted first, otherwise the revisions would be added.
+                The unique key index is created on the first read or
+                write, so it fails if any revision is left.
+            counterShards: number of documents the count of written
+                points is split into, to spread the increments of
+                concurrent writers (see ShardedCounter).
+            topRevisions: whether to pick the newest revisions with
+                $top (MongoDB>=5.2) instead of sorting all the points.
+                If None, it is decided by the server version.
+            timeSeries: the collection is a MongoDB (>=5.0) time-series
+                collection, with the timestamp as timeField and the name
+                as metaField (see createTimeSeries and migrateFrom).
+                Points are just inserted, so single revision upserts
+                are not available, and compact requires MongoDB>=7.0.
+            singleFlight: optional SingleFlight, maybe shared with other
+                curves, so that identical concurrent gets run a single
+                aggregation, each caller receiving its own copy.
+        """
+        assert not (timeSeries and singleRevision), (
+            "Single revision upserts are not available on time-series")
         self.db = mongodb
         self.collectionName = collection
         self.collection = self.db[collection]
         self.timestamp = timestampField
         self.creation = creationField
+        self.batchSize = batchSize
+        self.rawDecode = rawDecode
+        self.stats = stats or nullStats
+        self.dates = None if datesCollection is None else self.db[datesCollection]
+        self.names = None
+        self.nameKey = 'name'
+        if namesCollection is not None:
+            self.names = NameInterner(self.db, namesCollection)
+            self.nameKey = nameIdField
+        self.singleRevision = singleRevision
+        self.counter = ShardedCounter(self.db, collection, counterShards)
+        self.topRevisions = topRevisions
+        self.timeSeries = timeSeries
+        self.singleFlight = singleFlight
+        self._serverVersion = None
+        self._indexed = False
 
-    def get(self, start, stop, filter, field, filling=None):
-        assert start.tzinfo is not None, (
-            "MongoTimeCurve.get called with naive (no timezone) start date")
+    def _nameFilter(self, name):
+        """Mongo query matching the points of a name"""
+        if self.names is None:
+            return dict(name=name)
+        if isinstance(name, dict) and list(name) == ['$in']:
+            ids = [self.names.id(x) for x in name['$in']]
+            return {self.nameKey: {'$in': [x for x in ids if x is not None]}}
+        if isinstance(name, dict):
+            return dict(name=name)
+        nameId = self.names.id(name)
+        if nameId is None:
+            return {self.nameKey: {'$in': []}}
+        return {self.nameKey: nameId}
 
-        assert stop.tzinfo is not None, (
-            "MongoTimeCurve.get called with naive (no timezone) stop date")
+    def _readCollection(self):
+        """Collection to be used on aggregation reads"""
+        if not self.rawDecode:
+            return self.collection
+        from bson.raw_bson import RawBSONDocument
+        from bson.codec_options import CodecOptions
+        return self.collection.with_options(
+            codec_options=CodecOptions(document_class=RawBSONDocument))
 
-        ndays = (stop.date()-start.date()).days+1
-        data = numpy.zeros(ndays*hoursPerDay, int)
-        if filling :
-            filldata = numpy.zeros(ndays*hoursPerDay, bool)
+    def _filters(self, start, stop, filter, quarters=False):
+        """Mongo query for the points of the curve between dates"""
         filters = {
             self.timestamp: {
                 '$gte': start,
                 '$lt': addDays(stop,1)
             },
-            "type": {"$ne" : "p4"},  # discard quarterhourly values, there are included in type=p
+            "type": "p4" if quarters else
+                {"$ne" : "p4"},  # discard quarterhourly values, there are included in type=p
         }
         if isinstance(filter, dict):
+            filter = dict(filter)
+            if 'name' in filter:
+                filters.update(self._nameFilter(filter.pop('name')))
             filters.update(filter)
-        elif filter: filters.update(name=filter)
+        elif filter: filters.update(self._nameFilter(filter))
+        return filters
+
+    def serverVersion(self):
+        """
+            Version of the mongo server as a tuple of ints,
+            empty if unknown.
+            Shared by the curves using the same client.
+        """
+        if self._serverVersion is None:
+            self._serverVersion = _clientServerVersion(self.db.client)
+        return self._serverVersion
+
+    def _useTop(self):
+        if self.topRevisions is not None:
+            return self.topRevisions
+        return self.serverVersion() >= (5,2)
+
+    def _pipeline(self, filters, fields):
+        """Aggregation pipeline adding the newest value of each name by timestamp"""
         from bson.son import SON
 
+        top = not self.singleRevision and self._useTop()
+        newest = {
+            '_id': {
+                self.timestamp: '$'+self.timestamp,
+                'name': '$'+self.nameKey,
+            },
+            self.timestamp: {'$first': '$'+self.timestamp},
+        }
+        added = {
+            '_id': '$'+self.timestamp,
+            self.timestamp: {'$first': '$'+self.timestamp},
+        }
+        for field in fields:
+            newest[field] = {'$first': '$'+field}
+            if top: newest[field] = {'$top': {
+                'sortBy': {self.creation: -1},
+                'output': '$'+field,
+            }}
+            added[field] = {'$sum': '$'+field}
+
         pipeline = [
             # pick the ones matching the filters
             {"$match":
                 filters,
             },
+        ]
+        if top: pipeline += [
+            # group all having the same timestamp and name, taking the newest
+            # without sorting every point (MongoDB>=5.2)
+            {"$group": newest},
+        ]
+        elif not self.singleRevision: pipeline += [
             # sort by timestamp, name and new firsts
             {"$sort": SON([
                 (self.timestamp, 1),
-                ("name", 1),
+                (self.nameKey, 1),
                 (self.creation, -1),
             ])},
             # group all having the same timestamp and name, pick newest on collission
-            {"$group": {
-                '_id': {
-                    self.timestamp: '$'+self.timestamp,
-                    'name': '$name',
-                },
-                self.timestamp: {'$first': '$'+self.timestamp},
-                field: {'$first': '$'+field}
-            }},
+            {"$group": newest},
+        ]
+        pipeline += [
             # Suma tots els que tenen el mateix timestamp, diferent nom
-            {"$group": {
-                '_id': '$'+self.timestamp,
-                self.timestamp: {'$first': '$'+self.timestamp},
-                field: {'$sum': '$'+field},
-            }},
+            {"$group": added},
         ]
+        return pipeline
+
+    def get(self, start, stop, filter, field=None, filling=None,
+            resolution='hourly', fields=None, splits=1):
+        """
+            Returns an array with the curve values of field between
+            start and stop dates (both included) for the points
+            matching the filter (a name or a mongo query).
+            If a list of fields is given instead of a field,
+            all of them are retrieved in a single aggregation
+            and a dict of arrays by field is returned.
+            resolution is one of 'hourly', 'quarterhourly' or
+            'hourlyFromQuarters'. See 'resolutions'.
+            If filling is true, also returns a boolean array
+            telling which positions have a point.
+            For long ranges, splits sets a number of sub-ranges
+            of whole days to be aggregated concurrently.
+        """
+        assert (field is None) != (fields is None), (
+            "MongoTimeCurve.get requires either field or fields")
+
+        assert resolution in resolutions, (
+            "MongoTimeCurve.get called with unknown resolution {}"
+            .format(resolution))
 
-        for x in self.collection.aggregate(pipeline,cursor={},allowDiskUse=True):
-            point = ns(x)
-            localTime = toLocal(asUtc(point[self.timestamp]))
-            timeindex = dateToCurveIndex (start, localTime)
-            data[timeindex]=point.get(field)
-            if filling: filldata[timeindex]=True
+        assert start.tzinfo is not None, (
+            "MongoTimeCurve.get called with naive (no timezone) start date")
+
+        assert stop.tzinfo is not None, (
+            "MongoTimeCurve.get called with naive (no timezone) stop date")
 
+        if not self._indexed:
+            self.ensureIndexes()
+
+        if self.singleFlight is None:
+            return self._get(start, stop, filter, field, filling,
+                resolution, fields, splits)
+
+        key = callKey('MongoTimeCurve.get',
+            self.db.name, self.collectionName,
+            start.isoformat(), stop.isoformat(), filter,
+            field, bool(filling), resolution, fields, splits)
+        return self.singleFlight.do(key, self._get, start, stop, filter,
+            field, filling, resolution, fields, splits)
+
+    def _get(self, start, stop, filter, field, filling,
+            resolution, fields, splits):
+        callStart = clock()
+        stats = self.stats
+        quarters = resolution != 'hourly'
+        ndays = (stop.date()-start.date()).days+1
+        slots = quartersPerDay if quarters else hoursPerDay
+        nslots = ndays*slots
+        allFields = [field] if fields is None else list(fields)
+        data = dict((f, numpy.zeros(nslots, int)) for f in allFields)
+        filldata = numpy.zeros(nslots, bool) if filling else None
+
+        nsplits = max(1, min(splits, ndays))
+        offsets = [ndays*i//nsplits for i in range(nsplits+1)]
+        ranges = [(
+            start if first == 0 else addDays(start, first),
+            addDays(start, last-1),
+            slice(first*slots, last*slots),
+            ) for first, last in zip(offsets, offsets[1:])]
+
+        def aggregate(range):
+            rangeStart, rangeStop, rangeSlots = range
+            return self._aggregateRange(rangeStart, rangeStop, filter,
+                allFields, quarters, data, filldata, rangeSlots)
+
+        if nsplits == 1:
+            npoints = aggregate(ranges[0])
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(nsplits)
+            try:
+                npoints = sum(pool.map(aggregate, ranges))
+            finally:
+                pool.close()
+                pool.join()
+
+        if resolution == 'hourlyFromQuarters':
+            with stats.timed('get', 'assembly'):
+                data = dict((f, quartersToHours(data[f])) for f in allFields)
+                if filling:
+                    filldata = filldata.reshape(-1, quartersPerHour).any(axis=1)
+
+        stats.count('get', 'documents', npoints)
+        stats.observe('get', 'total', clock()-callStart)
+
+        if fields is None: data = data[field]
         if filling: return data, filldata
         return data
 
-    def fillPoint(self, **data):
+    def _aggregateRange(self, start, stop, filter, fields, quarters,
+            data, filldata, slots):
+        """
+            Aggregates the points between start and stop dates
+            into the given slice of the data and filling arrays.
+            Returns the number of aggregated points.
+            Without rawDecode, the documents are decoded while
+            fetched, so that time is recorded as query, not decode.
+        """
+        stats = self.stats
+        pipeline = self._pipeline(
+            self._filters(start, stop, filter, quarters), fields)
+
+        options = dict(cursor={}, allowDiskUse=True)
+        if self.batchSize:
+            options.update(batchSize=self.batchSize)
+
+        with stats.timed('get', 'query'):
+            points = list(self._readCollection().aggregate(pipeline, **options))
+        with stats.timed('get', 'decode'):
+            timestamps = [x[self.timestamp] for x in points]
+            values = dict(
+                (f, [x[f] for x in points])
+                for f in fields)
+        with stats.timed('get', 'mapping'):
+            dateToIndex = dateToQuarterCurveIndex if quarters else dateToCurveIndex
+            timeindexes = [
+                dateToIndex(start, toLocal(asUtc(timestamp)))
+                for timestamp in timestamps
+            ]
+        with stats.timed('get', 'assembly'):
+            for f in fields:
+                data[f][slots][timeindexes] = values[f]
+            if filldata is not None:
+                filldata[slots][timeindexes] = True
+
+        if self.rawDecode:
+            stats.count('get', 'bytes', sum(len(x.raw) for x in points))
+        return len(points)
+
+    def checkPoint(self, data):
+        """Checks the point has the fields required by fillPoint"""
         for requiredField in ('name', 'datetime'):
             if requiredField not in data:
                 raise Exception("Missing '{}'".format(requiredField))
@@ -175,29 +624,169 @@ class MongoTimeCurve(object):
         assert data['datetime'].tzinfo is not None, (
             "MongoTimeCurve.fillPoint with naive (no timezone) datetime")
 
-        counter = self.db['counters'].find_and_modify(
-            {'_id': self.collectionName},
-            {'$inc': {'counter': 1}}
-        )
+    def _point(self, data):
+        """Checks and completes the point to be stored"""
+        self.checkPoint(data)
         timestamp = data.pop('datetime')
+        if self.names is not None:
+            data[self.nameKey] = self.names.id(data['name'], create=True)
         data.update({
             self.creation: datetime.datetime.now(),
             self.timestamp: timestamp,
             })
-        return self.collection.insert(data)
+        return data
 
-    def _firstLastDate(self, name, first=False):
-        """returns the date of the first or last item of a given name"""
+    def fillPoint(self, **data):
+        data = self._point(data)
+        if self.singleRevision:
+            return self._upsert([data])
+
+        self.counter.increment()
+        return self._insert(data)
+
+    def _insert(self, data):
+        if not self._indexed:
+            self.ensureIndexes()
+        result = self.collection.insert(data)
+        self._updateDates(data['name'], data[self.timestamp], data[self.timestamp])
+        return result
+
+    def fillPoints(self, points):
+        """
+            Writes many points, given as dicts of fillPoint parameters,
+            in a single bulk write.
+        """
+        points = [self._point(dict(point)) for point in points]
+        if self.singleRevision:
+            return self._upsert(points)
+        if not points: return None
+        if not self._indexed:
+            self.ensureIndexes()
+        self.counter.increment(len(points))
+        result = self.collection.insert_many(points)
+        self._widenDates(points)
+        return result
+
+    def ensureIndexes(self):
+        """
+            Creates the indexes the curve reads rely on.
+            In single revision mode, the unique key of the points.
+            With interned names, the (id, timestamp) index.
+            Time-series collections just have the one created by
+            createTimeSeries, since older servers do not index
+            measurement fields.
+        """
+        import pymongo
+        if self.singleRevision:
+            self.collection.create_index([
+                (self.nameKey, pymongo.ASCENDING),
+                (self.timestamp, pymongo.ASCENDING),
+                ('type', pymongo.ASCENDING),
+            ], unique=True)
+        elif self.names is not None and not self.timeSeries:
+            self.collection.create_index([
+                (self.nameKey, pymongo.ASCENDING),
+                (self.timestamp, pymongo.ASCENDING),
+            ])
+        self._indexed = True
+
+    def _upsert(self, points):
+        """Writes the points replacing any former value, in a single bulk"""
+        if not points: return None
+        import pymongo
+        if not self._indexed:
+            self.ensureIndexes()
+        result = self.collection.bulk_write([
+            pymongo.UpdateOne({
+                self.nameKey: point[self.nameKey],
+                self.timestamp: point[self.timestamp],
+                'type': point.get('type'),
+            }, {'$set': point}, upsert=True)
+            for point in points
+        ], ordered=False)
+        self._widenDates(points)
+        return result
+
+    def _widenDates(self, points):
+        """Updates the stored dates of the names of the points"""
+        names = {}
+        for point in points:
+            first, last = names.get(point['name'], (None, None))
+            timestamp = point[self.timestamp]
+            names[point['name']] = (
+                timestamp if first is None else min(first, timestamp),
+                timestamp if last is None else max(last, timestamp),
+            )
+        for name, (first, last) in names.items():
+            self._updateDates(name, first, last)
+
+    def _updateDates(self, name, first, last):
+        """Widens the stored first and last timestamps of a name"""
+        if self.dates is None: return
+        self.dates.update_one(
+            {'_id': name},
+            {
+                '$min': {'first': first},
+                '$max': {'last': last},
+            },
+            upsert=True,
+        )
+
+    def _rawBoundary(self, name, first=False):
+        """returns the first or last timestamp of a given name"""
+        import pymongo
         order = pymongo.ASCENDING if first else pymongo.DESCENDING
         for point in (self.collection
-                .find(dict(name=name))
+                .find(self._nameFilter(name))
                 .sort(self.timestamp, order)
                 .limit(1)
                 ):
-            return toLocal(asUtc(point[self.timestamp])).replace(
-                    hour=0,minute=0,second=0)
+            return point[self.timestamp]
         return None
 
+    def _boundaries(self, names, first=True, last=True):
+        """
+            Returns a dict with the (first, last) timestamps of each name,
+            (None, None) if the name has no data.
+            Uses the dates collection when available, a single read
+            for all the names, and falls back to the curve collection
+            for names still not there, storing both boundaries.
+            Without dates collection, just the requested boundaries
+            are queried, the other one being None.
+        """
+        result = {}
+        if self.dates is not None:
+            for entry in self.dates.find({'_id': {'$in': list(names)}}):
+                result[entry['_id']] = entry['first'], entry['last']
+            self.stats.count('dates', 'cache_hits', len(result))
+            first = last = True
+        for name in names:
+            if name in result: continue
+            firstStamp = self._rawBoundary(name, first=True) if first else None
+            lastStamp = None
+            if last and (firstStamp is not None or not first):
+                lastStamp = self._rawBoundary(name)
+            result[name] = firstStamp, lastStamp
+            if firstStamp is None: continue
+            self._updateDates(name, firstStamp, lastStamp)
+        return result
+
+    def _day(self, timestamp, hours=0):
+        """Local date start of a stored timestamp, shifted some hours"""
+        if timestamp is None: return None
+        return toLocal(addHours(asUtc(timestamp), hours)).replace(
+                hour=0,minute=0,second=0)
+
+    def _boundary(self, name, first=False):
+        """returns the first or last timestamp of a given name"""
+        if self.dates is None:
+            return self._rawBoundary(name, first)
+        return self._boundaries([name])[name][0 if first else 1]
+
+    def _firstLastDate(self, name, first=False):
+        """returns the date of the first or last item of a given name"""
+        return self._day(self._boundary(name, first))
+
     def firstDate(self, name):
         """returns the date of the first item of a given name"""
         return self._firstLastDate(name, first=True)
@@ -207,18 +796,54 @@ class MongoTimeCurve(object):
         return self._firstLastDate(name)
 
     def lastFullDate(self,name):
-        order = pymongo.DESCENDING
-        for point in (self.collection
-                .find(dict(name=name))
-                .sort(self.timestamp, order)
-                .limit(1)
-                ):
-            return toLocal(addHours(asUtc(point[self.timestamp]),-18)).replace(
-                    hour=0,minute=0,second=0)
+        return self._day(self._boundary(name), -18)
+
     def firstFullDate(self,name):
         # TODO: dumb implementation, having just a single hour considers whole date filled
         return self.firstDate(name)
 
+    def measurementDates(self, names, first=True, last=True):
+        """
+            Returns a dict with the (firstFullDate, lastFullDate)
+            of each name, with a single read if dates are kept.
+            If first or last is false, that date may be not
+            computed, and returned as None.
+        """
+        return dict(
+            (name, (self._day(firstStamp), self._day(lastStamp, -18)))
+            for name, (firstStamp, lastStamp)
+            in self._boundaries(names, first, last).items()
+        )
+
+    def reconcileDates(self, names=None):
+        """
+            Rebuilds the first and last timestamps of the given names,
+            or all of them, from the curve collection.
+            To be run periodically when other tools write the curves.
+            Returns the number of names having data.
+        """
+        if self.dates is None: return 0
+        match = {} if names is None else {'name': {'$in': list(names)}}
+        found = set()
+        for entry in self.collection.aggregate([
+                {'$match': match},
+                {'$group': {
+                    '_id': '$name',
+                    'first': {'$min': '$'+self.timestamp},
+                    'last': {'$max': '$'+self.timestamp},
+                }},
+            ], cursor={}, allowDiskUse=True):
+            found.add(entry['_id'])
+            self.dates.replace_one({'_id': entry['_id']}, dict(
+                first=entry['first'],
+                last=entry['last'],
+            ), upsert=True)
+        stale = {'_id': {'$nin': list(found)}}
+        if names is not None:
+            stale['_id']['$in'] = list(names)
+        self.dates.delete_many(stale)
+        return len(found)
+
     def update(self, start, filter, field, data):
         """Updates the curve with new data"""
 
@@ -232,15 +857,239 @@ class MongoTimeCurve(object):
         oldData, filling = self.get(start, stop, filter, field, filling=True)
         if type(data) == numpy.ndarray:
             data = (x.item() for x in data)
-        for i,(bin,old,f) in enumerate(zip(data,oldData,filling)):
-            curveDate = curveIndexToDate(start, i)
+        dates = curveDates(start, len(oldData)//hoursPerDay).tolist()
+        changes = []
+        for bin, old, curveDate in zip(data, oldData, dates):
             if curveDate is None: continue
             if bin == old: continue
-            self.fillPoint(
-                datetime=curveDate,
+            changes.append(dict(
+                datetime=asUtc(curveDate),
                 name=filter['name'],
                 **{field: bin}
-                )
+                ))
+
+        self.fillPoints(changes)
+
+    def compact(self, start, stop, names=None, windowDays=31,
+            archiveCollection=None, progressCollection=None,
+            batchSize=1000):
+        """
+            Removes the superseded revisions of the points between
+            start and stop dates (both included), keeping just the
+            newest one for each name, timestamp and type.
+            If archiveCollection is given, removed points are copied
+            there before removing them.
+            Work is done by name and windows of windowDays days.
+            If progressCollection is given, finished windows are
+            recorded there, by run (start, stop and windowDays) and name,
+            and skipped when the same run is repeated, so an interrupted
+            compaction resumes where it stopped. Once the run finishes
+            its records are removed, so later runs compact again
+            the revisions written since.
+            Returns the number of removed points.
+        """
+        assert start.tzinfo is not None, (
+            "MongoTimeCurve.compact called with naive (no timezone) start date")
+        assert stop.tzinfo is not None, (
+            "MongoTimeCurve.compact called with naive (no timezone) stop date")
+        assert not self.timeSeries or self.serverVersion() >= (7,0), (
+            "Removing time-series points requires MongoDB>=7.0")
+
+        end = addDays(stop, 1)
+        if names is None:
+            # key=str since names may mix ints and strings
+            names = sorted(self.collection.distinct('name', {
+                self.timestamp: {'$gte': start, '$lt': end},
+            }), key=str)
+        archive = None if archiveCollection is None else self.db[archiveCollection]
+        progress = None if progressCollection is None else self.db[progressCollection]
+
+        run = dict(
+            collection=self.collectionName,
+            start=start.isoformat(),
+            stop=stop.isoformat(),
+            windowDays=windowDays,
+            )
+        removed = 0
+        for name in names:
+            progressId = dict(run, name=name)
+            done = progress is not None and progress.find_one({'_id': progressId})
+            windowStart = start
+            while windowStart < end:
+                windowEnd = min(addDays(windowStart, windowDays), end)
+                if not done or asUtc(done['done']) < windowEnd:
+                    removed += self._compactWindow(name,
+                        windowStart, windowEnd, archive, batchSize)
+                    if progress is not None:
+                        progress.replace_one({'_id': progressId},
+                            dict(done=windowEnd), upsert=True)
+                windowStart = windowEnd
+        if progress is not None:
+            progress.delete_many(dict(
+                ('_id.'+key, value) for key, value in run.items()))
+        return removed
+
+    def _compactWindow(self, name, start, end, archive, batchSize):
+        """Removes superseded revisions of a name in [start, end)"""
+        filters = self._nameFilter(name)
+        filters[self.timestamp] = {'$gte': start, '$lt': end}
+        from bson.son import SON
+        superseded = []
+        for revisions in self.collection.aggregate([
+                {'$match': filters},
+                {'$sort': SON([
+                    (self.timestamp, 1),
+                    (self.creation, -1),
+                ])},
+                {'$group': {
+                    '_id': {
+                        self.timestamp: '$'+self.timestamp,
+                        'type': '$type',
+                    },
+                    'ids': {'$push': '$_id'},
+                }},
+                {'$match': {'ids.1': {'$exists': True}}},
+            ], cursor={}, allowDiskUse=True):
+            superseded += revisions['ids'][1:]
+
+        for i in range(0, len(superseded), batchSize):
+            batch = superseded[i:i+batchSize]
+            if archive is not None:
+                self._archive(archive, batch)
+            self.collection.delete_many({'_id': {'$in': batch}})
+        return len(superseded)
+
+    def createTimeSeries(self, granularity='hours'):
+        """
+            Creates the curve collection as a time-series collection,
+            having the timestamp as timeField and the name as metaField,
+            and the index by name and timestamp the reads use.
+            An existing collection is left as is.
+            granularity: 'hours' or, for quarter hourly curves, 'minutes'
+        """
+        import pymongo
+        if self.collectionName not in self.db.list_collection_names():
+            self.db.create_collection(self.collectionName, timeseries=dict(
+                timeField=self.timestamp,
+                metaField='name',
+                granularity=granularity,
+            ))
+        self.collection.create_index([
+            ('name', pymongo.ASCENDING),
+            (self.timestamp, pymongo.ASCENDING),
+        ])
+
+    def migrateFrom(self, sourceCollection, batchSize=1000,
+            progressCollection=None):
+        """
+            Copies every point, revisions included, of a plain
+            curve collection into this one (ie. a time-series one),
+            in bulk inserts of batchSize points.
+            If progressCollection is given, the last copied point
+            is recorded there, so an interrupted copy resumes after it.
+            Points of a batch inserted but not recorded are copied
+            twice, which is harmless since both revisions are equal.
+            Returns the number of copied points.
+        """
+        import pymongo
+        source = self.db[sourceCollection]
+        progress = None if progressCollection is None else self.db[progressCollection]
+        progressId = dict(source=sourceCollection, target=self.collectionName)
+        query = {}
+        done = progress is not None and progress.find_one({'_id': progressId})
+        if done:
+            query = {'_id': {'$gt': done['last']}}
+
+        copied = 0
+        batch = []
+        cursor = source.find(query).sort('_id', pymongo.ASCENDING)
+        for point in cursor:
+            batch.append(point)
+            if len(batch) < batchSize: continue
+            copied += self._copyBatch(batch, progress, progressId)
+            batch = []
+        if batch:
+            copied += self._copyBatch(batch, progress, progressId)
+        return copied
+
+    def _copyBatch(self, points, progress, progressId):
+        last = points[-1]['_id']
+        for point in points:
+            del point['_id']
+        self.collection.insert_many(points, ordered=False)
+        self._widenDates(points)
+        if progress is not None:
+            progress.replace_one({'_id': progressId},
+                dict(last=last), upsert=True)
+        return len(points)
+
+    def stampNameIds(self, batchSize=1000, progressCollection=None):
+        """
+            Sets the name id on the points lacking it, those written
+            before interning names or by other tools, so that
+            interned reads see them.
+            Points are updated in bulks of batchSize points.
+            Since stamped points are not selected again, an interrupted
+            run just resumes by running it again. If progressCollection
+            is given, the last stamped point is also recorded there,
+            so the resumed run does not scan the points already done.
+            Returns the number of stamped points.
+        """
+        assert self.names is not None, (
+            "MongoTimeCurve.stampNameIds requires a namesCollection")
+        assert not self.timeSeries or self.serverVersion() >= (7,0), (
+            "Updating time-series points requires MongoDB>=7.0")
+        import pymongo
+        if not self._indexed:
+            self.ensureIndexes()
+        progress = None if progressCollection is None else self.db[progressCollection]
+        progressId = dict(collection=self.collectionName, stamp=self.nameKey)
+        query = {self.nameKey: {'$exists': False}}
+        done = progress is not None and progress.find_one({'_id': progressId})
+        if done:
+            query['_id'] = {'$gt': done['last']}
+
+        stamped = 0
+        batch = []
+        cursor = (self.collection
+            .find(query, projection=['name'])
+            .sort('_id', pymongo.ASCENDING))
+        for point in cursor:
+            batch.append(point)
+            if len(batch) < batchSize: continue
+            stamped += self._stampBatch(batch, progress, progressId)
+            batch = []
+        if batch:
+            stamped += self._stampBatch(batch, progress, progressId)
+        return stamped
+
+    def _stampBatch(self, points, progress, progressId):
+        import pymongo
+        ids = {}
+        for point in points:
+            ids.setdefault(point['name'], []).append(point['_id'])
+        self.collection.bulk_write([
+            pymongo.UpdateMany(
+                {'_id': {'$in': pointIds}},
+                {'$set': {self.nameKey: self.names.id(name, create=True)}})
+            for name, pointIds in ids.items()
+        ], ordered=False)
+        if progress is not None:
+            progress.replace_one({'_id': progressId},
+                dict(last=points[-1]['_id']), upsert=True)
+        return len(points)
+
+    def _archive(self, archive, ids):
+        from pymongo.errors import BulkWriteError
+        points = list(self.collection.find({'_id': {'$in': ids}}))
+        if not points: return
+        try:
+            archive.insert_many(points, ordered=False)
+        except BulkWriteError as e:
+            # Already archived by an interrupted run
+            if any(error['code'] != 11000
+                    for error in e.details['writeErrors']):
+                raise
 
 
 
@@ -2,8 +2,12 @@
 
 from .mongotimecurve import (
     MongoTimeCurve,
+    ShardedCounter,
     dateToCurveIndex,
     curveIndexToDate,
+    curveDates,
+    dateToQuarterCurveIndex,
+    quartersToHours,
     )
 from somutils.isodates import (
     asUtc,
@@ -13,8 +17,9 @@ from somutils.isodates import (
     assertLocalDateTime,
     )
 from . import testutils # proper ids
-import pymongo
 import datetime
+import mock
+import threading
 
 import unittest
 
@@ -23,6 +28,11 @@ def localTime(string):
     if isSummer: string=string[:-1]
     return parseLocalTime(string, isSummer)
 
+def collectionTruthinessForbidden(collection):
+    """As pymongo>=4 does, which raises on bool(collection)"""
+    return mock.patch.object(type(collection), '__bool__', create=True,
+        side_effect=NotImplementedError("Collection has no truth value"))
+
 
 class CurveDatetimeMapper_Test(unittest.TestCase):
 
@@ -199,24 +209,103 @@ class CurveDatetimeMapper_Test(unittest.TestCase):
             curveIndexToDate(localisodate("2016-3-26"), 50),
             localTime("2016-3-28 00:00:00"))
 
+    def test_dateToQuarterCurveIndex_firstQuarter(self):
+       self.assertEqual(
+            dateToQuarterCurveIndex(
+                localisodate("2016-08-15"),
+                localTime("2016-08-15 01:00:00")
+                ), 4)
+
+    def test_dateToQuarterCurveIndex_lastQuarter(self):
+       self.assertEqual(
+            dateToQuarterCurveIndex(
+                localisodate("2016-08-15"),
+                localTime("2016-08-15 01:45:00")
+                ), 7)
+
+    def test_dateToQuarterCurveIndex_afterSummerToWinterChange(self):
+       self.assertEqual(
+            dateToQuarterCurveIndex(
+                localisodate("2016-10-30"),
+                localTime("2016-10-30 02:15:00")
+                ), 13)
+
+    def test_dateToQuarterCurveIndex_nextDay(self):
+       self.assertEqual(
+            dateToQuarterCurveIndex(
+                localisodate("2016-08-15"),
+                localTime("2016-08-16 00:30:00")
+                ), 102)
+
+    def assertCurveDatesEquivalent(self, start, ndays):
+        start = localisodate(start)
+        expected = [
+            curveIndexToDate(start, i)
+            for i in range(ndays*25)
+        ]
+        self.assertEqual(
+            [date and asUtc(date) for date in curveDates(start, ndays).tolist()],
+            [date and asUtc(date) for date in expected])
+
+    def test_curveDates_noChange(self):
+        dates = curveDates(localisodate('2016-08-15'), 1)
+        self.assertEqual(str(dates[0]), '2016-08-14T22:00')
+        self.assertEqual(str(dates[23]), '2016-08-15T21:00')
+        self.assertEqual(str(dates[24]), 'NaT')
+
+    def test_curveDates_winter(self):
+        dates = curveDates(localisodate('2016-12-25'), 1)
+        self.assertEqual(str(dates[0]), '2016-12-24T23:00')
+        self.assertEqual(str(dates[24]), 'NaT')
+
+    def test_curveDates_summerToWinter_noPadding(self):
+        dates = curveDates(localisodate('2016-10-30'), 1)
+        self.assertEqual(str(dates[2]), '2016-10-30T00:00')
+        self.assertEqual(str(dates[3]), '2016-10-30T01:00')
+        self.assertEqual(str(dates[24]), '2016-10-30T22:00')
+
+    def test_curveDates_winterToSummer_twoPaddings(self):
+        dates = curveDates(localisodate('2016-03-27'), 1)
+        self.assertEqual(str(dates[22]), '2016-03-27T21:00')
+        self.assertEqual([str(x) for x in dates[23:]], ['NaT', 'NaT'])
+
+    def test_curveDates_noDays(self):
+        self.assertEqual(len(curveDates(localisodate('2016-03-27'), 0)), 0)
+
+    def test_curveDates_equivalentToCurveIndexToDate_acrossChanges(self):
+        self.assertCurveDatesEquivalent('2016-03-20', 240)
+
+    def test_curveDates_equivalentToCurveIndexToDate_acrossYears(self):
+        self.assertCurveDatesEquivalent('2015-10-20', 400)
+
+    def test_curveDates_tenYears(self):
+        dates = curveDates(localisodate('2015-01-01'), 3653)
+        self.assertEqual(len(dates), 3653*25)
+
+    def test_quartersToHours(self):
+        self.assertEqual(
+            list(quartersToHours([1,2,3,4]+4*[0]+92*[1])),
+            [10,0]+23*[4])
+
 
 
 class MongoTimeCurve_Test(unittest.TestCase):
 
     def setUp(self):
-        self.databasename = 'generationkwh_test'
         self.collection = 'generation'
-
-        c = pymongo.MongoClient()
-        c.drop_database(self.databasename)
-        self.db = c[self.databasename]
-
-    def tearDown(self):
-        c = pymongo.MongoClient()
-        c.drop_database('generationkwh_test')
+        testutils.setUpMongo(self)
     
-    def curve(self):
-        return MongoTimeCurve(self.db, self.collection)
+    def curve(self, **kwds):
+        return MongoTimeCurve(self.db, self.collection, **kwds)
+
+    def setupPlainPoints(self, points):
+        plain = MongoTimeCurve(self.db, self.collection)
+        for datetime, plant, value in points:
+            plain.fillPoint(
+                datetime=localTime(datetime),
+                name=plant,
+                ae=value,
+                )
 
     def setupPoints(self, points):
         mtc = self.curve()
@@ -381,6 +470,8 @@ class MongoTimeCurve_Test(unittest.TestCase):
             +23*[0]+[30,0])
 
     def test_get_sameNameAndDate_prioritizesNewest(self):
+        testutils.skipIfMongomock(self,
+            "unstable sort on creation dates tied at ms resolution")
         mtc = self.setupPoints([
             ('2015-01-01 23:00:00', 'miplanta', 10),
             ])
@@ -468,6 +559,310 @@ class MongoTimeCurve_Test(unittest.TestCase):
             list(curve),
             [1,0,2,3]+20*[0]+[4])
 
+    def test_get_withBatchSize(self):
+        self.setupPoints([
+            ('2015-01-01 01:00:00', 'miplanta', 10),
+            ('2015-01-01 02:00:00', 'miplanta', 20),
+            ('2015-01-01 03:00:00', 'miplanta', 30),
+            ])
+        mtc = self.curve(batchSize=2)
+
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter=dict(name='miplanta'),
+            field='ae',
+            )
+        self.assertEqual(
+            list(curve),
+            [0,10,20,30]+21*[0])
+
+    def test_get_rawDecode(self):
+        testutils.skipIfMongomock(self, "raw bson codec options")
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-01 23:00:00', 'otraplanta', 20),
+            ])
+        mtc = self.curve(rawDecode=True)
+
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter=None,
+            field='ae',
+            )
+        self.assertEqual(
+            list(curve),
+            +23*[0]+[30,0])
+
+    def test_get_withStats(self):
+        from .instrumentation import CurveStats
+        self.setupPoints([
+            ('2015-01-01 01:00:00', 'miplanta', 10),
+            ('2015-01-01 02:00:00', 'miplanta', 20),
+            ])
+        stats = CurveStats()
+        mtc = self.curve(stats=stats)
+
+        mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter=dict(name='miplanta'),
+            field='ae',
+            )
+        self.assertEqual(sorted(stats.histograms), [
+            ('get', 'assembly'),
+            ('get', 'decode'),
+            ('get', 'mapping'),
+            ('get', 'query'),
+            ('get', 'total'),
+            ])
+        self.assertEqual(stats.counters, {('get', 'documents'): 2})
+
+    def setupQuarterPoints(self, points):
+        mtc = self.curve()
+        for datetime, plant, value in points:
+            mtc.fillPoint(
+                datetime=localTime(datetime),
+                name=plant,
+                type='p4',
+                ae=value,
+            )
+        return mtc
+
+    def test_get_quarterhourly(self):
+        self.setupQuarterPoints([
+            ('2015-01-01 00:00:00', 'miplanta', 1),
+            ('2015-01-01 00:45:00', 'miplanta', 2),
+            ('2015-01-01 23:15:00', 'miplanta', 3),
+            ])
+        mtc = self.setupPoints([
+            ('2015-01-01 01:00:00', 'miplanta', 10),
+            ])
+
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
+            resolution='quarterhourly',
+            )
+        self.assertEqual(
+            list(curve),
+            [1,0,0,2]+88*[0]+[0,3,0,0]+4*[0])
+
+    def test_get_hourlyFromQuarters(self):
+        self.setupQuarterPoints([
+            ('2015-01-01 00:00:00', 'miplanta', 1),
+            ('2015-01-01 00:45:00', 'miplanta', 2),
+            ('2015-01-01 23:15:00', 'miplanta', 3),
+            ])
+        mtc = self.setupPoints([
+            ('2015-01-01 01:00:00', 'miplanta', 10),
+            ])
+
+        curve, filling = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
+            filling=True,
+            resolution='hourlyFromQuarters',
+            )
+        self.assertEqual(list(curve), [3]+22*[0]+[3,0])
+        self.assertEqual(list(filling), [True]+22*[False]+[True,False])
+
+    def test_get_hourly_ignoresQuarters(self):
+        self.setupQuarterPoints([
+            ('2015-01-01 00:00:00', 'miplanta', 1),
+            ])
+        mtc = self.setupPoints([
+            ('2015-01-01 01:00:00', 'miplanta', 10),
+            ])
+
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
+            )
+        self.assertEqual(list(curve), [0,10]+23*[0])
+
+    def test_get_unknownResolution(self):
+        mtc = self.curve()
+        with self.assertRaises(AssertionError) as ctx:
+            mtc.get(
+                start=localisodate('2015-01-01'),
+                stop=localisodate('2015-01-01'),
+                filter='miplanta',
+                field='ae',
+                resolution='daily',
+                )
+        self.assertEqual(ctx.exception.args[0],
+            "MongoTimeCurve.get called with unknown resolution daily")
+
+    def test_get_manyFields(self):
+        mtc = self.curve()
+        for hour, ae, ai in [
+                ('2015-01-01 21:00:00', 10, 1),
+                ('2015-01-01 23:00:00', 20, 2),
+                ]:
+            mtc.fillPoint(
+                datetime=localTime(hour),
+                name='miplanta',
+                ae=ae,
+                ai=ai,
+            )
+        result = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            fields=['ae', 'ai'],
+            )
+        self.assertEqual(sorted(result), ['ae', 'ai'])
+        self.assertEqual(list(result['ae']), 21*[0]+[10,0,20,0])
+        self.assertEqual(list(result['ai']), 21*[0]+[1,0,2,0])
+
+    def test_get_manyFields_withFilling(self):
+        mtc = self.curve()
+        mtc.fillPoint(
+            datetime=localTime('2015-01-01 23:00:00'),
+            name='miplanta',
+            ae=10,
+            ai=1,
+        )
+        result, filling = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            fields=['ae', 'ai'],
+            filling=True,
+            )
+        self.assertEqual(list(result['ai']), 23*[0]+[1,0])
+        self.assertEqual(list(filling), 23*[False]+[True,False])
+
+    def test_get_fieldAndFields(self):
+        mtc = self.curve()
+        with self.assertRaises(AssertionError) as ctx:
+            mtc.get(
+                start=localisodate('2015-01-01'),
+                stop=localisodate('2015-01-01'),
+                filter='miplanta',
+                field='ae',
+                fields=['ae', 'ai'],
+                )
+        self.assertEqual(ctx.exception.args[0],
+            "MongoTimeCurve.get requires either field or fields")
+
+    def test_get_splits_crossingDaylightChanges(self):
+        mtc = self.setupPoints([
+            ('2015-03-28 23:00:00', 'miplanta', 1),
+            ('2015-03-29 01:00:00', 'miplanta', 2),
+            ('2015-03-29 03:00:00S', 'miplanta', 3),
+            ('2015-03-30 00:00:00S', 'miplanta', 4),
+            ('2015-10-25 02:00:00S', 'miplanta', 5),
+            ('2015-10-25 02:00:00', 'miplanta', 6),
+            ('2015-10-26 00:00:00', 'miplanta', 7),
+            ])
+        def get(**kwds):
+            return mtc.get(
+                start=localisodate('2015-03-28'),
+                stop=localisodate('2015-10-26'),
+                filter='miplanta',
+                field='ae',
+                filling=True,
+                **kwds)
+
+        curve, filling = get()
+        for splits in 2, 3, 7, 300:
+            splitCurve, splitFilling = get(splits=splits)
+            self.assertEqual(list(splitCurve), list(curve))
+            self.assertEqual(list(splitFilling), list(filling))
+        self.assertEqual(curve.sum(), 28)
+        self.assertEqual(filling.sum(), 7)
+
+    def test_get_splits_aggregatesEachRange(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 00:00:00', 'miplanta', 1),
+            ('2015-01-02 23:00:00', 'miplanta', 2),
+            ('2015-01-03 00:00:00', 'miplanta', 3),
+            ])
+        collection = mtc._readCollection()
+        with mock.patch.object(type(collection), 'aggregate',
+                autospec=True, side_effect=type(collection).aggregate,
+                ) as aggregate:
+            curve = mtc.get(
+                start=localisodate('2015-01-01'),
+                stop=localisodate('2015-01-03'),
+                filter='miplanta',
+                field='ae',
+                splits=2,
+                )
+        self.assertEqual(aggregate.call_count, 2)
+        self.assertEqual(list(curve),
+            [1]+24*[0]
+            +23*[0]+[2,0]
+            +[3]+24*[0]
+            )
+
+    def test_get_splits_quarterhourly(self):
+        self.setupQuarterPoints([
+            ('2015-01-01 00:45:00', 'miplanta', 1),
+            ('2015-01-02 00:15:00', 'miplanta', 2),
+            ])
+        mtc = self.curve()
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-02'),
+            filter='miplanta',
+            field='ae',
+            resolution='hourlyFromQuarters',
+            splits=2,
+            )
+        self.assertEqual(list(curve), [1]+24*[0]+[2]+24*[0])
+
+    def test_get_singleFlight_concurrentCallsShareAggregation(self):
+        import time
+        from .singleflight import SingleFlight
+        from .instrumentation import CurveStats
+        self.setupPoints([
+            ('2015-01-01 01:00:00', 'miplanta', 10),
+            ])
+        stats = CurveStats()
+        flight = SingleFlight(stats)
+        gate = threading.Event()
+        mtc = self.curve(singleFlight=flight)
+        _get = mtc._get
+        def slowGet(*args):
+            gate.wait(2)
+            return _get(*args)
+
+        results = []
+        def call(name='miplanta'):
+            results.append(self.curve(singleFlight=flight).get(
+                start=localisodate('2015-01-01'),
+                stop=localisodate('2015-01-01'),
+                filter=dict(name=name),
+                field='ae',
+                ))
+
+        with mock.patch.object(MongoTimeCurve, '_get',
+                autospec=True, side_effect=lambda self, *args: slowGet(*args),
+                ) as get:
+            threads = [threading.Thread(target=call) for i in range(3)]
+            threads.append(threading.Thread(target=call, args=('otraplanta',)))
+            for thread in threads: thread.start()
+            start = time.time()
+            while (stats.counters.get(('singleflight', 'shared'), 0) < 2
+                    and time.time() - start < 2):
+                time.sleep(0.005)
+            gate.set()
+            for thread in threads: thread.join(2)
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(sorted(list(x) for x in results),
+            [25*[0]]+3*[[0,10]+23*[0]])
+
     def test_fillPoint_complaintsMissingDatetime(self):
         mtc = self.curve()
         with self.assertRaises(Exception) as ass:
@@ -528,6 +923,42 @@ class MongoTimeCurve_Test(unittest.TestCase):
         lastdate = mtc.lastDate('miplanta')
         self.assertEqual(lastdate,localisodate('2015-01-02'))
 
+    def test_measurementDates_firstOnly_queriesFirst(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-03 23:00:00', 'miplanta', 30),
+            ])
+        if mtc.dates is not None:
+            self.skipTest("Dates collection keeps both boundaries")
+        with mock.patch.object(mtc, '_rawBoundary',
+                wraps=mtc._rawBoundary) as rawBoundary:
+            dates = mtc.measurementDates(['miplanta', 'nodata'], last=False)
+        self.assertEqual(dates, {
+            'miplanta': (localisodate('2015-01-01'), None),
+            'nodata': (None, None),
+            })
+        self.assertEqual(rawBoundary.call_args_list, [
+            mock.call('miplanta', first=True),
+            mock.call('nodata', first=True),
+            ])
+
+    def test_measurementDates_lastOnly_queriesLast(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-03 23:00:00', 'miplanta', 30),
+            ])
+        if mtc.dates is not None:
+            self.skipTest("Dates collection keeps both boundaries")
+        with mock.patch.object(mtc, '_rawBoundary',
+                wraps=mtc._rawBoundary) as rawBoundary:
+            dates = mtc.measurementDates(['miplanta'], first=False)
+        self.assertEqual(dates, {
+            'miplanta': (None, localisodate('2015-01-03')),
+            })
+        self.assertEqual(rawBoundary.call_args_list, [
+            mock.call('miplanta'),
+            ])
+
     def test_firstDate_whenNoPoint_returnsNone(self):
         mtc = self.setupPoints([
             ])
@@ -705,6 +1136,68 @@ class MongoTimeCurve_Test(unittest.TestCase):
             [True]+24*[False]
             )
 
+    def counterValue(self):
+        counter = self.db['counters'].find_one({'_id': self.collection})
+        return counter and counter['counter']
+
+    def test_fillPoint_incrementsCounter(self):
+        if self.curve().singleRevision:
+            self.skipTest("Counter not used in single revision mode")
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-02 23:00:00', 'miplanta', 10),
+            ])
+        self.assertEqual(self.counterValue(), 2)
+
+    def test_fillPoints(self):
+        mtc = self.curve()
+        mtc.fillPoints([
+            dict(datetime=localTime('2015-01-01 22:00:00'), name='miplanta', ae=10),
+            dict(datetime=localTime('2015-01-01 23:00:00'), name='miplanta', ae=20),
+            ])
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
+            )
+        self.assertEqual(list(curve), 22*[0]+[10,20,0])
+        self.assertEqual(mtc.lastDate('miplanta'),
+            localisodate('2015-01-01'))
+
+    def test_fillPoints_missingField(self):
+        mtc = self.curve()
+        with self.assertRaises(Exception) as ctx:
+            mtc.fillPoints([dict(name='miplanta', ae=10)])
+        self.assertEqual(ctx.exception.args[0], "Missing 'datetime'")
+
+    def test_update_incrementsCounterOnce(self):
+        mtc = self.curve()
+        if mtc.singleRevision:
+            self.skipTest("Counter not used in single revision mode")
+        with mock.patch.object(mtc.counter, 'increment',
+                wraps=mtc.counter.increment) as increment:
+            mtc.update(
+                start=localisodate('2015-08-15'),
+                filter=dict(name='miplanta'),
+                field='ae',
+                data=[1,2,3]+22*[0],
+                )
+        increment.assert_called_once_with(3)
+        self.assertEqual(self.counterValue(), 3)
+
+    def test_fillPoints_shardedCounter_countsEveryPoint(self):
+        mtc = self.curve(counterShards=4)
+        if mtc.singleRevision:
+            self.skipTest("Counter not used in single revision mode")
+        for i in range(5):
+            mtc.fillPoints([
+                dict(datetime=localTime('2015-01-01 22:00:00'), name='miplanta', ae=10),
+                dict(datetime=localTime('2015-01-01 23:00:00'), name='miplanta', ae=20),
+                ])
+        mtc.fillPoint(datetime=localTime('2015-01-01 22:00:00'), name='miplanta', ae=10)
+        self.assertEqual(mtc.counter.total(), 11)
+
     def test_get_withFilledGap(self):
 
         mtc = self.setupPoints([])
@@ -802,13 +1295,959 @@ class MongoTimeCurve_Test(unittest.TestCase):
             +24*[True]+[False]
         )
 
+    def setupRevisions(self, points):
+        """Points with explicit creation times to avoid ties"""
+        mtc = self.curve()
+        if mtc.singleRevision:
+            self.skipTest("No revisions are kept in single revision mode")
+        for datetime, plant, value, created in points:
+            mtc.fillPoint(
+                datetime=localTime(datetime),
+                name=plant,
+                ae=value,
+            )
+            self.db[self.collection].update_one(
+                {'name': plant, 'ae': value},
+                {'$set': {mtc.creation: localTime(created)}})
+        return mtc
+
+    def getDay(self, mtc, day, name='miplanta'):
+        return list(mtc.get(
+            start=localisodate(day),
+            stop=localisodate(day),
+            filter=name,
+            field='ae',
+            ))
+
+    def test_compact_removesSupersededRevisions(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 30, '2015-02-02 00:00:00'),
+            ('2015-01-01 22:00:00', 'miplanta', 40, '2015-02-01 00:00:00'),
+            ])
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'))
+
+        self.assertEqual(removed, 2)
+        self.assertEqual(
+            sorted(x['ae'] for x in self.db[self.collection].find()),
+            [20, 40])
+        self.assertEqual(self.getDay(mtc, '2015-01-01'),
+            22*[0]+[40,20,0])
+
+    def test_compact_otherNamesAndDatesKept(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'otraplanta', 20, '2015-02-02 00:00:00'),
+            ('2015-01-02 23:00:00', 'miplanta', 30, '2015-02-03 00:00:00'),
+            ])
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-02'))
+
+        self.assertEqual(removed, 0)
+        self.assertEqual(self.db[self.collection].count_documents({}), 3)
+
+    def test_compact_outsideRange_kept(self):
+        mtc = self.setupRevisions([
+            ('2015-01-02 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-02 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ])
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'))
+
+        self.assertEqual(removed, 0)
+
+    def test_compact_byWindows(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ('2015-01-03 23:00:00', 'miplanta', 30, '2015-02-01 00:00:00'),
+            ('2015-01-03 23:00:00', 'miplanta', 40, '2015-02-03 00:00:00'),
+            ])
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-03'),
+            windowDays=1, batchSize=1)
+
+        self.assertEqual(removed, 2)
+        self.assertEqual(
+            sorted(x['ae'] for x in self.db[self.collection].find()),
+            [20, 40])
+
+    def test_compact_archives(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ])
+        mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'),
+            archiveCollection='archive')
+
+        self.assertEqual(
+            [x['ae'] for x in self.db['archive'].find()],
+            [10])
+
+    def test_compact_resumesFromProgress(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ('2015-01-02 23:00:00', 'miplanta', 30, '2015-02-01 00:00:00'),
+            ('2015-01-02 23:00:00', 'miplanta', 40, '2015-02-03 00:00:00'),
+            ])
+        # As if an interrupted run of the same range finished the first day
+        self.db['progress'].insert_one({
+            '_id': dict(
+                collection=self.collection,
+                start=localisodate('2015-01-01').isoformat(),
+                stop=localisodate('2015-01-02').isoformat(),
+                windowDays=1,
+                name='miplanta',
+                ),
+            'done': localisodate('2015-01-02'),
+            })
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-02'),
+            windowDays=1, progressCollection='progress')
+
+        self.assertEqual(removed, 1)
+        self.assertEqual(
+            sorted(x['ae'] for x in self.db[self.collection].find()),
+            [10, 20, 40])
+
+    def test_compact_withProgress_collectionTruthinessNotUsed(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ])
+        with collectionTruthinessForbidden(self.db['progress']):
+            removed = mtc.compact(
+                localisodate('2015-01-01'), localisodate('2015-01-01'),
+                progressCollection='progress')
+        self.assertEqual(removed, 1)
+
+    def test_compact_mixedIntAndStringNames(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ('2015-01-01 23:00:00', 501215455, 30, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 501215455, 40, '2015-02-03 00:00:00'),
+            ])
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'))
+        self.assertEqual(removed, 2)
+        self.assertEqual(
+            sorted(x['ae'] for x in self.db[self.collection].find()),
+            [20, 40])
+
+    def test_compact_withProgress_finishedRunCleared(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ])
+        mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'),
+            progressCollection='progress')
+
+        self.assertEqual(self.db['progress'].count_documents({}), 0)
+
+    def test_compact_withProgress_rerunAfterNewRevisions(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ])
+        mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'),
+            progressCollection='progress')
+        self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 30, '2015-02-04 00:00:00'),
+            ])
+
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'),
+            progressCollection='progress')
+
+        self.assertEqual(removed, 1)
+        self.assertEqual(
+            sorted(x['ae'] for x in self.db[self.collection].find()),
+            [30])
+
+    def test_compact_withProgress_otherRangeNotSkipped(self):
+        mtc = self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ])
+        # An interrupted run of a later range
+        self.db['progress'].insert_one({
+            '_id': dict(
+                collection=self.collection,
+                start=localisodate('2015-04-01').isoformat(),
+                stop=localisodate('2015-04-30').isoformat(),
+                windowDays=31,
+                name='miplanta',
+                ),
+            'done': localisodate('2015-05-01'),
+            })
+        removed = mtc.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'),
+            names=['miplanta'], progressCollection='progress')
+
+        self.assertEqual(removed, 1)
+        self.assertEqual(self.db['progress'].count_documents({}), 1)
+
+
+class ShardedCounter_Test(unittest.TestCase):
+
+    def setUp(self):
+        testutils.setUpMongo(self)
+
+    def counterValue(self):
+        return self.db['counters'].find_one({'_id': 'mycounter'})['counter']
+
+    def test_increment_unsharded_incrementsFormerDocument(self):
+        counter = ShardedCounter(self.db, 'mycounter')
+        counter.increment()
+        counter.increment(3)
+        self.assertEqual(self.counterValue(), 4)
+        self.assertEqual(self.db['counters'].count_documents({}), 1)
+
+    def test_total_continuesExistingCounter(self):
+        self.db['counters'].insert_one({'_id': 'mycounter', 'counter': 10})
+        counter = ShardedCounter(self.db, 'mycounter', shards=3)
+        counter.increment(2)
+        self.assertEqual(counter.total(), 12)
+
+    def test_total_noIncrements(self):
+        counter = ShardedCounter(self.db, 'mycounter', shards=3)
+        self.assertEqual(counter.total(), 0)
+
+    def test_increment_sharded_spreadsAndSums(self):
+        counter = ShardedCounter(self.db, 'mycounter', shards=4)
+        with mock.patch('random.randrange', side_effect=[0, 1, 3, 3]):
+            for i in range(4):
+                counter.increment(2)
+        self.assertEqual(
+            sorted((x['_id'], x['counter'])
+                for x in self.db['counters'].find()), [
+            ('mycounter', 2),
+            ('mycounter:1', 2),
+            ('mycounter:3', 4),
+        ])
+        self.assertEqual(counter.total(), 8)
+
+    def test_total_ignoresOtherCounters(self):
+        self.db['counters'].insert_one({'_id': 'othercounter', 'counter': 10})
+        counter = ShardedCounter(self.db, 'mycounter', shards=2)
+        counter.increment(5)
+        self.assertEqual(counter.total(), 5)
+
+    def test_increment_concurrentThreads_noneLost(self):
+        counter = ShardedCounter(self.db, 'mycounter', shards=3)
+        def write():
+            for i in range(50):
+                counter.increment(2)
+        threads = [threading.Thread(target=write) for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(counter.total(), 400)
+
 
 class MongoTimeCurveNew_Test(MongoTimeCurve_Test):
-    def curve(self):
+    def curve(self, **kwds):
         return MongoTimeCurve(self.db, self.collection,
             creationField = 'create_date', 
             timestampField = 'utc_gkwh_timestamp',
+            **kwds)
+
+
+class MongoTimeCurveDates_Test(MongoTimeCurve_Test):
+    def curve(self, **kwds):
+        return MongoTimeCurve(self.db, self.collection,
+            datesCollection = 'generation_dates',
+            **kwds)
+
+    def test_measurementDates(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-03 23:00:00', 'miplanta', 30),
+            ('2015-01-02 10:00:00', 'otraplanta', 30),
+            ])
+
+        self.assertEqual(mtc.measurementDates(['miplanta', 'otraplanta', 'nodata']), {
+            'miplanta': (localisodate('2015-01-01'), localisodate('2015-01-03')),
+            'otraplanta': (localisodate('2015-01-02'), localisodate('2015-01-01')),
+            'nodata': (None, None),
+            })
+
+    def test_measurementDates_singleRead(self):
+        from .instrumentation import CurveStats
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-02 10:00:00', 'otraplanta', 30),
+            ])
+        stats = CurveStats()
+        mtc = self.curve(stats=stats)
+        mtc.measurementDates(['miplanta', 'otraplanta'])
+        self.assertEqual(stats.counters, {('dates', 'cache_hits'): 2})
+
+    def test_measurementDates_firstOnly_storesBoth(self):
+        self.setupPlainPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-03 23:00:00', 'miplanta', 30),
+            ])
+        mtc = self.curve()
+        self.assertEqual(mtc.measurementDates(['miplanta'], last=False), {
+            'miplanta': (localisodate('2015-01-01'), localisodate('2015-01-03')),
+            })
+        entry = self.db['generation_dates'].find_one({'_id': 'miplanta'})
+        self.assertEqual(
+            (toLocal(asUtc(entry['first'])), toLocal(asUtc(entry['last']))),
+            (localTime('2015-01-01 23:00:00'), localTime('2015-01-03 23:00:00')))
+
+    def test_lastDate_externalWrite_ignoredUntilReconcile(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ])
+        plain = MongoTimeCurve(self.db, self.collection)
+        plain.fillPoint(
+            datetime=localTime('2015-01-02 23:00:00'),
+            name='miplanta',
+            ae=30,
+            )
+        self.assertEqual(mtc.lastDate('miplanta'), localisodate('2015-01-01'))
+
+        self.assertEqual(mtc.reconcileDates(), 1)
+
+        self.assertEqual(mtc.lastDate('miplanta'), localisodate('2015-01-02'))
+
+    def test_lastDate_missingEntry_takenFromCurves(self):
+        plain = MongoTimeCurve(self.db, self.collection)
+        plain.fillPoint(
+            datetime=localTime('2015-01-02 23:00:00'),
+            name='miplanta',
+            ae=30,
+            )
+        mtc = self.curve()
+        self.assertEqual(mtc.lastDate('miplanta'), localisodate('2015-01-02'))
+        self.assertEqual(
+            self.db['generation_dates'].find_one({'_id': 'miplanta'})['last'],
+            asUtc(localTime('2015-01-02 23:00:00')).replace(tzinfo=None))
+
+    def test_reconcileDates_removesNamesWithoutData(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-01 23:00:00', 'otraplanta', 30),
+            ])
+        self.db[self.collection].delete_many({'name': 'otraplanta'})
+
+        self.assertEqual(mtc.reconcileDates(['otraplanta']), 0)
+
+        self.assertEqual(
+            sorted(x['_id'] for x in self.db['generation_dates'].find()),
+            ['miplanta'])
+
+
+class MongoTimeCurveInterned_Test(MongoTimeCurve_Test):
+    def curve(self, **kwds):
+        return MongoTimeCurve(self.db, self.collection,
+            namesCollection = 'generation_names',
+            **kwds)
+
+    def test_fillPoint_storesNameId(self):
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-01 23:00:00', 'otraplanta', 20),
+            ('2015-01-02 23:00:00', 'miplanta', 30),
+            ])
+        self.assertEqual(
+            sorted((x['name'], x['name_id'])
+                for x in self.db[self.collection].find()), [
+            ('miplanta', 1),
+            ('miplanta', 1),
+            ('otraplanta', 2),
+            ])
+
+    def test_fillPoint_idsSharedAmongInstances(self):
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ])
+        mtc = self.curve()
+        self.assertEqual(mtc.names.id('miplanta'), 1)
+        self.assertEqual(mtc.names.id('otraplanta'), None)
+
+    def test_get_nameWithoutPointsWrittenHere_ignored(self):
+        plain = MongoTimeCurve(self.db, self.collection)
+        plain.fillPoint(
+            datetime=localTime('2015-01-01 23:00:00'),
+            name='miplanta',
+            ae=10,
+            )
+        curve = self.curve().get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
+            )
+        self.assertEqual(list(curve), 25*[0])
+
+    def test_get_nameInList(self):
+        mtc = self.setupPoints([
+            ('2015-01-01 21:00:00', 'miplanta', 10),
+            ('2015-01-01 22:00:00', 'otraplanta', 20),
+            ('2015-01-01 23:00:00', 'tercera', 40),
+            ])
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter=dict(name={'$in': ['miplanta', 'otraplanta', 'nodata']}),
+            field='ae',
+            )
+        self.assertEqual(list(curve), 21*[0]+[10,20,0,0])
+
+    def nameIdIndexes(self):
+        return [
+            index['key']
+            for index in self.db[self.collection].index_information().values()
+            if index['key'][0][0] == 'name_id'
+        ]
+
+    def test_get_createsNameIdIndex(self):
+        mtc = self.curve()
+        if mtc.singleRevision:
+            self.skipTest("Single revision has its own unique index")
+        mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
+            )
+        self.assertEqual(self.nameIdIndexes(), [
+            [('name_id', 1), ('datetime', 1)],
+        ])
+
+    def test_fillPoint_createsNameIdIndex(self):
+        if self.curve().singleRevision:
+            self.skipTest("Single revision has its own unique index")
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ])
+        self.assertEqual(self.nameIdIndexes(), [
+            [('name_id', 1), ('datetime', 1)],
+        ])
+
+    def nameDay(self, name):
+        return list(self.curve().get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter=name,
+            field='ae',
+            ))
+
+    def test_stampNameIds_formerPointsRead(self):
+        self.setupPlainPoints([
+            ('2015-01-01 22:00:00', 'miplanta', 10),
+            ('2015-01-01 23:00:00', 'otraplanta', 20),
+            ])
+        stamped = self.curve().stampNameIds()
+        self.assertEqual(stamped, 2)
+        self.assertEqual(self.nameDay('miplanta'), 22*[0]+[10,0,0])
+        self.assertEqual(self.nameDay('otraplanta'), 23*[0]+[20,0])
+
+    def test_stampNameIds_keepsIdsOfWrittenNames(self):
+        self.setupPoints([
+            ('2015-01-01 21:00:00', 'otraplanta', 5),
+            ])
+        self.setupPlainPoints([
+            ('2015-01-01 23:00:00', 'otraplanta', 20),
+            ])
+        self.curve().stampNameIds()
+        self.assertEqual(
+            sorted(x['name_id'] for x in self.db[self.collection].find()),
+            [1, 1])
+
+    def test_stampNameIds_inBatches(self):
+        self.setupPlainPoints([
+            ('2015-01-01 21:00:00', 'miplanta', 10),
+            ('2015-01-01 22:00:00', 'otraplanta', 20),
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ])
+        mtc = self.curve()
+        with mock.patch.object(mtc, '_stampBatch',
+                wraps=mtc._stampBatch) as stampBatch:
+            stamped = mtc.stampNameIds(batchSize=2)
+        self.assertEqual(stamped, 3)
+        self.assertEqual(
+            [len(call[0][0]) for call in stampBatch.call_args_list],
+            [2, 1])
+        self.assertEqual(self.nameDay('miplanta'), 21*[0]+[10,0,30,0])
+
+    def test_stampNameIds_rerun_stampsNothing(self):
+        self.setupPlainPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ])
+        self.curve().stampNameIds()
+        self.assertEqual(self.curve().stampNameIds(), 0)
+
+    def test_stampNameIds_interrupted_resumesFromProgress(self):
+        self.setupPlainPoints([
+            ('2015-01-01 21:00:00', 'miplanta', 10),
+            ('2015-01-01 22:00:00', 'miplanta', 20),
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ])
+        mtc = self.curve()
+        calls = []
+        def stampBatch(points, progress, progressId):
+            if calls: raise IOError("Connection lost")
+            calls.append(len(points))
+            return MongoTimeCurve._stampBatch(mtc,
+                points, progress, progressId)
+        with mock.patch.object(mtc, '_stampBatch', side_effect=stampBatch):
+            with self.assertRaises(IOError):
+                mtc.stampNameIds(batchSize=1, progressCollection='progress')
+        mtc = self.curve()
+        with mock.patch.object(mtc.collection, 'find',
+                wraps=mtc.collection.find) as find:
+            stamped = mtc.stampNameIds(progressCollection='progress')
+        self.assertEqual(stamped, 2)
+        query = find.call_args[0][0]
+        self.assertIn('$gt', query['_id'])
+        self.assertEqual(self.nameDay('miplanta'), 21*[0]+[10,20,30,0])
+
+    def test_stampNameIds_withoutNamesCollection_fails(self):
+        mtc = MongoTimeCurve(self.db, self.collection)
+        with self.assertRaises(AssertionError) as ctx:
+            mtc.stampNameIds()
+        self.assertEqual(ctx.exception.args[0],
+            "MongoTimeCurve.stampNameIds requires a namesCollection")
+
+
+class MongoTimeCurveTop_Test(MongoTimeCurve_Test):
+    """Runs the curve tests resolving revisions with $top"""
+
+    def setUp(self):
+        super(MongoTimeCurveTop_Test, self).setUp()
+        testutils.skipIfMongomock(self, "$top accumulator")
+        if MongoTimeCurve(self.db, self.collection).serverVersion() < (5,2):
+            self.skipTest("$top requires MongoDB>=5.2")
+
+    def curve(self, **kwds):
+        return MongoTimeCurve(self.db, self.collection,
+            topRevisions = True,
+            **kwds)
+
+    def test_get_sameCurveThanSorting(self):
+        self.setupRevisions([
+            ('2015-01-01 23:00:00', 'miplanta', 10, '2015-02-01 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 20, '2015-02-03 00:00:00'),
+            ('2015-01-01 23:00:00', 'miplanta', 30, '2015-02-02 00:00:00'),
+            ('2015-01-01 23:00:00', 'otraplanta', 40, '2015-02-01 00:00:00'),
+            ('2015-01-01 22:00:00', 'miplanta', 50, '2015-02-01 00:00:00'),
+            ('2015-01-02 00:00:00', 'otraplanta', 60, '2015-02-01 00:00:00'),
+            ('2015-01-02 00:00:00', 'otraplanta', 70, '2015-01-01 00:00:00'),
+            ])
+        def get(topRevisions):
+            return list(MongoTimeCurve(self.db, self.collection,
+                topRevisions=topRevisions).get(
+                    start=localisodate('2015-01-01'),
+                    stop=localisodate('2015-01-02'),
+                    filter=None,
+                    field='ae',
+                    ))
+        self.assertEqual(get(True), get(False))
+        self.assertEqual(get(True), 22*[0]+[50,60,0]+[60]+24*[0])
+
+
+class MongoTimeCurveTimeSeries_Test(MongoTimeCurve_Test):
+    """
+        Runs the curve tests on a time-series collection.
+        Tests modify and remove points, which needs MongoDB>=7.0.
+    """
+
+    def setUp(self):
+        super(MongoTimeCurveTimeSeries_Test, self).setUp()
+        testutils.skipIfMongomock(self, "time-series collections")
+        if MongoTimeCurve(self.db, self.collection).serverVersion() < (7,0):
+            self.skipTest("Modifying time-series requires MongoDB>=7.0")
+        self.curve().createTimeSeries()
+
+    def curve(self, **kwds):
+        return MongoTimeCurve(self.db, self.collection,
+            timeSeries = True,
+            **kwds)
+
+    def test_createTimeSeries_options(self):
+        options = self.db[self.collection].options()
+        self.assertEqual(options['timeseries']['timeField'], 'datetime')
+        self.assertEqual(options['timeseries']['metaField'], 'name')
+
+
+class MongoTimeCurveTimeSeriesInserts_Test(unittest.TestCase):
+    """
+        Reads and inserts on a time-series collection,
+        available since MongoDB 5.0.
+    """
+
+    def setUp(self):
+        self.collection = 'generation'
+        testutils.setUpMongo(self)
+        testutils.skipIfMongomock(self, "time-series collections")
+        self.mtc = MongoTimeCurve(self.db, self.collection, timeSeries=True)
+        if self.mtc.serverVersion() < (5,0):
+            self.skipTest("Time-series require MongoDB>=5.0")
+        self.mtc.createTimeSeries()
+
+    def get(self, start, stop, name='miplanta'):
+        return list(self.mtc.get(
+            start=localisodate(start),
+            stop=localisodate(stop),
+            filter=name,
+            field='ae',
+            ))
+
+    def test_createTimeSeries_options(self):
+        options = self.db[self.collection].options()
+        self.assertEqual(options['timeseries']['timeField'], 'datetime')
+        self.assertEqual(options['timeseries']['metaField'], 'name')
+
+    def test_createTimeSeries_existing_keptAsIs(self):
+        self.mtc.fillPoint(
+            datetime=localTime('2015-01-01 23:00:00'),
+            name='miplanta',
+            ae=10,
+        )
+        self.mtc.createTimeSeries()
+        self.assertEqual(self.get('2015-01-01', '2015-01-01'),
+            23*[0]+[10,0])
+
+    def test_update_get(self):
+        self.mtc.update(
+            start=localisodate('2015-10-25'),
+            filter='miplanta',
+            field='ae',
+            data=list(range(1,26)),
+            )
+        self.assertEqual(self.get('2015-10-25', '2015-10-25'),
+            list(range(1,26)))
+
+    def test_fillPoints_otherNamesIgnored(self):
+        self.mtc.fillPoints([
+            dict(name='miplanta', datetime=localTime('2015-01-01 01:00:00'), ae=1),
+            dict(name='otraplanta', datetime=localTime('2015-01-01 01:00:00'), ae=2),
+            ])
+        self.assertEqual(self.get('2015-01-01', '2015-01-01'),
+            [0,1]+23*[0])
+
+    def test_migrateFrom_keepsNewestRevision(self):
+        old = MongoTimeCurve(self.db, 'old')
+        for value, created in [
+                (10, '2015-02-01 00:00:00'),
+                (30, '2015-02-03 00:00:00'),
+                (20, '2015-02-02 00:00:00'),
+                ]:
+            old.fillPoint(
+                datetime=localTime('2015-01-01 23:00:00'),
+                name='miplanta',
+                ae=value,
+            )
+            self.db['old'].update_one({'ae': value},
+                {'$set': {old.creation: localTime(created)}})
+
+        self.assertEqual(self.mtc.migrateFrom('old'), 3)
+        self.assertEqual(self.get('2015-01-01', '2015-01-01'),
+            23*[0]+[30,0])
+
+
+class MongoTimeCurveMigration_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = 'generation'
+        testutils.setUpMongo(self)
+
+    def setupOldPoints(self, points):
+        old = MongoTimeCurve(self.db, 'old')
+        for datetime, plant, value in points:
+            old.fillPoint(
+                datetime=localTime(datetime),
+                name=plant,
+                ae=value,
+                )
+
+    def stored(self):
+        return sorted(
+            (x['name'], x['ae'])
+            for x in self.db[self.collection].find()
+        )
+
+    def test_timeSeries_singleRevision_notAvailable(self):
+        with self.assertRaises(AssertionError) as ctx:
+            MongoTimeCurve(self.db, self.collection,
+                timeSeries=True, singleRevision=True)
+        self.assertEqual(ctx.exception.args[0],
+            "Single revision upserts are not available on time-series")
+
+    def test_compact_timeSeries_oldServer_fails(self):
+        mtc = MongoTimeCurve(self.db, self.collection, timeSeries=True)
+        mtc._serverVersion = (6,0,0)
+        with self.assertRaises(AssertionError) as ctx:
+            mtc.compact(localisodate('2015-01-01'), localisodate('2015-01-02'))
+        self.assertEqual(ctx.exception.args[0],
+            "Removing time-series points requires MongoDB>=7.0")
+
+    def test_createTimeSeries(self):
+        mtc = MongoTimeCurve(self.db, self.collection,
+            timestampField='utc_gkwh_timestamp', timeSeries=True)
+        with mock.patch.object(self.db, 'create_collection') as create:
+            mtc.createTimeSeries()
+        create.assert_called_once_with(self.collection, timeseries=dict(
+            timeField='utc_gkwh_timestamp',
+            metaField='name',
+            granularity='hours',
+            ))
+        self.assertIn('name_1_utc_gkwh_timestamp_1',
+            self.db[self.collection].index_information())
+
+    def test_createTimeSeries_existing_keptAsIs(self):
+        self.db[self.collection].insert_one(dict(name='miplanta'))
+        mtc = MongoTimeCurve(self.db, self.collection, timeSeries=True)
+        with mock.patch.object(self.db, 'create_collection') as create:
+            mtc.createTimeSeries()
+        self.assertEqual(create.call_count, 0)
+
+    def test_migrateFrom_copiesRevisions(self):
+        self.setupOldPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-01 23:00:00', 'miplanta', 20),
+            ('2015-01-02 23:00:00', 'otraplanta', 30),
+            ])
+        mtc = MongoTimeCurve(self.db, self.collection)
+        self.assertEqual(mtc.migrateFrom('old', batchSize=2), 3)
+        self.assertEqual(self.stored(), [
+            ('miplanta', 10),
+            ('miplanta', 20),
+            ('otraplanta', 30),
+            ])
+        self.assertEqual(self.db['old'].count_documents({}), 3)
+
+    def test_migrateFrom_keepsCreationDates(self):
+        self.setupOldPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ])
+        created = self.db['old'].find_one()['create_at']
+        MongoTimeCurve(self.db, self.collection).migrateFrom('old')
+        self.assertEqual(
+            self.db[self.collection].find_one()['create_at'], created)
+
+    def test_migrateFrom_widensDates(self):
+        self.setupOldPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-03 23:00:00', 'miplanta', 20),
+            ])
+        mtc = MongoTimeCurve(self.db, self.collection,
+            datesCollection='dates')
+        mtc.migrateFrom('old')
+        self.assertEqual(mtc.lastDate('miplanta'), localisodate('2015-01-03'))
+
+    def test_migrateFrom_withProgress_resumes(self):
+        self.setupOldPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-02 23:00:00', 'miplanta', 20),
+            ])
+        mtc = MongoTimeCurve(self.db, self.collection)
+        mtc.migrateFrom('old', progressCollection='progress')
+        self.setupOldPoints([
+            ('2015-01-03 23:00:00', 'miplanta', 30),
+            ])
+        self.assertEqual(
+            mtc.migrateFrom('old', progressCollection='progress'), 1)
+        self.assertEqual(self.stored(), [
+            ('miplanta', 10),
+            ('miplanta', 20),
+            ('miplanta', 30),
+            ])
+
+    def test_migrateFrom_withProgress_collectionTruthinessNotUsed(self):
+        self.setupOldPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ])
+        mtc = MongoTimeCurve(self.db, self.collection)
+        with collectionTruthinessForbidden(self.db['progress']):
+            copied = mtc.migrateFrom('old', progressCollection='progress')
+        self.assertEqual(copied, 1)
+
+    def test_migrateFrom_emptySource(self):
+        mtc = MongoTimeCurve(self.db, self.collection)
+        self.assertEqual(mtc.migrateFrom('old'), 0)
+
+
+class MongoTimeCurvePipeline_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = 'generation'
+        testutils.setUpMongo(self)
+
+    def stages(self, version, **kwds):
+        mtc = MongoTimeCurve(self.db, self.collection, **kwds)
+        mtc._serverVersion = version
+        return [list(stage)[0] for stage in mtc._pipeline({}, ['ae'])]
+
+    def test_pipeline_oldServer_sorts(self):
+        self.assertEqual(self.stages((5,0,5)),
+            ['$match', '$sort', '$group', '$group'])
+
+    def test_pipeline_newServer_top(self):
+        self.assertEqual(self.stages((5,2,0)),
+            ['$match', '$group', '$group'])
+
+    def test_pipeline_unknownServer_sorts(self):
+        self.assertEqual(self.stages(()),
+            ['$match', '$sort', '$group', '$group'])
+
+    def test_pipeline_forcedSort(self):
+        self.assertEqual(self.stages((6,0,0), topRevisions=False),
+            ['$match', '$sort', '$group', '$group'])
+
+    def test_pipeline_forcedTop(self):
+        self.assertEqual(self.stages((4,4,0), topRevisions=True),
+            ['$match', '$group', '$group'])
+
+    def test_pipeline_top_newestByCreation(self):
+        mtc = MongoTimeCurve(self.db, self.collection, topRevisions=True)
+        pipeline = mtc._pipeline({}, ['ae', 'ai'])
+        self.assertEqual(pipeline[1]['$group']['ai'], {'$top': {
+            'sortBy': {'create_at': -1},
+            'output': '$ai',
+        }})
+
+    def test_pipeline_top_singleRevision_noRevisionSelection(self):
+        self.assertEqual(self.stages((6,0,0), singleRevision=True),
+            ['$match', '$group'])
+
+    def clearServerVersions(self):
+        from . import mongotimecurve
+        patcher = mock.patch.dict(mongotimecurve._serverVersions, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_serverVersion(self):
+        self.clearServerVersions()
+        mtc = MongoTimeCurve(self.db, self.collection)
+        with mock.patch.object(self.db.client, 'server_info',
+                return_value={'version': '5.2.1-rc0'}):
+            self.assertEqual(mtc.serverVersion(), (5,2,1))
+
+    def test_serverVersion_cached(self):
+        self.clearServerVersions()
+        mtc = MongoTimeCurve(self.db, self.collection)
+        with mock.patch.object(self.db.client, 'server_info',
+                return_value={'version': '6.0.1'}) as server_info:
+            mtc.serverVersion()
+            mtc.serverVersion()
+        server_info.assert_called_once_with()
+
+    def test_serverVersion_cachedByClient(self):
+        self.clearServerVersions()
+        with mock.patch.object(self.db.client, 'server_info',
+                return_value={'version': '6.0.1'}) as server_info:
+            MongoTimeCurve(self.db, self.collection).serverVersion()
+            version = MongoTimeCurve(self.db, 'other').serverVersion()
+        server_info.assert_called_once_with()
+        self.assertEqual(version, (6,0,1))
+
+    def test_serverVersion_failing(self):
+        self.clearServerVersions()
+        mtc = MongoTimeCurve(self.db, self.collection)
+        with mock.patch.object(self.db.client, 'server_info',
+                side_effect=Exception("Not authorized")):
+            self.assertEqual(mtc.serverVersion(), ())
+
+    def test_serverVersion_failing_notCachedByClient(self):
+        self.clearServerVersions()
+        with mock.patch.object(self.db.client, 'server_info',
+                side_effect=Exception("Not authorized")):
+            MongoTimeCurve(self.db, self.collection).serverVersion()
+        with mock.patch.object(self.db.client, 'server_info',
+                return_value={'version': '6.0.1'}):
+            version = MongoTimeCurve(self.db, self.collection).serverVersion()
+        self.assertEqual(version, (6,0,1))
+
+
+class MongoTimeCurveSingleRevision_Test(MongoTimeCurve_Test):
+    def curve(self, **kwds):
+        return MongoTimeCurve(self.db, self.collection,
+            singleRevision = True,
+            **kwds)
+
+    def test_fillPoint_sameNameAndDate_replaces(self):
+        self.setupPoints([
+            ('2015-01-01 23:00:00', 'miplanta', 10),
+            ('2015-01-01 23:00:00', 'miplanta', 30),
+            ('2015-01-01 23:00:00', 'otraplanta', 20),
+            ])
+        self.assertEqual(
+            sorted((x['name'], x['ae'])
+                for x in self.db[self.collection].find()), [
+            ('miplanta', 30),
+            ('otraplanta', 20),
+            ])
+
+    def test_update_singleBulkWrite(self):
+        mtc = self.curve()
+        with mock.patch.object(mtc.collection, 'bulk_write',
+                wraps=mtc.collection.bulk_write) as bulk_write:
+            mtc.update(
+                start=localisodate('2015-08-15'),
+                filter=dict(name='miplanta'),
+                field='ae',
+                data=+25*[1]
+                )
+        self.assertEqual(bulk_write.call_count, 1)
+        self.assertEqual(self.db[self.collection].count_documents({}), 24)
+
+    def test_pipeline_noRevisionSelection(self):
+        mtc = self.curve()
+        pipeline = mtc._pipeline({}, ['ae'])
+        self.assertEqual(
+            [list(stage)[0] for stage in pipeline],
+            ['$match', '$group'])
+
+    def test_get_appendedRevisionsLeft_fails(self):
+        import pymongo.errors
+        appending = MongoTimeCurve(self.db, self.collection)
+        for value in 1, 2:
+            appending.fillPoint(
+                datetime=localTime('2015-01-01 23:00:00'),
+                name='miplanta',
+                ae=value,
+            )
+        mtc = self.curve()
+        with self.assertRaises(pymongo.errors.DuplicateKeyError):
+            mtc.get(
+                start=localisodate('2015-01-01'),
+                stop=localisodate('2015-01-01'),
+                filter='miplanta',
+                field='ae',
+                )
+
+    def test_get_compactedRevisions_read(self):
+        appending = MongoTimeCurve(self.db, self.collection)
+        for value in 1, 2:
+            appending.fillPoint(
+                datetime=localTime('2015-01-01 23:00:00'),
+                name='miplanta',
+                ae=value,
+            )
+            self.db[self.collection].update_one({'ae': value}, {'$set': {
+                appending.creation: localTime('2015-02-0{} 00:00:00'.format(value)),
+                }})
+        appending.compact(
+            localisodate('2015-01-01'), localisodate('2015-01-01'))
+        mtc = self.curve()
+        curve = mtc.get(
+            start=localisodate('2015-01-01'),
+            stop=localisodate('2015-01-01'),
+            filter='miplanta',
+            field='ae',
             )
+        self.assertEqual(list(curve), 23*[0]+[2,0])
 
 
 
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import numpy
+
+from .mongotimecurve import hoursPerDay
+
+"""
+Calendar aware aggregation of curves.
+
+Curves have a fixed number of slots a day (25 for hourly ones),
+so they can be reshaped into a (days, slots) matrix.
+Periods are given by the offsets of their first day,
+so that numpy's reduceat aggregates each period at once.
+A first period not starting at its calendar start is kept partial.
+"""
+
+granularities = (
+    'daily',
+    'weekly', # ISO weeks, starting on monday
+    'monthly',
+    'yearly',
+)
+
+
+def periodBoundaries(start, ndays, granularity):
+    """
+        Returns the offset of the first day of every period of the
+        given granularity within ndays days from start date.
+        The first one is always 0.
+    """
+    assert granularity in granularities, (
+        "Unknown granularity {}".format(granularity))
+
+    offsets = numpy.arange(ndays)
+    if granularity == 'daily':
+        return offsets
+    days = numpy.datetime64(start, 'D') + offsets
+    if granularity == 'weekly':
+        # 1970-01-01 was thursday, so monday is 0
+        periods = (days.astype(int)+3)//7
+    elif granularity == 'monthly':
+        periods = days.astype('datetime64[M]')
+    else:
+        periods = days.astype('datetime64[Y]')
+    changes = numpy.ones(ndays, bool)
+    changes[1:] = periods[1:] != periods[:-1]
+    return offsets[changes]
+
+
+def periodStarts(start, ndays, granularity):
+    """Returns the date of the first day of every period"""
+    return [
+        (numpy.datetime64(start, 'D') + offset).item()
+        for offset in periodBoundaries(start, ndays, granularity)
+    ]
+
+
+def dailyMatrix(curve, slots=hoursPerDay):
+    """Reshapes a curve as a (days, slots) matrix"""
+    return numpy.asarray(curve).reshape(-1, slots)
+
+
+def resample(curve, start, granularity, slots=hoursPerDay):
+    """
+        Adds the values of the curve, starting at start date,
+        by periods of the given granularity.
+    """
+    days = dailyMatrix(curve, slots)
+    if not len(days):
+        return days.sum(axis=1)
+    boundaries = periodBoundaries(start, len(days), granularity)
+    return numpy.add.reduceat(days.sum(axis=1), boundaries)
+
+
+def profile(curve, start, granularity, slots=hoursPerDay, peak=False):
+    """
+        Returns a (periods, slots) matrix with, for each period of
+        the given granularity, the total of every slot of the day,
+        or, if peak is True, the maximum value of every slot.
+    """
+    days = dailyMatrix(curve, slots)
+    if not len(days):
+        return days
+    boundaries = periodBoundaries(start, len(days), granularity)
+    reducer = numpy.maximum if peak else numpy.add
+    return reducer.reduceat(days, boundaries, axis=0)
+
+
+# vim: et ts=4 sw=4
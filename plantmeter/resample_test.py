@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+from .resample import (
+    periodBoundaries,
+    periodStarts,
+    resample,
+    profile,
+    )
+from datetime import date
+
+import unittest
+
+
+class PeriodBoundaries_Test(unittest.TestCase):
+
+    def test_daily(self):
+        self.assertEqual(
+            list(periodBoundaries(date(2019,3,30), 3, 'daily')),
+            [0,1,2])
+
+    def test_weekly_startingOnMonday(self):
+        self.assertEqual(
+            list(periodBoundaries(date(2019,3,4), 15, 'weekly')),
+            [0,7,14])
+
+    def test_weekly_startingMidweek(self):
+        self.assertEqual(
+            list(periodBoundaries(date(2019,3,6), 15, 'weekly')),
+            [0,5,12])
+
+    def test_monthly(self):
+        self.assertEqual(
+            list(periodBoundaries(date(2019,1,30), 33, 'monthly')),
+            [0,2,30])
+
+    def test_yearly(self):
+        self.assertEqual(
+            list(periodBoundaries(date(2019,12,30), 400, 'yearly')),
+            [0,2,368])
+
+    def test_unknownGranularity(self):
+        with self.assertRaises(AssertionError) as ctx:
+            periodBoundaries(date(2019,12,30), 400, 'hourly')
+        self.assertEqual(ctx.exception.args[0],
+            "Unknown granularity hourly")
+
+    def test_periodStarts(self):
+        self.assertEqual(
+            periodStarts(date(2019,1,30), 33, 'monthly'), [
+            date(2019,1,30),
+            date(2019,2,1),
+            date(2019,3,1),
+            ])
+
+
+class Resample_Test(unittest.TestCase):
+
+    def test_resample_daily(self):
+        self.assertEqual(
+            list(resample(25*[1]+25*[2], date(2019,1,31), 'daily')),
+            [25, 50])
+
+    def test_resample_monthly(self):
+        self.assertEqual(
+            list(resample(25*[1]+25*[2]+25*[3], date(2019,1,31), 'monthly')),
+            [25, 125])
+
+    def test_resample_quarterSlots(self):
+        self.assertEqual(
+            list(resample(100*[1]+100*[2], date(2019,1,31), 'monthly', slots=100)),
+            [100, 200])
+
+    def test_resample_empty(self):
+        self.assertEqual(
+            list(resample([], date(2019,1,31), 'monthly')),
+            [])
+
+    def test_profile_added(self):
+        self.assertEqual(
+            profile([1,2]+23*[0]+[3,4]+23*[0]+[5,6]+23*[0],
+                date(2019,1,31), 'monthly').tolist(), [
+            [1,2]+23*[0],
+            [8,10]+23*[0],
+            ])
+
+    def test_profile_peak(self):
+        self.assertEqual(
+            profile([1,2]+23*[0]+[3,4]+23*[0]+[5,1]+23*[0],
+                date(2019,1,31), 'monthly', peak=True).tolist(), [
+            [1,2]+23*[0],
+            [5,4]+23*[0],
+            ])
+
+
+# vim: et ts=4 sw=4
@@ -6,6 +6,10 @@ from somutils.isodates import (
     assertDate,
     )
 import datetime
+from .instrumentation import nullStats
+from .mongotimecurve import slotsPerDay
+from .resample import resample
+from .singleflight import callKey
 
 """
 TODOs
@@ -15,88 +19,192 @@ TODOs
 + Padding
 """
 
+def optionalDate(value):
+    """Turns an iso date string into a date, keeping dates and None"""
+    if not value: return None
+    if isinstance(value, datetime.date): return value
+    return isodate(value)
+
 class Resource(object):
     id = None 
     name = None
     description = None
     enabled = None
+    first_active_date = None
+    last_active_date = None
+    stats = nullStats
+    singleFlight = None
 
-    def __init__(self, id, name, description, enabled):
+    def __init__(self, id, name, description, enabled, stats=None):
         self.id = id 
         self.name = name
         self.description = description
         self.enabled = enabled
+        self.stats = stats or nullStats
+
+    def activeDays(self, start, end):
+        """
+        Returns the (first, last) day offsets of the resource
+        active window within the [start, end] date range.
+        Days before first and from last on are out of the window.
+        """
+        ndays = (end-start).days+1
+        first = 0
+        last = ndays
+        if self.first_active_date:
+            first = min(max((self.first_active_date-start).days, 0), ndays)
+        if self.last_active_date:
+            last = min(max((self.last_active_date-start).days+1, 0), ndays)
+        return first, max(first, last)
+
+    def get_kwh(self, start, end, resolution='hourly', granularity=None):
+        """
+        Production curve between start and end dates (both included).
+        See mongotimecurve.resolutions for the available resolutions.
+        If granularity is given, returns the totals by periods
+        instead. See resample.granularities.
+        """
+        if self.singleFlight is None:
+            return self._get_kwh(start, end, resolution, granularity)
+
+        key = callKey(type(self).__name__+'.get_kwh', self.id,
+            start, end, resolution, granularity)
+        return self.singleFlight.do(key, self._get_kwh,
+            start, end, resolution, granularity)
+
+    def _get_kwh(self, start, end, resolution, granularity):
+        if granularity is not None:
+            return resample(
+                self._get_kwh(start, end, resolution, None),
+                start, granularity, slotsPerDay(resolution))
 
-class ParentResource(Resource):
+        assertDate('start', start)
+        assertDate('end', end)
 
-    def __init__(self, id, name, description, enabled, children=[]):
-        super(ParentResource, self).__init__(id, name, description, enabled)
-        self.children = children
+        with self.stats.timed(type(self).__name__+'.get_kwh'):
+            ndays = (end-start).days+1
+            first, last = self.activeDays(start, end)
+            if first == 0 and last == ndays:
+                return self._activeKwh(start, end, resolution)
+
+            # Just query the active window, and place it
+            slots = slotsPerDay(resolution)
+            data = np.zeros(ndays*slots, int)
+            if first == last: return data
+            data[first*slots:last*slots] = self._activeKwh(
+                start + datetime.timedelta(days=first),
+                start + datetime.timedelta(days=last-1),
+                resolution,
+                )
+            return data
+
+    def _activeKwh(self, start, end, resolution):
+        """Production curve for a range within the active window"""
+        raise NotImplementedError()
 
-    def get_kwh(self, start, end):
+class ParentResource(Resource):
 
-        assertDate('start', start)
-        assertDate('end', end)
+    def __init__(self, id, name, description, enabled, children=[], stats=None,
+            singleFlight=None):
+        """
+        singleFlight: optional SingleFlight, usually shared by
+        every resource tree built by the process, so that identical
+        concurrent get_kwh calls on a resource id compute it once.
+        """
+        super(ParentResource, self).__init__(id, name, description, enabled, stats)
+        self.children = children
+        self.singleFlight = singleFlight
 
-        return np.sum([
-            child.get_kwh(start, end)
+    def _activeKwh(self, start, end, resolution):
+        curves = [
+            child.get_kwh(start, end, resolution)
             for child in self.children
             if child.enabled
-            ], axis=0)
-
-    def firstMeasurementDate(self):
-        return min([
-            child.firstMeasurementDate()
+            ]
+        if not curves:
+            ndays = (end-start).days+1
+            return np.zeros(ndays*slotsPerDay(resolution), int)
+        with self.stats.timed(type(self).__name__+'.get_kwh', 'assembly'):
+            return np.sum(curves, axis=0)
+
+    def enabledMeters(self):
+        return [
+            meter
             for child in self.children
             if child.enabled
-            ])
+            for meter in child.enabledMeters()
+            ]
+
+    def _measurementDates(self, first=True, last=True):
+        """
+        Returns the (first, last) measurement dates of every
+        enabled meter, asking each curve provider once for all
+        its meters. Providers may skip the date not requested.
+        """
+        providers = []
+        names = {}
+        for meter in self.enabledMeters():
+            key = id(meter.curveProvider)
+            if key not in names:
+                providers.append(meter.curveProvider)
+                names[key] = []
+            names[key].append(meter.name)
+        return [
+            tuple(date and date.date() for date in dates)
+            for provider in providers
+            for dates in provider.measurementDates(
+                names[id(provider)], first=first, last=last).values()
+            ]
+
+    def firstMeasurementDate(self):
+        dates = [first for first, last in self._measurementDates(last=False)]
+        if not dates or None in dates: return None
+        return min(dates)
 
     def lastMeasurementDate(self):
-        return min([
-            child.lastMeasurementDate()
-            for child in self.children
-            if child.enabled
-            ])
+        dates = [last for first, last in self._measurementDates(first=False)]
+        if not dates or None in dates: return None
+        return min(dates)
 
 class ProductionAggregator(ParentResource):
-    def __init__(self, id, name, description, enabled, plants=[]):
+    def __init__(self, id, name, description, enabled, plants=[], stats=None,
+            singleFlight=None):
         super(ProductionAggregator, self).__init__(
-            id, name, description, enabled, children=plants)
+            id, name, description, enabled, children=plants, stats=stats,
+            singleFlight=singleFlight)
 
     def firstActiveDate(self):
         if not self.children: return None
-        return isodate(min(plant.first_active_date for plant in self.children))
+        dates = [plant.first_active_date for plant in self.children]
+        if not all(dates): return None
+        return min(dates)
 
 class ProductionPlant(ParentResource):
-    def __init__(self, id, name, description, enabled, first_active_date=None, last_active_date=None, meters=[]):
+    def __init__(self, id, name, description, enabled, first_active_date=None, last_active_date=None, meters=[], stats=None, singleFlight=None):
         super(ProductionPlant, self).__init__(
-            id, name, description, enabled, children=meters)
-        self.first_active_date = first_active_date
+            id, name, description, enabled, children=meters, stats=stats,
+            singleFlight=singleFlight)
+        self.first_active_date = optionalDate(first_active_date)
+        self.last_active_date = optionalDate(last_active_date)
 
 class ProductionMeter(Resource):
     def __init__(self, *args, **kwargs):
-        self.first_active_date = kwargs.pop('first_active_date', None)
-        self.first_active_date = self.first_active_date and isodate(self.first_active_date)
+        self.first_active_date = optionalDate(kwargs.pop('first_active_date', None))
+        self.last_active_date = optionalDate(kwargs.pop('last_active_date', None))
         self.curveProvider = kwargs.pop('curveProvider', None)
         super(ProductionMeter, self).__init__(*args, **kwargs)
 
-    def get_kwh(self, start, end):
-
-        assertDate('start', start)
-        assertDate('end', end)
-
-        data = self.curveProvider.get(
+    def _activeKwh(self, start, end, resolution):
+        return self.curveProvider.get(
             start=dateToLocal(start),
             stop=dateToLocal(end),
             filter=self.name,
             field='ae',
+            resolution=resolution,
             )
 
-        if self.first_active_date and self.first_active_date >= start:
-            nbins= (self.first_active_date-start).days * 25
-            data[:nbins] = 0
-
-        return data
+    def enabledMeters(self):
+        return [self]
 
     def lastMeasurementDate(self):
         result = self.curveProvider.lastFullDate(self.name)
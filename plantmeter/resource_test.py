@@ -3,7 +3,6 @@
 from .mongotimecurve import MongoTimeCurve
 from somutils.isodates import localisodate
 import os
-import pymongo
 from datetime import date
 from . import testutils
 from .resource import (
@@ -14,25 +13,19 @@ from .resource import (
 
 import unittest
 import pytest
+import mock
 
 def local_file(filename):
     return os.path.join(os.path.abspath(os.path.dirname(__file__)), filename)
 
 class Meter_Test(unittest.TestCase):
     def setUp(self):
-        self.databasename = 'generationkwh_test'
         self.collection = 'production'
-
-        self.connection = pymongo.MongoClient()
-        self.connection.drop_database(self.databasename)
-        self.db = self.connection[self.databasename]
+        testutils.setUpMongo(self)
         self.curveProvider = MongoTimeCurve(self.db, self.collection)
         self.row1 = [0,0,0,0,0,0,0,0,3,6,5,4,8,17,34,12,12,5,3,1,0,0,0,0,0,]
         self.row2 = [0,0,0,0,0,0,0,0,4,7,6,5,9,18,35,13,13,6,4,2,0,0,0,0,0,]
 
-    def tearDown(self):
-        self.connection.drop_database('generationkwh_test')
-
     def setupEmptyMeter(self, **kwd):
         return ProductionMeter(
             1,
@@ -91,6 +84,63 @@ class Meter_Test(unittest.TestCase):
                 date(2015,9,5))),
             [0]*50)
 
+    def test__get_kwh__filled__whenLastActive(self):
+        m = self.setupMeter(last_active_date="2015-09-04")
+        self.assertEqual(
+            list(m.get_kwh(
+                date(2015,9,4),
+                date(2015,9,5))),
+            self.row1 + [0]*25)
+
+    def test__get_kwh__filled__whenLastActive_beforeStart(self):
+        m = self.setupMeter(last_active_date="2015-09-03")
+        self.assertEqual(
+            list(m.get_kwh(
+                date(2015,9,4),
+                date(2015,9,5))),
+            [0]*50)
+
+    def test__get_kwh__filled__whenActiveDatesAsDate(self):
+        m = self.setupMeter(
+            first_active_date=date(2015,9,5),
+            last_active_date=date(2015,9,5),
+            )
+        self.assertEqual(
+            list(m.get_kwh(
+                date(2015,9,4),
+                date(2015,9,6))),
+            [0]*25 + self.row2 + [0]*25)
+
+    def queriedRanges(self, m, start, end):
+        with mock.patch.object(self.curveProvider, 'get',
+                wraps=self.curveProvider.get) as get:
+            m.get_kwh(start, end)
+        return [
+            (call[1]['start'].date(), call[1]['stop'].date())
+            for call in get.call_args_list
+        ]
+
+    def test__get_kwh__activeWindowInside_queriesJustTheWindow(self):
+        m = self.setupMeter(
+            first_active_date="2015-09-05",
+            last_active_date="2015-09-05",
+            )
+        self.assertEqual(
+            self.queriedRanges(m, date(2015,9,4), date(2015,9,6)),
+            [(date(2015,9,5), date(2015,9,5))])
+
+    def test__get_kwh__activeWindowOutside_noQuery(self):
+        m = self.setupMeter(first_active_date="2015-09-07")
+        self.assertEqual(
+            self.queriedRanges(m, date(2015,9,4), date(2015,9,6)),
+            [])
+
+    def test__get_kwh__activeWindowCovering_queriesWholeRange(self):
+        m = self.setupMeter(first_active_date="2015-09-01")
+        self.assertEqual(
+            self.queriedRanges(m, date(2015,9,4), date(2015,9,6)),
+            [(date(2015,9,4), date(2015,9,6))])
+
     def test_lastDate_empty(self):
         m = self.setupEmptyMeter()
         self.assertEqual(m.lastMeasurementDate(), None)
@@ -111,19 +161,12 @@ class Meter_Test(unittest.TestCase):
 class Resource_Test(unittest.TestCase):
 
     def setUp(self):
-        self.databasename = 'generationkwh_test'
         self.collection = 'production'
-
-        self.connection = pymongo.MongoClient()
-        self.connection.drop_database(self.databasename)
-        self.db = self.connection[self.databasename]
+        testutils.setUpMongo(self)
         self.curveProvider = MongoTimeCurve(self.db, self.collection)
         self.row1 = [0,0,0,0,0,0,0,0,3,6,5,4,8,17,34,12,12,5,3,1,0,0,0,0,0]
         self.row2 = [0,0,0,0,0,0,0,0,4,7,6,5,9,18,35,13,13,6,4,2,0,0,0,0,0]
 
-    def tearDown(self):
-        self.connection.drop_database('generationkwh_test')
-
     def setupMeter(self, n, name):
         return ProductionMeter(
             id=n,
@@ -225,6 +268,167 @@ class Resource_Test(unittest.TestCase):
                 0,0,0,0,0,0,0,0,8,14,12,10,18,36,70,26,26,12,8,4,0,0,0,0,0,
             ])
 
+    def test__get_kwh__plantFirstActiveDate(self):
+        m = self.setupMeter(1, 'm1')
+        self.fillMeter('m1', '2015-09-04')
+        p = ProductionPlant(1,'plantName','plantDescription',True,
+            first_active_date='2015-09-05', meters=[m])
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p])
+
+        self.assertEqual(
+            list(aggr.get_kwh(
+                date(2015,9,4),
+                date(2015,9,5))),
+            [0]*25 + self.row2)
+
+    def test__get_kwh__plantLastActiveDate(self):
+        m1 = self.setupMeter(1, 'm1')
+        self.fillMeter('m1', '2015-09-04')
+        p1 = ProductionPlant(1,'plantName1','plantDescription1',True,
+            last_active_date='2015-09-04', meters=[m1])
+        m2 = self.setupMeter(2, 'm2')
+        self.fillMeter('m2', '2015-09-04')
+        p2 = ProductionPlant(2,'plantName2','plantDescription2',True, meters=[m2])
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p1,p2])
+
+        self.assertEqual(
+            list(aggr.get_kwh(
+                date(2015,9,4),
+                date(2015,9,5))),
+            [2*x for x in self.row1] + self.row2)
+
+    def test__get_kwh__plantAndMeterWindows_intersected(self):
+        m = ProductionMeter(1, 'm1', 'meterDescription', True,
+            curveProvider = self.curveProvider,
+            first_active_date='2015-09-04',
+            last_active_date='2015-09-05',
+            )
+        self.fillMeter('m1', '2015-09-04')
+        p = ProductionPlant(1,'plantName','plantDescription',True,
+            first_active_date='2015-09-05', meters=[m])
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p])
+
+        with mock.patch.object(self.curveProvider, 'get',
+                wraps=self.curveProvider.get) as get:
+            result = aggr.get_kwh(date(2015,9,3), date(2015,9,6))
+
+        self.assertEqual(list(result), [0]*50 + self.row2 + [0]*25)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(get.call_args[1]['start'].date(), date(2015,9,5))
+        self.assertEqual(get.call_args[1]['stop'].date(), date(2015,9,5))
+
+    def test__get_kwh__quarterhourly(self):
+        m = self.setupMeter(1, 'm1')
+        self.curveProvider.fillPoint(
+            datetime=localisodate('2015-09-05').replace(hour=10, minute=30),
+            name='m1',
+            type='p4',
+            ae=5,
+            )
+        p = ProductionPlant(1,'plantName','plantDescription',True,
+            first_active_date='2015-09-05', meters=[m])
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p])
+
+        self.assertEqual(
+            list(aggr.get_kwh(
+                date(2015,9,4),
+                date(2015,9,5),
+                resolution='quarterhourly')),
+            [0]*100 + [0]*42 + [5] + [0]*57)
+
+    def test__get_kwh__daily(self):
+        m = self.setupMeter(1, 'm1')
+        self.fillMeter('m1', '2015-09-04')
+        p = ProductionPlant(1,'plantName','plantDescription',True, meters=[m])
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p])
+
+        self.assertEqual(
+            list(aggr.get_kwh(
+                date(2015,9,4),
+                date(2015,9,6),
+                granularity='daily')),
+            [sum(self.row1), sum(self.row2), 0])
+
+    def test__get_kwh__noEnabledChildren(self):
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[])
+
+        self.assertEqual(
+            list(aggr.get_kwh(
+                date(2015,9,4),
+                date(2015,9,5))),
+            2*25*[0])
+
+    def test__get_kwh__noEnabledChildren_daily(self):
+        p = ProductionPlant(1,'plantName','plantDescription',False, meters=[])
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p])
+
+        self.assertEqual(
+            list(aggr.get_kwh(
+                date(2015,9,4),
+                date(2015,9,6),
+                granularity='daily')),
+            [0, 0, 0])
+
+    def test__get_kwh__withStats(self):
+        from .instrumentation import CurveStats
+        stats = CurveStats()
+        m = self.setupMeter(1, 'm1')
+        m.stats = stats
+        p = ProductionPlant(1,'plantName','plantDescription',True, meters=[m], stats=stats)
+        aggr = ProductionAggregator(1,'aggrName','aggrDescription',True, plants=[p], stats=stats)
+
+        aggr.get_kwh(date(2015,9,4), date(2015,9,5))
+
+        self.assertEqual(sorted(stats.histograms), [
+            ('ProductionAggregator.get_kwh', 'assembly'),
+            ('ProductionAggregator.get_kwh', 'total'),
+            ('ProductionMeter.get_kwh', 'total'),
+            ('ProductionPlant.get_kwh', 'assembly'),
+            ('ProductionPlant.get_kwh', 'total'),
+            ])
+
+    def test__get_kwh__singleFlight_concurrentCallsShareCurves(self):
+        import threading
+        import time
+        from .singleflight import SingleFlight
+        from .instrumentation import CurveStats
+        stats = CurveStats()
+        flight = SingleFlight(stats)
+        self.fillMeter('m1', '2015-09-04')
+        gate = threading.Event()
+        get = self.curveProvider.get
+        def slowGet(**kwds):
+            gate.wait(2)
+            return get(**kwds)
+
+        def aggregator():
+            m = self.setupMeter(1, 'm1')
+            p = ProductionPlant(1,'plantName','plantDescription',True,
+                meters=[m], singleFlight=flight)
+            return ProductionAggregator(1,'aggrName','aggrDescription',True,
+                plants=[p], singleFlight=flight)
+
+        results = []
+        def call():
+            results.append(aggregator().get_kwh(date(2015,9,4), date(2015,9,5)))
+
+        with mock.patch.object(self.curveProvider, 'get',
+                side_effect=slowGet) as curveGet:
+            threads = [threading.Thread(target=call) for i in range(3)]
+            for thread in threads: thread.start()
+            start = time.time()
+            while (stats.counters.get(('singleflight', 'shared'), 0) < 2
+                    and time.time() - start < 2):
+                time.sleep(0.005)
+            gate.set()
+            for thread in threads: thread.join(2)
+
+        self.assertEqual(curveGet.call_count, 1)
+        self.assertEqual([list(x) for x in results],
+            3*[self.row1+self.row2])
+        results[0][8] = 100
+        self.assertEqual(results[1][8], 3)
+
     def test_lastDate_empty(self):
         m = self.setupMeter(1, '20150904')
         p = ProductionPlant(1,'plantName','plantDescription',True, meters=[m])
@@ -302,22 +506,43 @@ class Resource_Test(unittest.TestCase):
 
         self.assertEqual(aggr.firstMeasurementDate(), date(2015,8,4))
 
+    def test_firstDate_twoPlantsTwoMeters_singleProviderCall(self):
+        m1 = self.setupMeter(1, 'm1')
+        m2 = self.setupMeter(2, 'm2')
+        self.fillMeter('m1', '2015-09-04')
+        self.fillMeter('m2', '2015-08-04')
+
+        p1 = ProductionPlant(1,'plantName1','plantDescription1',True, meters=[m1])
+        p2 = ProductionPlant(2,'plantName2','plantDescription2',True, meters=[m2])
+        aggr = ProductionAggregator(1,'aggrName','aggreDescription',True, plants=[p1,p2])
+
+        with mock.patch.object(self.curveProvider, 'measurementDates',
+                wraps=self.curveProvider.measurementDates) as measurementDates:
+            self.assertEqual(aggr.firstMeasurementDate(), date(2015,8,4))
+        measurementDates.assert_called_once_with(['m1', 'm2'],
+            first=True, last=False)
+
+    def test_firstDate_disabledMeter_ignored(self):
+        m1 = self.setupMeter(1, 'm1')
+        m2 = self.setupMeter(2, 'm2')
+        m2.enabled = False
+        self.fillMeter('m1', '2015-09-04')
+        self.fillMeter('m2', '2015-08-04')
+
+        p = ProductionPlant(1,'plantName','plantDescription',True, meters=[m1,m2])
+        aggr = ProductionAggregator(1,'aggrName','aggreDescription',True, plants=[p])
+
+        self.assertEqual(aggr.firstMeasurementDate(), date(2015,9,4))
+
 class Mix_Test(unittest.TestCase):
 
     def setUp(self):
-        self.databasename = 'generationkwh_test'
         self.collection = 'production'
-
-        self.connection = pymongo.MongoClient()
-        self.connection.drop_database(self.databasename)
-        self.db = self.connection[self.databasename]
+        testutils.setUpMongo(self)
         self.curveProvider = MongoTimeCurve(self.db, self.collection)
         self.row1 = [0,0,0,0,0,0,0,0,3,6,5,4,8,17,34,12,12,5,3,1,0,0,0,0,0]
         self.row2 = [0,0,0,0,0,0,0,0,4,7,6,5,9,18,35,13,13,6,4,2,0,0,0,0,0]
 
-    def tearDown(self):
-        self.connection.drop_database('generationkwh_test')
-
     def setupMeter(self, n, name):
         return ProductionMeter(
             id=n,
@@ -354,6 +579,15 @@ class Mix_Test(unittest.TestCase):
 
         self.assertEqual(aggr.firstActiveDate(), date(2000,1,1))
 
+    def test_firstActiveDate_plantWithoutDate(self):
+        m1 = self.setupMeter(1, 'm1')
+        m2 = self.setupMeter(2, 'm2')
+        p1 = ProductionPlant(1,'plantName1','plantDescription1',True, '2000-01-01', meters=[m1])
+        p2 = ProductionPlant(2,'plantName2','plantDescription2',True, False, meters=[m2])
+        aggr = ProductionAggregator(1,'aggrName','aggreDescription',True, plants=[p1,p2])
+
+        self.assertEqual(aggr.firstActiveDate(), None)
+
         
 
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import numpy
+import threading
+
+from .mongotimecurve import hoursPerDay
+
+"""
+Builds active share curves from plant periods.
+
+Every plant contributes its shares from its first effective date
+to its last effective date, both included.
+Instead of adding each plant day by day, each period becomes
+two events (+shares on the first day, -shares after the last one)
+and the curve is the cumulative sum of the events.
+"""
+
+
+def shareCurve(periods, start, end, hourly=False):
+    """
+        Returns an array with the number of active shares for each
+        day in [start, end] given an iterable of plant periods as
+        (shares, firstEffectiveDate, lastEffectiveDate) tuples.
+
+        Periods without first date are never active.
+        Periods without last date remain active after the first one.
+
+        If hourly is True, each day is expanded to the hoursPerDay
+        slots of an hourly curve.
+    """
+    ndays = (end-start).days+1
+    events = numpy.zeros(max(ndays,0)+1, int)
+
+    firsts, lasts, shares = [], [], []
+    for nshares, first, last in periods:
+        if not first: continue
+        if last and last < first: continue
+        firstOffset = max((first-start).days, 0)
+        lastOffset = ndays if not last else min((last-start).days+1, ndays)
+        if firstOffset >= ndays or lastOffset <= 0: continue
+        firsts.append(firstOffset)
+        lasts.append(lastOffset)
+        shares.append(nshares)
+
+    shares = numpy.array(shares, int)
+    numpy.add.at(events, numpy.array(firsts, int), shares)
+    numpy.subtract.at(events, numpy.array(lasts, int), shares)
+    curve = numpy.cumsum(events)[:-1]
+
+    if hourly:
+        return numpy.repeat(curve, hoursPerDay)
+    return curve
+
+
+class ShareCurveCache(object):
+    """
+        Keeps share curves by key (ie. database and mix),
+        range and resolution. The periods are read just to
+        compute a missing curve, so the holder has to invalidate
+        the key whenever the periods change.
+        Invalidation just reaches the cache of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._curves = {}
+
+    @staticmethod
+    def _prefix(key):
+        return key if isinstance(key, tuple) else (key,)
+
+    def get(self, key, periods, start, end, hourly=False):
+        """
+            Returns a copy of the curve of the key for the range.
+            periods is a callable returning the (shares,
+            firstEffectiveDate, lastEffectiveDate) of the key,
+            called just if the curve is not cached.
+        """
+        cacheKey = self._prefix(key) + (start, end, hourly)
+        with self._lock:
+            curve = self._curves.get(cacheKey)
+        if curve is None:
+            curve = shareCurve(periods(), start, end, hourly=hourly)
+            with self._lock:
+                self._curves[cacheKey] = curve
+        return curve.copy()
+
+    def invalidate(self, *prefix):
+        """
+            Removes the curves whose key starts with the given
+            values (ie. a database, or a database and a mix),
+            or every curve if none is given.
+        """
+        with self._lock:
+            for cacheKey in list(self._curves):
+                if cacheKey[:len(prefix)] == prefix:
+                    del self._curves[cacheKey]
+
+    def clear(self):
+        self.invalidate()
+
+
+# vim: et ts=4 sw=4
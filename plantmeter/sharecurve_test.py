@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+from .sharecurve import (
+    shareCurve,
+    ShareCurveCache,
+    )
+from datetime import date
+
+import unittest
+
+
+class ShareCurve_Test(unittest.TestCase):
+
+    def test_shareCurve_noPeriods(self):
+        curve = shareCurve([], date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,0,0])
+
+    def test_shareCurve_periodCoveringRange(self):
+        curve = shareCurve([
+            (10, date(2019,1,1), date(2019,12,31)),
+            ], date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [10,10,10])
+
+    def test_shareCurve_periodInsideRange(self):
+        curve = shareCurve([
+            (10, date(2019,3,2), date(2019,3,3)),
+            ], date(2019,3,1), date(2019,3,4))
+        self.assertEqual(list(curve), [0,10,10,0])
+
+    def test_shareCurve_periodOutsideRange(self):
+        curve = shareCurve([
+            (10, date(2019,2,1), date(2019,2,28)),
+            (20, date(2019,4,1), date(2019,4,28)),
+            ], date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,0,0])
+
+    def test_shareCurve_noLastDate_remainsActive(self):
+        curve = shareCurve([
+            (10, date(2019,3,2), None),
+            ], date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,10,10])
+
+    def test_shareCurve_noFirstDate_neverActive(self):
+        curve = shareCurve([
+            (10, False, date(2019,3,2)),
+            ], date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,0,0])
+
+    def test_shareCurve_overlappingPeriods_added(self):
+        curve = shareCurve([
+            (10, date(2019,3,1), date(2019,3,2)),
+            (20, date(2019,3,2), date(2019,3,3)),
+            ], date(2019,3,1), date(2019,3,4))
+        self.assertEqual(list(curve), [10,30,20,0])
+
+    def test_shareCurve_hourly(self):
+        curve = shareCurve([
+            (10, date(2019,3,2), date(2019,3,2)),
+            ], date(2019,3,1), date(2019,3,2), hourly=True)
+        self.assertEqual(list(curve), 25*[0]+25*[10])
+
+
+class ShareCurveCache_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ShareCurveCache()
+        self.reads = []
+
+    def periods(self, *periods):
+        def read():
+            self.reads.append(periods)
+            return list(periods)
+        return read
+
+    def test_get_computesCurve(self):
+        curve = self.cache.get(('db', 'mix'), self.periods(
+            (10, date(2019,3,2), date(2019,3,3)),
+            ), date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,10,10])
+
+    def test_get_cached_periodsNotRead(self):
+        periods = self.periods((10, date(2019,3,2), date(2019,3,3)))
+        self.cache.get(('db', 'mix'), periods, date(2019,3,1), date(2019,3,3))
+        curve = self.cache.get(('db', 'mix'), periods, date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,10,10])
+        self.assertEqual(len(self.reads), 1)
+
+    def test_get_returnsCopies(self):
+        periods = self.periods((10, date(2019,3,2), date(2019,3,3)))
+        curve = self.cache.get(('db', 'mix'), periods, date(2019,3,1), date(2019,3,3))
+        curve[:] = 0
+        curve = self.cache.get(('db', 'mix'), periods, date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,10,10])
+
+    def test_get_otherRangeOrResolution_computed(self):
+        periods = self.periods((10, date(2019,3,2), date(2019,3,3)))
+        self.cache.get(('db', 'mix'), periods, date(2019,3,1), date(2019,3,3))
+        curve = self.cache.get(('db', 'mix'), periods, date(2019,3,2), date(2019,3,3))
+        self.assertEqual(list(curve), [10,10])
+        curve = self.cache.get(('db', 'mix'), periods,
+            date(2019,3,2), date(2019,3,2), hourly=True)
+        self.assertEqual(list(curve), 25*[10])
+        self.assertEqual(len(self.reads), 3)
+
+    def test_get_differentKeys_independent(self):
+        self.cache.get(('db', 'mix1'), self.periods(
+            (10, date(2019,3,2), date(2019,3,3)),
+            ), date(2019,3,1), date(2019,3,3))
+        curve = self.cache.get(('db', 'mix2'), self.periods(),
+            date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,0,0])
+
+    def test_get_changedPeriods_keptUntilInvalidated(self):
+        self.cache.get(('db', 'mix'), self.periods(
+            (10, date(2019,3,2), date(2019,3,3)),
+            ), date(2019,3,1), date(2019,3,3))
+        changed = self.periods((20, date(2019,3,2), date(2019,3,3)))
+        curve = self.cache.get(('db', 'mix'), changed, date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,10,10])
+
+        self.cache.invalidate('db', 'mix')
+
+        curve = self.cache.get(('db', 'mix'), changed, date(2019,3,1), date(2019,3,3))
+        self.assertEqual(list(curve), [0,20,20])
+
+    def test_invalidate_otherMixesKept(self):
+        self.cache.get(('db', 'mix1'), self.periods(), date(2019,3,1), date(2019,3,3))
+        self.cache.get(('db', 'mix2'), self.periods(), date(2019,3,1), date(2019,3,3))
+        self.cache.invalidate('db', 'mix1')
+        self.assertEqual(list(self.cache._curves), [
+            ('db', 'mix2', date(2019,3,1), date(2019,3,3), False),
+        ])
+
+    def test_invalidate_database(self):
+        self.cache.get(('db1', 'mix'), self.periods(), date(2019,3,1), date(2019,3,3))
+        self.cache.get(('db1', 'mix2'), self.periods(), date(2019,3,1), date(2019,3,3))
+        self.cache.get(('db2', 'mix'), self.periods(), date(2019,3,1), date(2019,3,3))
+        self.cache.invalidate('db1')
+        self.assertEqual(list(self.cache._curves), [
+            ('db2', 'mix', date(2019,3,1), date(2019,3,3), False),
+        ])
+
+    def test_clear(self):
+        self.cache.get(('db', 'mix'), self.periods(), date(2019,3,1), date(2019,3,3))
+        self.cache.clear()
+        self.assertEqual(self.cache._curves, {})
+
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import copy
+import threading
+
+from .instrumentation import nullStats
+
+"""
+Coalescing of identical concurrent calls (single-flight).
+
+When many threads ask for the same curve at once,
+just the first one computes it while the others
+wait for its result instead of repeating the query.
+Results are not kept once the computation ends,
+so this is no cache: later calls compute again.
+"""
+
+
+def freeze(value):
+    """Turns nested dicts, lists and sets into hashable equivalents"""
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    return value
+
+
+def callKey(*args, **kwds):
+    """Hashable key identifying a call by its parameters"""
+    return freeze(args), freeze(kwds)
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+        Shares a single in-flight computation among
+        the concurrent calls having the same key.
+
+        The first caller of a key computes it, and callers
+        arriving meanwhile wait for that computation.
+        Every caller receives its own deep copy of the result,
+        so that it can be modified safely.
+        If the computation fails, every waiting caller
+        gets the same exception.
+
+        An instance can be shared by several curves or resources
+        as long as their keys tell them apart.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats or nullStats
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def inFlight(self):
+        """Returns the number of keys being computed"""
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, function, *args, **kwds):
+        """
+            Returns a copy of function(*args, **kwds), or of the
+            result of the ongoing computation having the same key.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self.stats.count('singleflight', 'shared')
+            with self.stats.timed('singleflight', 'wait'):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = function(*args, **kwds)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return copy.deepcopy(call.result)
+
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+from .singleflight import SingleFlight, callKey, freeze
+from .instrumentation import CurveStats
+import threading
+import time
+import numpy
+
+import unittest
+
+
+class Freeze_Test(unittest.TestCase):
+
+    def test_freeze_scalar(self):
+        self.assertEqual(freeze('miplanta'), 'miplanta')
+
+    def test_freeze_dictsByKeyOrder(self):
+        self.assertEqual(
+            freeze(dict(b=1, a=[1, 2])),
+            freeze(dict(a=[1, 2], b=1)))
+
+    def test_freeze_isHashable(self):
+        hash(freeze(dict(name={'$in': ['a', 'b']}, types=set(['p1']))))
+
+    def test_callKey_differentParameters(self):
+        self.assertNotEqual(
+            callKey('get', dict(name='a')),
+            callKey('get', dict(name='b')))
+
+
+class SingleFlight_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = CurveStats()
+        self.flight = SingleFlight(self.stats)
+        self.gate = threading.Event()
+        self.calls = []
+
+    def slowCompute(self, value):
+        self.calls.append(value)
+        self.gate.wait(2)
+        return numpy.array([value, value])
+
+    def startCalls(self, key, value, n):
+        results = []
+        def call():
+            results.append(self.flight.do(key, self.slowCompute, value))
+        threads = [threading.Thread(target=call) for i in range(n)]
+        for thread in threads: thread.start()
+        return threads, results
+
+    def waitShared(self, n):
+        start = time.time()
+        while (self.stats.counters.get(('singleflight', 'shared'), 0) < n
+                and time.time() - start < 2):
+            time.sleep(0.005)
+
+    def test_do_single(self):
+        self.gate.set()
+        result = self.flight.do('key', self.slowCompute, 3)
+        self.assertEqual(list(result), [3, 3])
+        self.assertEqual(self.flight.inFlight(), 0)
+
+    def test_do_concurrentSameKey_computedOnce(self):
+        threads, results = self.startCalls('key', 3, 4)
+        self.waitShared(3)
+        self.gate.set()
+        for thread in threads: thread.join(2)
+        self.assertEqual(self.calls, [3])
+        self.assertEqual([list(x) for x in results], 4*[[3, 3]])
+        self.assertEqual(self.stats.counters[('singleflight', 'shared')], 3)
+        self.assertEqual(self.flight.inFlight(), 0)
+
+    def test_do_concurrentSameKey_resultsAreCopies(self):
+        threads, results = self.startCalls('key', 3, 2)
+        self.waitShared(1)
+        self.gate.set()
+        for thread in threads: thread.join(2)
+        results[0][0] = 10
+        self.assertEqual(list(results[1]), [3, 3])
+
+    def test_do_differentKeys_computedEach(self):
+        threads1, results1 = self.startCalls('key1', 1, 1)
+        threads2, results2 = self.startCalls('key2', 2, 1)
+        self.gate.set()
+        for thread in threads1+threads2: thread.join(2)
+        self.assertEqual(sorted(self.calls), [1, 2])
+
+    def test_do_sequentialCalls_computedEach(self):
+        self.gate.set()
+        self.flight.do('key', self.slowCompute, 1)
+        self.flight.do('key', self.slowCompute, 1)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_do_failure_raisedToEveryCaller(self):
+        errors = []
+        def fail():
+            self.gate.wait(2)
+            raise IOError("Connection lost")
+        def call():
+            try:
+                self.flight.do('key', fail)
+            except IOError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call) for i in range(3)]
+        for thread in threads: thread.start()
+        self.waitShared(2)
+        self.gate.set()
+        for thread in threads: thread.join(2)
+        self.assertEqual([str(e) for e in errors], 3*["Connection lost"])
+        self.assertEqual(self.flight.inFlight(), 0)
+
+
+# vim: et ts=4 sw=4
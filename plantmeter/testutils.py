@@ -34,16 +34,155 @@ def assertNsEqual(self, dict1, dict2):
     return self.assertMultiLineEqual(dict1.dump(), dict2.dump())
 
 
-def _inProduction():
+productionEnvironment = 'PLANTMETER_PRODUCTION'
+productionTimeoutEnvironment = 'PLANTMETER_PRODUCTION_TIMEOUT'
+productionTimeout = 2.
+
+_production = None
+
+
+mongoEnvironment = 'PLANTMETER_TEST_MONGO'
+mongoDefault = 'mongodb://localhost'
+mongoDatabase = 'generationkwh_test'
+
+_mongoClient = None
+
+
+def mongoBackend():
+    """
+    Mongo backend for the tests, taken from PLANTMETER_TEST_MONGO.
+    Either a mongo uri or 'mongomock' for an in-memory one.
+    """
+    import os
+    return os.environ.get(mongoEnvironment) or mongoDefault
+
+
+def usingMongomock():
+    return mongoBackend() == 'mongomock'
+
+
+def mongoClient():
+    """Process wide client for the configured test backend"""
+    global _mongoClient
+    if _mongoClient is None:
+        backend = mongoBackend()
+        if backend == 'mongomock':
+            import mongomock
+            _mongoClient = mongomock.MongoClient()
+        else:
+            import pymongo
+            _mongoClient = pymongo.MongoClient(backend)
+    return _mongoClient
+
+
+def testDatabaseName(base=mongoDatabase):
+    """
+    Database name unique for the process, so that concurrent runs
+    and pytest-xdist workers do not clear each other databases.
+    """
+    import os
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+    return '{}_{}_{}'.format(base, worker, os.getpid())
+
+
+def setUpMongo(testcase, base=mongoDatabase):
+    """
+    Sets a clean testcase.db, dropped when the test ends,
+    and testcase.databasename.
+    """
+    client = mongoClient()
+    testcase.databasename = testDatabaseName(base)
+    client.drop_database(testcase.databasename)
+    testcase.addCleanup(client.drop_database, testcase.databasename)
+    testcase.db = client[testcase.databasename]
+    return testcase.db
+
+
+def skipIfMongomock(testcase, reason):
+    if usingMongomock():
+        testcase.skipTest("Not supported by mongomock: " + reason)
+
+
+def _inSomEnergiaNetwork():
     import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(("8.8.8.8", 80))
-    return 'somenergia' in socket.gethostbyaddr(s.getsockname()[0])[0].split('.')
+    try:
+        s.connect(("8.8.8.8", 80))
+        return 'somenergia' in socket.gethostbyaddr(s.getsockname()[0])[0].split('.')
+    finally:
+        s.close()
+
+
+def _detectProduction(timeout):
+    """
+    Runs the network based detection with a bounded time.
+    Returns None if it fails or does not end in time.
+    """
+    import threading
+    result = []
+    def detect():
+        try:
+            result.append(_inSomEnergiaNetwork())
+        except Exception:
+            pass
+    thread = threading.Thread(target=detect)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def _inProduction():
+    """
+    Tells whether we are in a production setup.
+
+    The PLANTMETER_PRODUCTION environment variable decides it
+    without touching the network (1/yes/true or 0/no/false).
+    Otherwise the host domain is looked up, waiting at most
+    PLANTMETER_PRODUCTION_TIMEOUT seconds.
+    When it cannot be told, it is considered production to be safe.
+    The result is computed once, on first use.
+    """
+    global _production
+    if _production is not None:
+        return _production
+    import os
+    value = os.environ.get(productionEnvironment, '').strip().lower()
+    if value in ('1', 'yes', 'true'):
+        _production = True
+    elif value in ('0', 'no', 'false'):
+        _production = False
+    else:
+        timeout = float(os.environ.get(
+            productionTimeoutEnvironment, productionTimeout))
+        _production = _detectProduction(timeout) is not False
+    return _production
 
 
 def destructiveTest(decorated):
-    return unittest.skipIf(_inProduction(),
-                           "Destructive test being run in a production setup!!")(decorated)
+    """
+    Skips the decorated test function or test case
+    when it is run in a production setup.
+    Production is checked when the test runs, not on import.
+    """
+    import functools
+    reason = "Destructive test being run in a production setup!!"
+
+    if isinstance(decorated, type):
+        setUpClass = decorated.setUpClass.__func__
+        def guardedSetUpClass(cls):
+            if _inProduction():
+                raise unittest.SkipTest(reason)
+            setUpClass(cls)
+        decorated.setUpClass = classmethod(guardedSetUpClass)
+        return decorated
+
+    @functools.wraps(decorated)
+    def guarded(*args, **kwds):
+        if _inProduction():
+            raise unittest.SkipTest(reason)
+        return decorated(*args, **kwds)
+    return guarded
 
 
 # vim: ts=4 sw=4 et
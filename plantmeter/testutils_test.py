@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+from . import testutils
+from .testutils import destructiveTest
+
+import os
+import threading
+import unittest
+import mock
+
+
+class DestructiveTest_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ)
+        self.env.start()
+        os.environ.pop(testutils.productionEnvironment, None)
+        os.environ.pop(testutils.productionTimeoutEnvironment, None)
+        self.production = mock.patch.object(testutils, '_production', None)
+        self.production.start()
+        self.network = mock.patch.object(testutils, '_inSomEnergiaNetwork',
+            side_effect=AssertionError("Network accessed"))
+        self.lookup = self.network.start()
+
+    def tearDown(self):
+        self.network.stop()
+        self.production.stop()
+        self.env.stop()
+
+    def run_(self, testcase):
+        result = unittest.TestResult()
+        unittest.defaultTestLoader.loadTestsFromTestCase(testcase).run(result)
+        return result
+
+    def test_inProduction_fromEnvironment(self):
+        os.environ[testutils.productionEnvironment] = 'yes'
+        self.assertEqual(testutils._inProduction(), True)
+        self.assertEqual(self.lookup.call_count, 0)
+
+    def test_inProduction_notFromEnvironment(self):
+        os.environ[testutils.productionEnvironment] = '0'
+        self.assertEqual(testutils._inProduction(), False)
+        self.assertEqual(self.lookup.call_count, 0)
+
+    def test_inProduction_detected(self):
+        self.lookup.side_effect = None
+        self.lookup.return_value = False
+        self.assertEqual(testutils._inProduction(), False)
+
+    def test_inProduction_cached(self):
+        self.lookup.side_effect = None
+        self.lookup.return_value = False
+        testutils._inProduction()
+        testutils._inProduction()
+        self.assertEqual(self.lookup.call_count, 1)
+
+    def test_inProduction_failingDetection_assumesProduction(self):
+        self.lookup.side_effect = IOError("Network unreachable")
+        self.assertEqual(testutils._inProduction(), True)
+
+    def test_detectProduction_slowDetection_timesOut(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        self.lookup.side_effect = gate.wait
+        self.assertEqual(testutils._detectProduction(0.05), None)
+
+    def test_inProduction_slowDetection_consideredProduction(self):
+        os.environ[testutils.productionTimeoutEnvironment] = '0.05'
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        self.lookup.side_effect = gate.wait
+        self.assertEqual(testutils._inProduction(), True)
+
+    def test_destructiveTest_decorationIsLazy(self):
+        @destructiveTest
+        class Destructive(unittest.TestCase):
+            def test(self): pass
+        @destructiveTest
+        def test(): pass
+        self.assertEqual(self.lookup.call_count, 0)
+
+    def test_destructiveTest_class_inProduction_skipped(self):
+        os.environ[testutils.productionEnvironment] = '1'
+        calls = []
+        @destructiveTest
+        class Destructive(unittest.TestCase):
+            @classmethod
+            def setUpClass(cls): calls.append('setUpClass')
+            def test(self): calls.append('test')
+        result = self.run_(Destructive)
+        self.assertEqual(calls, [])
+        self.assertEqual(len(result.skipped), 1)
+
+    def test_destructiveTest_class_notInProduction_run(self):
+        os.environ[testutils.productionEnvironment] = '0'
+        calls = []
+        @destructiveTest
+        class Destructive(unittest.TestCase):
+            @classmethod
+            def setUpClass(cls): calls.append(cls.__name__)
+            def test(self): calls.append('test')
+        result = self.run_(Destructive)
+        self.assertEqual(calls, ['Destructive', 'test'])
+        self.assertEqual(result.skipped, [])
+
+    def test_destructiveTest_function_inProduction_skipped(self):
+        os.environ[testutils.productionEnvironment] = '1'
+        @destructiveTest
+        def test(): return 'run'
+        with self.assertRaises(unittest.SkipTest):
+            test()
+
+    def test_destructiveTest_function_notInProduction_run(self):
+        os.environ[testutils.productionEnvironment] = '0'
+        @destructiveTest
+        def test(): return 'run'
+        self.assertEqual(test(), 'run')
+
+
+class MongoFixture_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ)
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_testDatabaseName_perWorker(self):
+        os.environ['PYTEST_XDIST_WORKER'] = 'gw3'
+        self.assertEqual(testutils.testDatabaseName('base'),
+            'base_gw3_{}'.format(os.getpid()))
+
+    def test_testDatabaseName_noWorker(self):
+        os.environ.pop('PYTEST_XDIST_WORKER', None)
+        self.assertEqual(testutils.testDatabaseName('base'),
+            'base_main_{}'.format(os.getpid()))
+
+    def test_mongoBackend_default(self):
+        os.environ.pop(testutils.mongoEnvironment, None)
+        self.assertEqual(testutils.mongoBackend(), 'mongodb://localhost')
+        self.assertEqual(testutils.usingMongomock(), False)
+
+    def test_mongoBackend_mongomock(self):
+        os.environ[testutils.mongoEnvironment] = 'mongomock'
+        self.assertEqual(testutils.usingMongomock(), True)
+
+    def test_setUpMongo_cleanDatabase_droppedOnCleanup(self):
+        class Fixtured(unittest.TestCase):
+            def setUp(self):
+                testutils.setUpMongo(self)
+            def test(self):
+                self.db.things.insert_one(dict(a=1))
+                Fixtured.databasename = self.databasename
+                Fixtured.count = self.db.things.count_documents({})
+
+        result = unittest.TestResult()
+        unittest.defaultTestLoader.loadTestsFromTestCase(Fixtured).run(result)
+        self.assertEqual(result.errors+result.failures, [])
+        self.assertEqual(Fixtured.count, 1)
+        self.assertEqual(Fixtured.databasename, testutils.testDatabaseName())
+        self.assertNotIn(Fixtured.databasename,
+            testutils.mongoClient().list_database_names())
+
+
+# vim: et ts=4 sw=4
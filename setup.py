@@ -13,9 +13,14 @@ with open('requirements-dev.txt') as f:
 with open('README.md') as f:
     readme = f.read()
 
+# Not importing the package, which requires the dependencies
+version = {}
+with open('plantmeter/_version.py') as f:
+    exec(f.read(), version)
+
 setup(
     name = "plantmeter",
-    version = "1.7.12",
+    version = version['__version__'],
     description =
         "OpenERP module and library to manage multisite energy generation",
     author = "Som Energia SCCL",
@@ -26,6 +31,13 @@ setup(
     license = 'GNU General Public License v3 or later (GPLv3+)',
     packages=find_packages(exclude=['*[tT]est*']),
     include_package_data = True,
+    entry_points = {
+        'console_scripts': [
+            'plantmeter_compact=plantmeter.compact:main',
+            'plantmeter_backfill=plantmeter.backfill:main',
+            'plantmeter_import=plantmeter.curvefile:main',
+        ],
+    },
     install_requires=INSTALL_REQUIRES,
     setup_requires=["pytest-runner"],
     tests_require=TEST_REQUIRES,
@@ -11,6 +11,7 @@
   "update_xml": [
     "security/som_plantmeter.xml",
     "security/ir.model.access.csv",
+    "som_plantmeter_data.xml",
     ],
   "active": False,
   "installable": True
@@ -10,8 +10,38 @@ from yamlns import namespace as ns
 from datetime import datetime
 from plantmeter.resource import ProductionAggregator, ProductionPlant, ProductionMeter
 from plantmeter.mongotimecurve import MongoTimeCurve, toLocal, asUtc
+from plantmeter.sharecurve import ShareCurveCache
+from plantmeter.singleflight import SingleFlight
 from somutils.isodates import isodate, localisodate
 
+# Identical concurrent get_kwh calls, frequent when a new month
+# is published, share a single computation among the trees
+# built for each call. One by database, since resource ids
+# are just unique within a database.
+_singleFlights = {}
+
+def singleFlight(dbname):
+    if dbname not in _singleFlights:
+        _singleFlights.setdefault(dbname, SingleFlight())
+    return _singleFlights[dbname]
+
+# Meter curves, and the first and last timestamp of each meter,
+# widened by every write done through MongoTimeCurve, so that
+# measurement dates need no sorted finds on the curves.
+# Curves imported by other tools are not seen there until the
+# reconcileMeasurementDates cron job runs (see the data xml).
+curveCollection = 'tm_profile'
+datesCollection = 'tm_profile_dates'
+
+def curveProvider(singleFlight=None):
+    return MongoTimeCurve(mdbpool.get_db(),
+                          curveCollection,
+                          creationField='create_date',
+                          timestampField='utc_gkwh_timestamp',
+                          datesCollection=datesCollection,
+                          singleFlight=singleFlight,
+                          )
+
 
 class GenerationkwhProductionAggregator(osv.osv):
     """
@@ -67,39 +97,91 @@ class GenerationkwhProductionAggregator(osv.osv):
         date = _aggr.lastMeasurementDate()
         return date if date else None
 
+    def _invalidateShareCurves(self, cursor, uid, ids):
+        for mix in self.read(cursor, uid, ids, ['name']):
+            PlantShareProvider._shareCurves.invalidate(
+                cursor.dbname, mix['name'])
+
+    def create(self, cursor, uid, vals, context=None):
+        # Curves are cached by mix name, maybe of a former mix
+        PlantShareProvider._shareCurves.invalidate(
+            cursor.dbname, vals.get('name'))
+        return super(GenerationkwhProductionAggregator, self).create(
+            cursor, uid, vals, context)
+
+    def write(self, cursor, uid, ids, vals, context=None):
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+        if 'name' in vals:
+            self._invalidateShareCurves(cursor, uid, ids)
+        return super(GenerationkwhProductionAggregator, self).write(
+            cursor, uid, ids, vals, context)
+
+    def unlink(self, cursor, uid, ids, context=None):
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+        self._invalidateShareCurves(cursor, uid, ids)
+        return super(GenerationkwhProductionAggregator, self).unlink(
+            cursor, uid, ids, context)
+
+    def reconcileMeasurementDates(self, cursor, uid, context=None):
+        '''Rebuild the measurement dates from the meter curves'''
+
+        # Run by cron, since curves imported by other tools
+        # do not update the dates
+        return curveProvider().reconcileDates()
+
     def _createAggregator(self, cursor, uid, mix_id):
-        def extract_attrs(obj, attrs):
-            # extracts name value tuples from erp browse object
-            return {attr: getattr(obj, attr) for attr in attrs}
+        def extract_attrs(record, attrs):
+            # extracts name value tuples from erp read dict
+            return {attr: record[attr] for attr in attrs}
 
         if isinstance(mix_id, list) or isinstance(mix_id, tuple):
             mix_id = mix_id[0]
 
-        aggr = self.browse(cursor, uid, mix_id)
-        curveProvider = MongoTimeCurve(mdbpool.get_db(),
-                                       'tm_profile',
-                                       creationField='create_date',
-                                       timestampField='utc_gkwh_timestamp',
-                                       )
+        Plant = self.pool.get('generationkwh.production.plant')
+        Meter = self.pool.get('generationkwh.production.meter')
 
-        # TODO: Clean initialization method
+        # Bulk reads instead of browse traversal,
+        # so the number of queries does not depend on the tree size
         args = ['id', 'name', 'description', 'enabled']
+        resourceArgs = args + ['first_active_date']
+        aggr = self.read(cursor, uid, mix_id, args)
+        plant_ids = Plant.search(cursor, uid, [
+            ('aggr_id', '=', mix_id),
+            ('enabled', '=', True),
+        ])
+        plantArgs = resourceArgs + ['last_active_date']
+        plants = Plant.read(cursor, uid, plant_ids, plantArgs)
+        meter_ids = Meter.search(cursor, uid, [
+            ('plant_id', 'in', plant_ids),
+            ('enabled', '=', True),
+        ]) if plant_ids else []
+        meters = Meter.read(cursor, uid, meter_ids, resourceArgs+['plant_id'])
+
+        plantMeters = dict((plant_id, []) for plant_id in plant_ids)
+        for meter in meters:
+            plantMeters[meter['plant_id'][0]].append(meter)
+
+        flight = singleFlight(cursor.dbname)
+        meterCurves = curveProvider(flight)
+
         return ProductionAggregator(**dict(
             extract_attrs(aggr, args),
+            singleFlight=flight,
             plants=[
                 ProductionPlant(**dict(
-                    extract_attrs(plant, args+['first_active_date']),
+                    extract_attrs(plant, plantArgs),
+                    singleFlight=flight,
                     meters=[
                         ProductionMeter(
-                            curveProvider=curveProvider,
-                            **extract_attrs(meter, args + ['first_active_date'])
+                            curveProvider=meterCurves,
+                            **extract_attrs(meter, resourceArgs)
                         )
-                        for meter in plant.meters
-                        if meter.enabled
+                        for meter in plantMeters[plant['id']]
                     ],
                 ))
-                for plant in aggr.plants
-                if plant.enabled
+                for plant in plants
             ],
         ))
 
@@ -128,6 +210,50 @@ class GenerationkwhProductionPlant(osv.osv):
         'enabled': lambda *a: False,
     }
 
+    # Plant fields the share curves of the mixes are built from
+    _shareFields = ['nshares', 'first_active_date', 'last_active_date', 'aggr_id']
+
+    def _mixIds(self, cursor, uid, ids):
+        return set(
+            plant['aggr_id'][0]
+            for plant in self.read(cursor, uid, ids, ['aggr_id'])
+            if plant['aggr_id']
+        )
+
+    def _invalidateShareCurves(self, cursor, uid, mix_ids):
+        Mix = self.pool.get('generationkwh.production.aggregator')
+        Mix._invalidateShareCurves(cursor, uid, list(mix_ids))
+
+    def create(self, cursor, uid, vals, context=None):
+        plant_id = super(GenerationkwhProductionPlant, self).create(
+            cursor, uid, vals, context)
+        self._invalidateShareCurves(cursor, uid,
+            self._mixIds(cursor, uid, [plant_id]))
+        return plant_id
+
+    def write(self, cursor, uid, ids, vals, context=None):
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+        if not any(field in vals for field in self._shareFields):
+            return super(GenerationkwhProductionPlant, self).write(
+                cursor, uid, ids, vals, context)
+        mix_ids = self._mixIds(cursor, uid, ids)
+        result = super(GenerationkwhProductionPlant, self).write(
+            cursor, uid, ids, vals, context)
+        if 'aggr_id' in vals:
+            mix_ids |= self._mixIds(cursor, uid, ids)
+        self._invalidateShareCurves(cursor, uid, mix_ids)
+        return result
+
+    def unlink(self, cursor, uid, ids, context=None):
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+        mix_ids = self._mixIds(cursor, uid, ids)
+        result = super(GenerationkwhProductionPlant, self).unlink(
+            cursor, uid, ids, context)
+        self._invalidateShareCurves(cursor, uid, mix_ids)
+        return result
+
 
 GenerationkwhProductionPlant()
 
@@ -160,6 +286,10 @@ class PlantShareProvider(ErpWrapper):
     the curves to represent the share value of the active built plants.
     """
 
+    # Shared among instances, providers are built on every erp call.
+    # Keyed by database and mix, plant changes invalidate it.
+    _shareCurves = ShareCurveCache()
+
     def __init__(self, erp, cursor, uid, mixname, context=None):
         self.mixname = mixname
         super(PlantShareProvider, self).__init__(erp, cursor, uid, context)
@@ -187,6 +317,21 @@ class PlantShareProvider(ErpWrapper):
             for plant in plants
         ]
 
+    def shareCurve(self, start, end, hourly=False):
+        """
+        Returns an array with the active shares of the mix for each
+        day in [start, end], or each hour slot if hourly is True.
+        The curve is cached until the plants of the mix change.
+        """
+        return self._shareCurves.get((self.cursor.dbname, self.mixname),
+            self._periods, start, end, hourly=hourly)
+
+    def _periods(self):
+        return [
+            (item.shares, item.firstEffectiveDate, item.lastEffectiveDate)
+            for item in self.items()
+        ]
+
 
 class GenerationkwhProductionMeasurement(osv_mongodb.osv_mongodb):
 
@@ -260,12 +405,7 @@ class GenerationkwhProductionAggregatorTesthelper(osv.osv):
             mdbpool.get_db().drop_collection(collection)
 
     def fillMeasurements(self, cursor, uid, first_date, meter_name, values):
-        curveProvider = MongoTimeCurve(mdbpool.get_db(),
-                                       'tm_profile',
-                                       creationField='create_date',
-                                       timestampField='utc_gkwh_timestamp',
-                                       )
-        curveProvider.update(
+        curveProvider().update(
             start=localisodate(first_date),
             filter=meter_name,
             field='ae',
@@ -273,12 +413,7 @@ class GenerationkwhProductionAggregatorTesthelper(osv.osv):
         )
 
     def fillMeasurementPoint(self, cursor, uid, pointTime, name, value, context=None):
-        curveProvider = MongoTimeCurve(mdbpool.get_db(),
-                                       'tm_profile',
-                                       creationField='create_date',
-                                       timestampField='utc_gkwh_timestamp',
-                                       )
-        curveProvider.fillPoint(
+        curveProvider().fillPoint(
             datetime=toLocal(asUtc(datetime.strptime(
                 pointTime, "%Y-%m-%d %H:%M:%S"))),
             name=name,
@@ -295,6 +430,11 @@ class GenerationkwhProductionAggregatorTesthelper(osv.osv):
             for item in provider.items()
         ]
 
+    def plantShareCurve(self, cursor, uid, mixname, start, end, hourly=False):
+        provider = PlantShareProvider(self, cursor, uid, mixname, context={})
+        return provider.shareCurve(
+            isodate(start), isodate(end), hourly=hourly).tolist()
+
 
 GenerationkwhProductionAggregatorTesthelper()
 
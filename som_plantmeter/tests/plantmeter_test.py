@@ -9,6 +9,7 @@ from yamlns import namespace as ns
 from destral import testing
 from destral.transaction import Transaction
 import tempfile
+import mock
 
 
 def localTime(string):
@@ -150,6 +151,126 @@ class PlantShareProvider_Test(testing.OOTestCase):
               lastEffectiveDate: '2019-03-03'
         """)
 
+    def test_shareCurve_withManyPlants(self):
+        self.setupMix('testmix', [
+            dict(
+                name='plant1',
+                nshares=10,
+                first_active_date='2019-03-02',
+                last_active_date='2019-03-03',
+                meters=[]
+            ),
+            dict(
+                name='plant2',
+                nshares=20,
+                first_active_date='2019-03-03',
+                last_active_date='2019-03-04',
+                meters=[]
+            ),
+        ])
+        curve = self.helper.plantShareCurve(self.cursor, self.uid, 'testmix',
+            '2019-03-01', '2019-03-05')
+
+        self.assertEqual(curve, [0, 10, 30, 20, 0])
+
+    def test_shareCurve_changedShares_rebuilt(self):
+        mix_id, (plant_id,) = self.setupMix('testmix', [
+            dict(
+                name='plant1',
+                nshares=10,
+                first_active_date='2019-03-02',
+                last_active_date='2019-03-03',
+                meters=[]
+            ),
+        ])
+        self.helper.plantShareCurve(self.cursor, self.uid, 'testmix',
+            '2019-03-01', '2019-03-03')
+        self.Plant.write(self.cursor, self.uid, plant_id, dict(nshares=30))
+
+        curve = self.helper.plantShareCurve(self.cursor, self.uid, 'testmix',
+            '2019-03-01', '2019-03-03')
+
+        self.assertEqual(curve, [0, 30, 30])
+
+    def setupPlant(self, **plant):
+        return self.setupMix('testmix', [dict(dict(
+                name='plant1',
+                nshares=10,
+                first_active_date='2019-03-02',
+                last_active_date='2019-03-03',
+                meters=[]
+            ), **plant)])
+
+    def shareCurve(self, mixname='testmix'):
+        return self.helper.plantShareCurve(self.cursor, self.uid, mixname,
+            '2019-03-01', '2019-03-03')
+
+    def plantReads(self, method, *args):
+        with mock.patch.object(self.Plant, 'read',
+                wraps=self.Plant.read) as read:
+            result = method(*args)
+        return result, read.call_count
+
+    def test_shareCurve_cached_plantsNotRead(self):
+        self.setupPlant()
+        self.shareCurve()
+
+        curve, reads = self.plantReads(self.shareCurve)
+
+        self.assertEqual(curve, [0, 10, 10])
+        self.assertEqual(reads, 0)
+
+    def test_shareCurve_otherPlantField_kept(self):
+        mix_id, (plant_id,) = self.setupPlant()
+        self.shareCurve()
+        self.Plant.write(self.cursor, self.uid, plant_id,
+            dict(description='changed'))
+
+        curve, reads = self.plantReads(self.shareCurve)
+
+        self.assertEqual(curve, [0, 10, 10])
+        self.assertEqual(reads, 0)
+
+    def test_shareCurve_changedDates_rebuilt(self):
+        mix_id, (plant_id,) = self.setupPlant()
+        self.shareCurve()
+        self.Plant.write(self.cursor, self.uid, plant_id,
+            dict(last_active_date='2019-03-02'))
+
+        self.assertEqual(self.shareCurve(), [0, 10, 0])
+
+    def test_shareCurve_newPlant_rebuilt(self):
+        mix_id, (plant_id,) = self.setupPlant()
+        self.shareCurve()
+        self.Plant.create(self.cursor, self.uid, dict(
+            name='plant2',
+            description='plant2 description',
+            aggr_id=mix_id,
+            enabled=True,
+            nshares=20,
+            first_active_date='2019-03-01',
+        ))
+
+        self.assertEqual(self.shareCurve(), [20, 30, 30])
+
+    def test_shareCurve_removedPlant_rebuilt(self):
+        mix_id, (plant_id,) = self.setupPlant()
+        self.shareCurve()
+        self.Plant.unlink(self.cursor, self.uid, [plant_id])
+
+        self.assertEqual(self.shareCurve(), [0, 0, 0])
+
+    def test_shareCurve_plantMovedToOtherMix_bothRebuilt(self):
+        mix_id, (plant_id,) = self.setupPlant()
+        other_id, plants = self.setupMix('othermix')
+        self.shareCurve()
+        self.shareCurve('othermix')
+        self.Plant.write(self.cursor, self.uid, plant_id,
+            dict(aggr_id=other_id))
+
+        self.assertEqual(self.shareCurve(), [0, 0, 0])
+        self.assertEqual(self.shareCurve('othermix'), [0, 10, 10])
+
 
 @destructiveTest
 class GenerationkwhProductionAggregator_Test(testing.OOTestCase):
@@ -161,6 +282,7 @@ class GenerationkwhProductionAggregator_Test(testing.OOTestCase):
 
         self.maxDiff = None
         self.collection = 'tm_profile'
+        self.datesCollection = 'tm_profile_dates'
 
         self.helper = self.openerp.pool.get(
             'generationkwh.production.aggregator.testhelper')
@@ -194,6 +316,7 @@ class GenerationkwhProductionAggregator_Test(testing.OOTestCase):
     def clearMeasurements(self):
         self.helper.clear_mongo_collections(self.cursor, self.uid, [
             self.collection,
+            self.datesCollection,
         ])
 
     def clearTemp(self):
@@ -274,6 +397,91 @@ class GenerationkwhProductionAggregator_Test(testing.OOTestCase):
                     ), values)
             ])
 
+    def countQueries(self, method, *args):
+        with mock.patch.object(self.cursor, 'execute',
+                wraps=self.cursor.execute) as execute:
+            method(*args)
+        return execute.call_count
+
+    def test_createAggregator_buildsTree(self):
+        aggr, meters = self.setupAggregator(
+            nplants=2,
+            nmeters=2)
+        aggr_id = aggr.read(['id'])[0]['id']
+
+        mix = self.aggr_obj._createAggregator(self.cursor, self.uid, aggr_id)
+
+        self.assertEqual(mix.name, 'myaggr')
+        self.assertEqual(
+            [(plant.name, [meter.name for meter in plant.children])
+                for plant in mix.children], [
+            ('myplant0', ['mymeter00', 'mymeter01']),
+            ('myplant1', ['mymeter10', 'mymeter11']),
+        ])
+
+    def test_createAggregator_skipsDisabled(self):
+        aggr, meters = self.setupAggregator(
+            nplants=2,
+            nmeters=2)
+        aggr_id = aggr.read(['id'])[0]['id']
+        self.meter_obj.write(self.cursor, self.uid, meters[1].id,
+            dict(enabled=False))
+        self.plant_obj.write(self.cursor, self.uid, meters[2].plant_id.id,
+            dict(enabled=False))
+
+        mix = self.aggr_obj._createAggregator(self.cursor, self.uid, aggr_id)
+
+        self.assertEqual(
+            [(plant.name, [meter.name for meter in plant.children])
+                for plant in mix.children], [
+            ('myplant0', ['mymeter00']),
+        ])
+
+    def test_createAggregator_treesShareSingleFlight(self):
+        aggr, meters = self.setupAggregator(
+            nplants=1,
+            nmeters=1)
+        aggr_id = aggr.read(['id'])[0]['id']
+
+        mix1 = self.aggr_obj._createAggregator(self.cursor, self.uid, aggr_id)
+        mix2 = self.aggr_obj._createAggregator(self.cursor, self.uid, aggr_id)
+
+        self.assertIsNotNone(mix1.singleFlight)
+        self.assertIs(mix1.singleFlight, mix2.singleFlight)
+        self.assertIs(mix1.children[0].singleFlight, mix2.singleFlight)
+        self.assertIs(
+            mix1.children[0].children[0].curveProvider.singleFlight,
+            mix2.singleFlight)
+
+    def test_createAggregator_keepsMeasurementDates(self):
+        aggr, meters = self.setupAggregator(
+            nplants=1,
+            nmeters=1)
+        aggr_id = aggr.read(['id'])[0]['id']
+
+        mix = self.aggr_obj._createAggregator(self.cursor, self.uid, aggr_id)
+
+        curveProvider = mix.children[0].children[0].curveProvider
+        self.assertEqual(curveProvider.dates.name, self.datesCollection)
+
+    def test_createAggregator_queriesIndependentOfSize(self):
+        aggr, meters = self.setupAggregator(
+            nplants=1,
+            nmeters=1)
+        aggr_id = aggr.read(['id'])[0]['id']
+        small = self.countQueries(self.aggr_obj._createAggregator,
+            self.cursor, self.uid, aggr_id)
+
+        self.clearAggregator()
+        aggr, meters = self.setupAggregator(
+            nplants=3,
+            nmeters=4)
+        aggr_id = aggr.read(['id'])[0]['id']
+        big = self.countQueries(self.aggr_obj._createAggregator,
+            self.cursor, self.uid, aggr_id)
+
+        self.assertEqual(big, small)
+
     def test_get_kwh_onePlant_withNoPoints(self):
         aggr, meters = self.setupAggregator(
             nplants=1,
@@ -593,5 +801,33 @@ class GenerationkwhProductionAggregator_Test(testing.OOTestCase):
         date = self.helper.lastMeasurementDate(self.cursor, self.uid, aggr_id)
         self.assertEqual(date, '2015-08-16')
 
+    def test_lastMeasurementDate_externalImport_seenAfterReconcile(self):
+        from plantmeter.mongotimecurve import MongoTimeCurve
+        from mongodb_backend.mongodb2 import mdbpool
+        aggr, meters = self.setupAggregator(
+            nplants=1,
+            nmeters=1)
+        aggr_id = aggr.read(['id'])[0]['id']
+        self.fillMeter('mymeter00', [
+            ('2015-08-16', 10*[0]+14*[10]),
+        ])
+        external = MongoTimeCurve(mdbpool.get_db(), self.collection,
+            creationField='create_date',
+            timestampField='utc_gkwh_timestamp',
+            )
+        external.update(
+            start=localisodate('2015-08-17'),
+            filter='mymeter00',
+            field='ae',
+            data=10*[0]+14*[10],
+            )
+        date = self.helper.lastMeasurementDate(self.cursor, self.uid, aggr_id)
+        self.assertEqual(date, '2015-08-16')
+
+        self.aggr_obj.reconcileMeasurementDates(self.cursor, self.uid)
+
+        date = self.helper.lastMeasurementDate(self.cursor, self.uid, aggr_id)
+        self.assertEqual(date, '2015-08-17')
+
 
 # vim: et ts=4 sw=4